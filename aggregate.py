@@ -0,0 +1,98 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Counters of the collected sockets, for the summary screen
+"""
+
+import heapq
+import itertools
+import operator
+import socket
+
+from sockettable import NO_UID
+
+TCP_TIME_WAIT = 6
+
+# Entries of the ranked views
+TOP_COUNT = 20
+
+
+def top(counter, count=TOP_COUNT):
+    """
+    Rank the entries of a counter
+
+    Returns:
+    Return the count (key, number) with the highest numbers, the
+    highest first
+    """
+    return heapq.nlargest(count, counter.iteritems(),
+                          key=operator.itemgetter(1))
+
+
+class Summary:
+    """
+    Number of sockets per state, remote host, local port and user
+
+    The counters are built in one pass over the integer columns of the
+    tables, the keys are the raw values: state numbers, ips as
+    SocketTable.address() returns them, ports and uids.
+
+    Arguments:
+    tables -- List of SocketTable, as returned by NetStat.collect()
+    """
+
+    def __init__(self, tables):
+        self.total = 0
+        self.states = {}
+        # Connections per remote ip, the listeners excluded
+        self.remote_hosts = {}
+        self.local_ports = {}
+        self.time_wait_ports = {}
+        self.users = {}
+
+        for table in tables:
+            self.add(table)
+
+    def add(self, table):
+        """
+        Count the sockets of a SocketTable
+        """
+        self.total += len(table)
+        states = self.states
+
+        if table.family == socket.AF_UNIX:
+            for state in table.state:
+                states[state] = states.get(state, 0) + 1
+            return
+
+        hosts = self.remote_hosts
+        ports = self.local_ports
+        time_wait = self.time_wait_ports
+        users = self.users
+
+        for state, local_port, rem_ip, rem_port, uid in itertools.izip(
+                table.state, table.local_port,
+                table.addresses(table.rem_ip), table.rem_port, table.uid):
+            states[state] = states.get(state, 0) + 1
+            ports[local_port] = ports.get(local_port, 0) + 1
+            if rem_port:
+                hosts[rem_ip] = hosts.get(rem_ip, 0) + 1
+            if state == TCP_TIME_WAIT:
+                time_wait[local_port] = time_wait.get(local_port, 0) + 1
+            if uid != NO_UID:
+                users[uid] = users.get(uid, 0) + 1
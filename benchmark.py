@@ -0,0 +1,805 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Benchmarks for the netpath collectors
+
+Use as: python benchmark.py parser [--lines 100000] [--source DIR]
+        python benchmark.py fixtures [--dir fixtures]
+        python benchmark.py memory [--lines 500000]
+        python benchmark.py backends [--connections 8000]
+        python benchmark.py export [--lines 100000]
+        python benchmark.py summary [--lines 100000]
+        python benchmark.py fleet [--agents 8] [--lines 10000]
+        python benchmark.py scaling [--lines 1000000] [--workers 1,2,4,8]
+        python benchmark.py index [--lines 1000000]
+        python benchmark.py filter [--lines 100000]
+        python benchmark.py counters [--interfaces 100]
+        python benchmark.py namespaces
+        python benchmark.py resolver [--ips 200] [--latency 0.05]
+
+The parser, diff and screen timings compared between runs are the
+pytest-benchmark cases of tests/test_benchmarks.py.
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import pwd
+import random
+import socket
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import aggregate
+import counters
+import export
+import utils
+from fleet import Fleet
+from namespaces import Namespaces
+from netstat import NetStat, parse_net
+from parallel import ParallelParser
+from resolver import Resolver
+from socketfilter import SocketFilter
+from socketindex import SocketIndex
+from source import DirectorySource
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, the peak RSS is used instead
+    tracemalloc = None
+
+NET_TCP_HEADER = "  sl  local_address rem_address   st tx_queue " \
+    "rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+# The kernel pads every line of the table to 149 chars
+NET_TCP_LINE = "%4d: %08X:%04X %08X:%04X %02X %08X:%08X 00:00000000 " \
+    "00000000 %5d        0 %d 1 0000000000000000 100 0 0 10 0"
+
+
+def make_net_tcp(lines, seed=0):
+    """
+    Build a synthetic /proc/net/tcp table
+
+    Arguments:
+    lines -- Number of sockets in the table
+    seed -- Seed used to generate the sockets, same seed same table
+
+    Returns:
+    Return the table as a string
+    """
+    rand = random.Random(seed)
+    uids = [pw.pw_uid for pw in pwd.getpwall()][:8] or [0]
+    # A busy host talks to a few hundred peers from a couple of ips
+    local_ips = [rand.randint(0, 0xFFFFFFFF) for _ in range(4)]
+    rem_ips = [rand.randint(0, 0xFFFFFFFF) for _ in range(500)]
+
+    table = [NET_TCP_HEADER.rstrip("\n").ljust(149) + "\n"]
+    for sl in range(lines):
+        table.append((NET_TCP_LINE % (
+            sl,
+            rand.choice(local_ips), rand.randint(1, 0xFFFF),
+            rand.choice(rem_ips), rand.randint(1, 0xFFFF),
+            rand.randint(1, 11),
+            rand.randint(0, 0xFFFF), rand.randint(0, 0xFFFF),
+            rand.choice(uids),
+            rand.randint(1, 0xFFFFFFF)
+        )).ljust(149) + "\n")
+
+    return "".join(table)
+
+
+def legacy_collect_net_tcp(conn_status, lines, ret_format):
+    """
+    The char-by-char parser shipped before the split-based one, kept as
+    reference for the benchmarks
+    """
+    netdata = {}
+    list_netdata = []
+
+    data = ""
+    for i, line in enumerate(lines):
+        if i == 0:
+            continue
+
+        index_netstat_fields = 0
+        for char in line:
+            if " " in char:
+                if data == "" or data == " " or data == "\n":
+                    continue
+
+                data = data.strip("\n")
+                netdata['proto'] = "tcp"
+                if index_netstat_fields == 0:
+                    netdata['sl'] = data
+
+                if index_netstat_fields == 1:
+                    if ret_format == "human_being":
+                        ip_address, port = data.split(":")
+                        ip_address = socket.inet_ntoa(
+                            struct.pack("<L", int(ip_address, 16))
+                        )
+                        netdata['local_address'] = ip_address
+                        netdata['local_address'] += ":" + \
+                            str(utils.hex_to_dec(port))
+                    else:
+                        netdata['local_address'] = data
+
+                if index_netstat_fields == 2:
+                    if ret_format == "human_being":
+                        ip_address, port = data.split(":")
+                        ip_address = socket.inet_ntoa(
+                            struct.pack("<L", int(ip_address, 16))
+                        )
+                        netdata['rem_address'] = ip_address
+                        netdata['rem_address'] += ":" + \
+                            str(utils.hex_to_dec(port))
+
+                        if "0.0.0.0:0" in netdata['rem_address']:
+                            netdata['rem_address'] = "0.0.0.0:*"
+                    else:
+                        netdata['rem_address'] = data
+
+                if index_netstat_fields == 3:
+                    if ret_format == "human_being":
+                        netdata['st'] = conn_status[str(
+                            utils.hex_to_dec(data)
+                        )]
+                    else:
+                        netdata['st'] = data
+
+                if index_netstat_fields == 4:
+                    if ret_format == "human_being":
+                        tx, rx = data.split(':')
+                        netdata['tx_queue_rx_queue'] = str(
+                            utils.hex_to_dec(rx)
+                        )
+                        netdata['tx_queue_rx_queue'] += ":" + \
+                            str(utils.hex_to_dec(tx))
+                    else:
+                        netdata['tx_queue_rx_queue'] = data
+
+                if index_netstat_fields == 5:
+                    netdata['tr_tm_when'] = data
+
+                if index_netstat_fields == 6:
+                    netdata['retrnsmt'] = data
+
+                if index_netstat_fields == 7:
+                    if ret_format == "human_being":
+                        netdata['uid'] = pwd.getpwuid(int(data))[0]
+                    else:
+                        netdata['uid'] = data
+
+                if index_netstat_fields == 8:
+                    netdata['timeout'] = data
+
+                if index_netstat_fields == 9:
+                    netdata['inode'] = data
+
+                if index_netstat_fields > 9:
+                    netdata['inode'] += " " + data
+
+                data = ""
+                index_netstat_fields += 1
+                continue
+
+            data += char
+        list_netdata.append(netdata.copy())
+
+    return list_netdata
+
+
+NET_TCP_KEYS = ('proto', 'sl', 'local_address', 'rem_address', 'st',
+                'tx_queue_rx_queue', 'tr_tm_when', 'retrnsmt', 'uid',
+                'timeout', 'inode')
+
+
+def _display_all(parse, *args):
+    # Access every field as the screen does, "human being" rows are
+    # only decoded on access
+    for row in parse(*args):
+        for key in NET_TCP_KEYS:
+            row[key]
+
+
+def _best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def _peak_memory(func, *args):
+    """
+    Run func(*args) in a child process
+
+    Returns:
+    Return the peak of memory allocated while running func, in bytes
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        if tracemalloc is not None:
+            tracemalloc.start()
+            result = func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        else:
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result = func(*args)
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak = (after - before) * 1024
+        os.write(write_fd, str(peak).encode())
+        os._exit(0)
+
+    os.close(write_fd)
+    peak = int(os.read(read_fd, 64))
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    return peak
+
+
+def bench_memory(args):
+    netstat = NetStat()
+    content = make_net_tcp(args.lines)
+    lines = content.splitlines(True)
+
+    legacy = _peak_memory(legacy_collect_net_tcp,
+                          netstat.conn_status, lines, "hex")
+    current = _peak_memory(netstat.parse_net_tcp, content, "hex")
+
+    print("%d sockets, peak %s" % (
+        args.lines, "tracemalloc" if tracemalloc else "RSS growth"
+    ))
+    print("list of dicts: %8.1f MB  %6d bytes/socket" % (
+        legacy / 1048576.0, legacy / args.lines))
+    print("SocketTable:   %8.1f MB  %6d bytes/socket" % (
+        current / 1048576.0, current / args.lines))
+
+
+def _loopback_connections(count):
+    """
+    Open count TCP connections over loopback
+
+    Returns:
+    Return the sockets, keep them referenced while benchmarking
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    # Two fds per connection, some left for the benchmark itself
+    count = min(count, (hard - 64) // 2)
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(128)
+
+    sockets = [server]
+    for _ in range(count):
+        client = socket.create_connection(server.getsockname())
+        conn, _ = server.accept()
+        sockets.append(client)
+        sockets.append(conn)
+
+    return sockets
+
+
+def bench_backends(args):
+    sockets = _loopback_connections(args.connections)
+    backends = [("proc", NetStat(backend="proc")),
+                ("netlink", NetStat(backend="netlink"))]
+
+    listen = SocketFilter("state", "LISTEN", backends[0][1].conn_status)
+
+    print("%d loopback connections, best of %d" % (
+        (len(sockets) - 1) // 2, args.repeat))
+    for name, socket_filter in (("all", None), ("LISTEN", listen)):
+        for backend, netstat in backends:
+            rows = len(netstat.collect_net_tcp("hex", socket_filter))
+            if netstat.backend != backend:
+                print("%s not available" % backend)
+                continue
+
+            elapsed = _best_of(args.repeat, netstat.collect_net_tcp,
+                               "hex", socket_filter)
+            print("%-6s %-8s %6d sockets %8.1f ms" % (
+                name, backend, rows, elapsed * 1000))
+
+
+class _NullOutput:
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def bench_export(args):
+    netstat = NetStat()
+    tables = [netstat.parse_net_tcp(make_net_tcp(args.lines), "hex")]
+
+    print("%d sockets, best of %d" % (args.lines, args.repeat))
+    for name in export.EXPORT_FORMATS:
+        writer = export.WRITERS[name](_NullOutput())
+        elapsed = _best_of(args.repeat, writer.write, netstat, tables)
+        print("%-10s %10d rows/s %8.1f ms per collection" % (
+            name, args.lines / elapsed, elapsed * 1000))
+
+
+def bench_summary(args):
+    netstat = NetStat()
+    tables = [netstat.parse_net_tcp(make_net_tcp(args.lines), "hex")]
+
+    elapsed = _best_of(args.repeat, aggregate.Summary, tables)
+    print("%d sockets, best of %d" % (args.lines, args.repeat))
+    print("summary    %10d rows/s %8.1f ms per collection" % (
+        args.lines / elapsed, elapsed * 1000))
+
+
+def _start_agents(directory, count, lines):
+    """
+    Start count agents on loopback, each serving its own tcp table
+
+    Returns:
+    Return the (processes, addresses) of the agents
+    """
+    netpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "netpath.py")
+    processes = []
+    addresses = []
+    for number in range(count):
+        path = os.path.join(directory, str(number))
+        os.makedirs(path)
+        with open(os.path.join(path, "tcp"), "w") as fd:
+            fd.write(make_net_tcp(lines, seed=number))
+
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        address = "127.0.0.1:%d" % listener.getsockname()[1]
+        listener.close()
+        processes.append(subprocess.Popen(
+            [sys.executable, netpath, "--agent", address, "--source", path]
+        ))
+        addresses.append(address)
+
+    # Wait for the agents to listen
+    for address in addresses:
+        host, port = address.split(":")
+        for _ in range(100):
+            try:
+                socket.create_connection((host, int(port))).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+
+    return processes, addresses
+
+
+def bench_fleet(args):
+    directory = tempfile.mkdtemp()
+    processes = []
+    try:
+        processes, addresses = _start_agents(directory, args.agents,
+                                             args.lines)
+        fleet = Fleet(addresses, timeout=60)
+        # Connects to the agents
+        fleet.collect(["tcp"], "hex")
+
+        elapsed = _best_of(args.repeat, fleet.collect, ["tcp"], "hex")
+        print("%d agents of %d sockets, best of %d" % (
+            args.agents, args.lines, args.repeat))
+        print("fleet      %10d rows/s %8.1f ms per collection, "
+              "slowest host %.1f ms" % (
+                  args.agents * args.lines / elapsed, elapsed * 1000,
+                  max(fleet.latency.values()) * 1000))
+        fleet.close()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory)
+
+
+def bench_scaling(args):
+    netstat = NetStat()
+    content = make_net_tcp(args.lines)
+
+    print("%d sockets, %d cores, best of %d" % (
+        args.lines, multiprocessing.cpu_count(), args.repeat))
+    serial = _best_of(args.repeat, parse_net, "tcp", content)
+    print("serial     %10d rows/s %8.1f ms" % (
+        args.lines / serial, serial * 1000))
+    for workers in args.workers.split(","):
+        parallel = ParallelParser(int(workers))
+        elapsed = _best_of(args.repeat, parallel.parse_chunks, "tcp",
+                           content, "hex", None, netstat)
+        print("%2s workers %10d rows/s %8.1f ms  (%.1fx)" % (
+            workers, args.lines / elapsed, elapsed * 1000,
+            serial / elapsed))
+
+    # As netpath picks it, once a few tables were parsed
+    parallel = ParallelParser()
+    for _ in range(args.repeat + 1):
+        parallel.parse("tcp", content, "hex", None, netstat)
+    threshold = parallel.threshold()
+    if threshold is None:
+        print("automatic threshold: never, single core")
+    else:
+        print("automatic threshold: %d bytes, %d sockets" % (
+            threshold, threshold * args.lines / len(content)))
+
+
+def _scan_rows(table, port):
+    # The string compare of every row the screen filter did
+    return [row for row in table
+            if port == row['local_address'].split(":")[1] or
+            port == row['rem_address'].split(":")[1]]
+
+
+def _scan_columns(table, socket_filter):
+    match = socket_filter.match
+    return [index for index, fields in enumerate(itertools.izip(
+        table.state, table.local_ip, table.local_port, table.rem_ip,
+        table.rem_port, table.uid, table.tx_queue, table.rx_queue))
+        if match(*fields)]
+
+
+def _index_all(delta, socket_filter):
+    index = SocketIndex()
+    index.update(delta)
+    return index.select(socket_filter)
+
+
+def bench_index(args):
+    netstat = NetStat()
+    content = make_net_tcp(args.lines)
+    table = netstat.parse_net_tcp(content, "hex")
+    delta = netstat.delta([table])
+
+    # A port of a few sockets, as a filter kept on a service
+    port = table.local_port[len(table) // 2]
+    socket_filter = SocketFilter("port", str(port), netstat.conn_status)
+    # The next collection, 1% of the sockets replaced
+    lines = content.splitlines(True)
+    churn = len(lines) // 100
+    other = make_net_tcp(churn, seed=1).splitlines(True)[1:]
+    next_delta = netstat.delta([netstat.parse_net_tcp(
+        "".join(lines[:-churn] + other), "hex")])
+    back_delta = netstat.delta([table])
+
+    index = SocketIndex()
+    index.update(delta)
+    selected = index.select(socket_filter)
+
+    def update():
+        # Two collections, so the index ends as it started
+        index.update(next_delta)
+        index.update(back_delta)
+
+    print("%d sockets, port %d of %d sockets, best of %d" % (
+        args.lines, port, len(selected), args.repeat))
+    for name, func, func_args in (
+            ("row scan", _scan_rows, (table, "%04X" % port)),
+            ("column scan", _scan_columns, (table, socket_filter)),
+            ("index build", _index_all, (delta, socket_filter)),
+            ("index lookup", index.select, (socket_filter,)),
+            ("index 2x1% churn", update, ())):
+        elapsed = _best_of(args.repeat, func, *func_args)
+        print("%-15s %10.2f ms" % (name, elapsed * 1000))
+
+
+# Expressions timed by "filter", from one term to a few
+FILTER_EXPRESSIONS = (
+    "state established",
+    "port 1-1024 or user 0",
+    "state established and ip 10.0.0.0/8 and port 5432 and rx_queue > 0",
+    "(state listen or state close_wait) and not rem_ip 10.0.0.0/8 and "
+    "tx_queue < 1000",
+)
+
+
+def _walk(node, columns):
+    # The filter tree interpreted on a socket, what the compiled
+    # match() saves
+    kind = node[0]
+    if kind == "and":
+        return all(_walk(child, columns) for child in node[1])
+    if kind == "or":
+        return any(_walk(child, columns) for child in node[1])
+    if kind == "not":
+        return not _walk(node[1], columns)
+
+    value = columns[node[1]]
+    if kind == "values":
+        return value in node[2]
+    if kind == "range":
+        return node[2] <= value and (node[3] is None or value <= node[3])
+    family, network, mask = node[2]
+    return not isinstance(value, tuple) and value & mask == network
+
+
+def _scan_tree(table, socket_filter):
+    names = ("state", "local_ip", "local_port", "rem_ip", "rem_port", "uid",
+             "tx_queue", "rx_queue")
+    return [index for index, fields in enumerate(itertools.izip(
+        *[getattr(table, name) for name in names]))
+        if _walk(socket_filter.tree, dict(zip(names, fields)))]
+
+
+def bench_filter(args):
+    netstat = NetStat()
+    content = make_net_tcp(args.lines)
+    table = netstat.parse_net_tcp(content, "hex")
+    index = SocketIndex()
+    index.update(netstat.delta([table]))
+
+    print("%d sockets, best of %d" % (args.lines, args.repeat))
+    print("%-70s %8s %8s %8s %8s %8s" % (
+        "expression", "sockets", "parse", "tree", "match", "index"))
+    for expression in FILTER_EXPRESSIONS:
+        socket_filter = SocketFilter("expression", expression,
+                                     netstat.conn_status)
+        # Parsed with the filter pushed down, then the filter checked
+        # on the sockets of a table
+        times = [_best_of(args.repeat, func, *func_args) * 1000
+                 for func, func_args in (
+                     (netstat.parse_net_tcp,
+                      (content, "hex", socket_filter)),
+                     (_scan_tree, (table, socket_filter)),
+                     (_scan_columns, (table, socket_filter)),
+                     (index.select, (socket_filter,)))]
+        print("%-70s %8d %6.1fms %6.1fms %6.1fms %6.1fms" % tuple(
+            [expression, len(index.select(socket_filter))] + times))
+
+
+NET_DEV_HEADER = "Inter-|   Receive                            " \
+    "                    |  Transmit\n" \
+    " face |bytes    packets errs drop fifo frame compressed multicast|" \
+    "bytes    packets errs drop fifo colls carrier compressed\n"
+
+
+def make_net_dev(interfaces):
+    """
+    Build a /proc/net/dev of many interfaces, as a host of containers
+    has
+    """
+    lines = [NET_DEV_HEADER]
+    for number in range(interfaces):
+        lines.append("veth%04d: %s\n" % (number, " ".join(
+            str(random.randint(0, 1 << 40)) for _ in range(16))))
+
+    return "".join(lines)
+
+
+def bench_counters(args):
+    live = NetStat()
+    dev = make_net_dev(args.interfaces)
+    snmp, netstat = [live.source.read(name) for name in ("snmp", "netstat")]
+
+    def sample(count):
+        sampled = counters.Counters()
+        for number in range(count):
+            sampled.update(dev, snmp, netstat, number)
+
+    samples = 1000
+    elapsed = _best_of(args.repeat, sample, samples)
+    print("%d interfaces, best of %d" % (args.interfaces, args.repeat))
+    print("parse      %8.1f us per sample" % (elapsed * 1e6 / samples))
+
+    elapsed = _best_of(args.repeat, lambda: [live.collect_counters()
+                                             for _ in range(samples)])
+    print("/proc/net  %8.1f us per sample, %d interfaces" % (
+        elapsed * 1e6 / samples, len(live.counters.interfaces)))
+
+
+def bench_namespaces(args):
+    namespaces = Namespaces()
+    try:
+        start = time.time()
+        namespaces.refresh()
+        first = time.time() - start
+
+        print("%d pids, %d namespaces, best of %d" % (
+            len(namespaces.pid_namespaces), len(namespaces.readers),
+            args.repeat))
+        print("first refresh  %8.1f ms" % (first * 1000))
+        print("refresh        %8.1f ms" % (
+            _best_of(args.repeat, namespaces.refresh) * 1000))
+        print("collect        %8.1f ms" % (_best_of(
+            args.repeat, namespaces.collect, ["tcp", "tcp6"], "hex") * 1000))
+    finally:
+        namespaces.close()
+
+
+def bench_resolver(args):
+    netstat = NetStat()
+    ips = range(args.ips)
+
+    def lookup(ip_string):
+        # A DNS server answering in latency seconds
+        time.sleep(args.latency)
+        return "host-" + ip_string
+
+    def inline():
+        for ip in ips:
+            lookup(netstat.human_ip(ip))
+
+    resolver = Resolver(netstat.human_ip, lookup)
+    named = set()
+    start = time.time()
+    for ip in ips:
+        resolver.name(ip)
+    first = time.time() - start
+    while len(named) < args.ips:
+        time.sleep(0.1)
+        named.update(resolver.tick())
+    elapsed = time.time() - start
+    resolver.close()
+
+    print("%d ips, lookups of %d ms" % (args.ips, args.latency * 1000))
+    print("inline       %8.1f ms per refresh" % (
+        _best_of(1, inline) * 1000))
+    print("background   %8.1f ms per refresh, all named in %.1f s" % (
+        first * 1000, elapsed))
+
+
+def make_fixtures(args):
+    """
+    Write the tcp tables of every size in a directory of args.dir,
+    named after the size, for "parser --source"
+    """
+    for size in args.sizes.split(","):
+        path = os.path.join(args.dir, size)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, "tcp"), "w") as fd:
+            fd.write(make_net_tcp(int(size)))
+        print("%s/tcp" % path)
+
+
+def bench_parser(args):
+    netstat = NetStat()
+    if args.source:
+        # The capture is parsed in place, as "netpath --source" does
+        content = DirectorySource(args.source).read("tcp")
+        args.lines = len(netstat.parse_net_tcp(content, "hex"))
+    else:
+        content = make_net_tcp(args.lines)
+    lines = content[:].splitlines(True)
+
+    print("%d sockets, best of %d" % (args.lines, args.repeat))
+    for ret_format in ("hex", "human_being"):
+        legacy = _best_of(args.repeat, _display_all, legacy_collect_net_tcp,
+                          netstat.conn_status, lines, ret_format)
+        current = _best_of(args.repeat, _display_all, netstat.parse_net_tcp,
+                           content, ret_format)
+
+        print("%-12s legacy: %10d rows/s  split: %10d rows/s  (%.1fx)" % (
+            ret_format,
+            args.lines / legacy,
+            args.lines / current,
+            legacy / current
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="netpath benchmarks")
+    parser.add_argument("--repeat", type=int, default=3)
+    subparsers = parser.add_subparsers()
+
+    parser_bench = subparsers.add_parser(
+        "parser", help="/proc/net/tcp parser rows/sec"
+    )
+    parser_bench.add_argument("--lines", type=int, default=100000)
+    parser_bench.add_argument(
+        "--source", help="directory of a tcp table, written by fixtures"
+    )
+    parser_bench.set_defaults(func=bench_parser)
+
+    parser_bench = subparsers.add_parser(
+        "fixtures", help="write tcp tables of the given sizes"
+    )
+    parser_bench.add_argument("--dir", default="fixtures")
+    parser_bench.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser_bench.set_defaults(func=make_fixtures)
+
+    parser_bench = subparsers.add_parser(
+        "memory", help="peak memory of the parsed /proc/net/tcp"
+    )
+    parser_bench.add_argument("--lines", type=int, default=500000)
+    parser_bench.set_defaults(func=bench_memory)
+
+    parser_bench = subparsers.add_parser(
+        "backends", help="/proc/net/tcp vs netlink sock_diag collection"
+    )
+    parser_bench.add_argument("--connections", type=int, default=8000)
+    parser_bench.set_defaults(func=bench_backends)
+
+    parser_bench = subparsers.add_parser(
+        "export", help="headless export rows/sec"
+    )
+    parser_bench.add_argument("--lines", type=int, default=100000)
+    parser_bench.set_defaults(func=bench_export)
+
+    parser_bench = subparsers.add_parser(
+        "summary", help="summary screen counters rows/sec"
+    )
+    parser_bench.add_argument("--lines", type=int, default=100000)
+    parser_bench.set_defaults(func=bench_summary)
+
+    parser_bench = subparsers.add_parser(
+        "fleet", help="collection of agents on loopback"
+    )
+    parser_bench.add_argument("--agents", type=int, default=8)
+    parser_bench.add_argument("--lines", type=int, default=10000)
+    parser_bench.set_defaults(func=bench_fleet)
+
+    parser_bench = subparsers.add_parser(
+        "scaling", help="parser rows/sec per number of workers"
+    )
+    parser_bench.add_argument("--lines", type=int, default=1000000)
+    parser_bench.add_argument("--workers", default="1,2,4,8")
+    parser_bench.set_defaults(func=bench_scaling)
+
+    parser_bench = subparsers.add_parser(
+        "index", help="filter by row scan vs socket indexes"
+    )
+    parser_bench.add_argument("--lines", type=int, default=1000000)
+    parser_bench.set_defaults(func=bench_index)
+
+    parser_bench = subparsers.add_parser(
+        "filter", help="filter expressions, interpreted vs compiled"
+    )
+    parser_bench.add_argument("--lines", type=int, default=100000)
+    parser_bench.set_defaults(func=bench_filter)
+
+    parser_bench = subparsers.add_parser(
+        "counters", help="interface and protocol counters per sample"
+    )
+    parser_bench.add_argument("--interfaces", type=int, default=100)
+    parser_bench.set_defaults(func=bench_counters)
+
+    parser_bench = subparsers.add_parser(
+        "namespaces", help="discovery and collection of the namespaces"
+    )
+    parser_bench.set_defaults(func=bench_namespaces)
+
+    parser_bench = subparsers.add_parser(
+        "resolver", help="host names resolved inline vs in the background"
+    )
+    parser_bench.add_argument("--ips", type=int, default=200)
+    parser_bench.add_argument("--latency", type=float, default=0.05)
+    parser_bench.set_defaults(func=bench_resolver)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Periodic socket collection from a background thread
+
+The collections are handed over through a queue, and a byte written to
+a pipe makes the Collector readable for select(), so the UI waits on
+the keyboard and the collections at once.
+"""
+
+import os
+import Queue
+import sys
+import threading
+import time
+
+# Bounds of the refresh interval, in seconds
+MIN_INTERVAL = 0.1
+MAX_INTERVAL = 10.0
+
+
+class Collector:
+    """
+    Collect and diff the sockets every interval seconds
+
+    Arguments:
+    netstat -- NetStat collecting, only used from the collector thread
+    protocols -- List of protocols to collect, see netstat.PROTOCOLS
+    interval -- Seconds between two collections
+    history -- history.History recording the collections, None for
+               none
+    """
+
+    def __init__(self, netstat, protocols, interval=1.0, history=None):
+        self.netstat = netstat
+        self.protocols = protocols
+        self.interval = interval
+        self.history = history
+        # profiling.Profiler of the first collections, if profiling
+        self.profiler = None
+        # scheduler.Scheduler adapting the interval to the CPU used,
+        # None to collect every interval seconds
+        self.scheduler = None
+
+        # (generation, ret_format, socket_filter) set by configure()
+        self._settings = (0, "hex", None)
+        self._generation = 0
+        # Filter of the collections recorded by the history
+        self._filter = None
+
+        # One collection at most waits for the UI, the ticks are skipped
+        # while the UI is busy
+        self._results = Queue.Queue(maxsize=1)
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def fileno(self):
+        """
+        Returns:
+        Return the fd readable once a collection is ready, for select()
+        """
+        return self._wakeup_read
+
+    def configure(self, ret_format, socket_filter):
+        """
+        Change the format and filter of the collections, the next one
+        is done at once and starts a new snapshot
+
+        Arguments:
+        ret_format -- "hex" or "human_being"
+        socket_filter -- SocketFilter of the sockets to collect, None
+                         for all
+
+        Settings as the current ones change nothing, netpath.socket_filter()
+        returns the same SocketFilter while the filter is the same.
+        """
+        generation, current_format, current_filter = self._settings
+        if ret_format == current_format and socket_filter is current_filter:
+            return
+
+        self._settings = (generation + 1, ret_format, socket_filter)
+        self._wake.set()
+
+    def wake(self):
+        """
+        Collect at once with the current settings, as when a replay is
+        moved
+        """
+        self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def get(self):
+        """
+        Take the collection ready, call when fileno() is readable
+
+        Returns:
+        Return the SnapshotDelta of the collection, None if it was made
+        with settings changed since
+
+        Raises the exception of a failed collection.
+        """
+        os.read(self._wakeup_read, 1)
+        try:
+            generation, delta, error = self._results.get_nowait()
+        except Queue.Empty:
+            return None
+
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+        if generation != self._settings[0]:
+            return None
+
+        return delta
+
+    def _run(self):
+        deadline = time.time()
+        while not self._stop.is_set():
+            self._wake.wait(max(deadline - time.time(), 0))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+
+            start = time.time()
+            deadline = start + self.interval
+            if self.scheduler is not None:
+                deadline = start + self.scheduler.current
+            generation, ret_format, socket_filter = self._settings
+            if generation != self._generation:
+                self._generation = generation
+                self.netstat.snapshot = None
+                # The counters of other filters would not compare, the
+                # format doesn't change them
+                if socket_filter is not self._filter:
+                    self._filter = socket_filter
+                    if self.history is not None:
+                        self.history.clear()
+                # Made with the former settings, the UI would drop it
+                try:
+                    self._results.get_nowait()
+                except Queue.Empty:
+                    pass
+            elif self._results.full():
+                continue
+
+            profiler = self.profiler
+            profiling = profiler is not None and profiler.start_collection()
+            stats = self.netstat.stats
+            delta = error = None
+            try:
+                with stats.timer("collection"):
+                    delta = self.netstat.delta(self.netstat.collect(
+                        self.protocols, ret_format, socket_filter
+                    ))
+                # Sampled every tick, the rates are ready when shown
+                self.netstat.collect_counters()
+                if self.history is not None:
+                    with stats.timer("history"):
+                        self.history.add(delta, time.time())
+                if self.scheduler is not None:
+                    deadline = start + self.scheduler.tick()
+            except Exception:
+                error = sys.exc_info()
+            finally:
+                if profiling:
+                    profiler.end_collection()
+
+            self._results.put((generation, delta, error))
+            os.write(self._wakeup_write, "x")
@@ -0,0 +1,232 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Counters of the interfaces and protocols, from /proc/net/dev,
+/proc/net/snmp and /proc/net/netstat, and their rates per second
+
+The columns of the counters are found in the header lines once, a
+sample then only splits the lines of values and picks the columns.
+"""
+
+import operator
+
+# Files of /proc/net read for the counters
+COUNTER_FILES = ("dev", "snmp", "netstat")
+
+# Counters of every interface, the receive ones then the transmit ones,
+# as named in the /proc/net/dev header
+INTERFACE_COUNTERS = (
+    "rx_bytes", "rx_packets", "rx_errs", "rx_drop", "rx_fifo", "rx_frame",
+    "rx_compressed", "rx_multicast",
+    "tx_bytes", "tx_packets", "tx_errs", "tx_drop", "tx_fifo", "tx_colls",
+    "tx_carrier", "tx_compressed",
+)
+
+# Counters of /proc/net/snmp and /proc/net/netstat kept, by group. The
+# ones the kernel doesn't have are left out.
+PROTOCOL_COUNTERS = (
+    ("Ip", ("InReceives", "InDiscards", "InDelivers", "OutRequests",
+            "OutDiscards", "OutNoRoutes", "ReasmFails", "FragFails")),
+    ("Icmp", ("InMsgs", "InErrors", "InDestUnreachs", "OutMsgs",
+              "OutDestUnreachs")),
+    ("Tcp", ("ActiveOpens", "PassiveOpens", "AttemptFails", "EstabResets",
+             "CurrEstab", "InSegs", "OutSegs", "RetransSegs", "InErrs",
+             "OutRsts")),
+    ("Udp", ("InDatagrams", "NoPorts", "InErrors", "OutDatagrams",
+             "RcvbufErrors", "SndbufErrors")),
+    ("TcpExt", ("ListenOverflows", "ListenDrops", "SyncookiesSent",
+                "TCPTimeouts", "TCPLossProbes", "TCPFastRetrans",
+                "TCPSlowStartRetrans", "TCPBacklogDrop", "TCPAbortOnData",
+                "TCPAbortOnTimeout", "TCPAbortOnMemory", "TCPReqQFullDrop",
+                "TCPOFODrop", "TCPRcvQDrop")),
+    ("IpExt", ("InOctets", "OutOctets")),
+)
+
+# Counters of PROTOCOL_COUNTERS which are gauges, they have no rate
+GAUGES = frozenset([("Tcp", "CurrEstab")])
+
+_WANTED = dict(PROTOCOL_COUNTERS)
+
+
+def _rates(values, previous, elapsed):
+    """
+    Returns:
+    Return the rates per second of counters since their previous
+    values, None if not sampled before. A counter reset or wrapped
+    counts 0.
+    """
+    if previous is None or elapsed <= 0:
+        return None
+
+    return [max(difference, 0) / elapsed
+            for difference in map(operator.sub, values, previous)]
+
+
+def _picker(indexes):
+    # Function returning the fields at indexes of a list, as a list
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda fields: [fields[index]]
+
+    return operator.itemgetter(*indexes)
+
+
+def _dev_columns(header):
+    """
+    Find the INTERFACE_COUNTERS in the fields of the interface lines
+
+    Arguments:
+    header -- Second line of /proc/net/dev, "face |bytes packets ...|
+              bytes packets ..."
+
+    Returns:
+    Return the function picking the counters from the fields after the
+    name, a counter the kernel doesn't have is 0
+    """
+    sections = header.split("|")
+    if len(sections) != 3:
+        raise ValueError("invalid /proc/net/dev header: %s" % header)
+
+    names = ["rx_" + name for name in sections[1].split()] + \
+        ["tx_" + name for name in sections[2].split()]
+    # A "0" field is appended to the ones of the lines for the missing
+    # counters
+    return _picker([names.index(name) if name in names else len(names)
+                    for name in INTERFACE_COUNTERS])
+
+
+def _protocol_columns(header):
+    """
+    Find the PROTOCOL_COUNTERS of a group in its header line
+
+    Arguments:
+    header -- A header line of /proc/net/snmp or /proc/net/netstat,
+              "Tcp: RtoAlgorithm RtoMin ..."
+
+    Returns:
+    Return the (group, names, function picking their values from the
+    fields of the values line) of the counters kept, None if none
+    """
+    fields = header.split()
+    if not fields:
+        return None
+
+    group = fields[0].rstrip(":")
+    kept = [name for name in _WANTED.get(group, ()) if name in fields]
+    if not kept:
+        return None
+
+    return group, kept, _picker([fields.index(name) for name in kept])
+
+
+class Counters:
+    """
+    The last sample of the counters of the interfaces and protocols,
+    and their rates per second since the sample before
+
+    The attributes are replaced, not modified, by update(): a thread
+    reading them while another one samples sees one sample or the
+    other.
+    """
+
+    def __init__(self):
+        # [(name, counters, rates)] of the interfaces in the order of
+        # /proc/net/dev, the counters and rates in the
+        # INTERFACE_COUNTERS order, rates None the first sample
+        self.interfaces = []
+        # [(group, name, value, rate)] of the groups in the order of the
+        # files, of the counters in the PROTOCOL_COUNTERS order, rate
+        # None the first sample and for the gauges
+        self.protocols = []
+        self.time = None
+
+        # Columns of the counters, by header line
+        self._columns = {}
+        self._previous_interfaces = {}
+        self._previous_protocols = {}
+
+    def update(self, dev, snmp, netstat, now):
+        """
+        Sample the counters
+
+        Arguments:
+        dev, snmp, netstat -- Content of the /proc/net files, "" if not
+                              read
+        now -- Time of the sample
+        """
+        elapsed = 0
+        if self.time is not None:
+            elapsed = now - self.time
+
+        self.interfaces = self._interfaces(dev, elapsed)
+        self.protocols = self._protocols(snmp, elapsed) + \
+            self._protocols(netstat, elapsed)
+        self.time = now
+
+    def _interfaces(self, content, elapsed):
+        lines = content[:].split("\n")
+        if len(lines) < 3:
+            return []
+
+        columns = self._columns.get(lines[1])
+        if columns is None:
+            columns = self._columns[lines[1]] = _dev_columns(lines[1])
+
+        interfaces = []
+        previous = self._previous_interfaces
+        current = {}
+        for line in lines[2:]:
+            name, _, fields = line.partition(":")
+            if not fields:
+                continue
+            name = name.strip()
+            fields = fields.split()
+            fields.append("0")
+            values = map(int, columns(fields))
+            current[name] = values
+            interfaces.append((name, values,
+                               _rates(values, previous.get(name), elapsed)))
+
+        self._previous_interfaces = current
+        return interfaces
+
+    def _protocols(self, content, elapsed):
+        # The groups come as a line of names then a line of values
+        lines = content[:].split("\n")
+        protocols = []
+        previous = self._previous_protocols
+        for header, line in zip(lines[::2], lines[1::2]):
+            if header not in self._columns:
+                self._columns[header] = _protocol_columns(header)
+            columns = self._columns[header]
+            if columns is None:
+                continue
+
+            # The values line starts with the group as the header
+            group, names, pick = columns
+            values = map(int, pick(line.split()))
+            rates = _rates(values, previous.get(group), elapsed)
+            previous[group] = values
+            if rates is None:
+                rates = [None] * len(values)
+            for name, value, rate in zip(names, values, rates):
+                if (group, name) in GAUGES:
+                    rate = None
+                protocols.append((group, name, value, rate))
+
+        return protocols
@@ -0,0 +1,425 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Headless export of the collected sockets, or of the interface and
+protocol counters
+
+Use as: for record in export.records(netstat, ["tcp", "tcp6"]): ...
+        python netpath.py --export jsonl --interval 0.1
+        python netpath.py --export prometheus --counters
+"""
+
+import collections
+import csv
+import itertools
+import json
+import os
+import socket
+import time
+
+from counters import GAUGES, INTERFACE_COUNTERS
+from sockettable import NO_UID
+
+# Fields of every exported socket, in the CSV columns order
+FIELDS = ("time", "proto", "local_address", "local_port", "rem_address",
+          "rem_port", "state", "tx_queue", "rx_queue", "uid", "user",
+          "inode")
+
+# Fields of every exported counter, kind "interface" or "protocol" and
+# group the interface or the protocol group. rate is None on the first
+# sample and for the gauges.
+COUNTER_FIELDS = ("time", "kind", "group", "counter", "value", "rate")
+
+EXPORT_FORMATS = ("jsonl", "csv", "prometheus")
+
+# A record of JSONLinesWriter, the FIELDS in order
+JSON_LINE = '{"time":%r,"proto":"%s","local_address":%s,"local_port":%d,' \
+    '"rem_address":"%s","rem_port":%d,"state":"%s","tx_queue":%d,' \
+    '"rx_queue":%d,"uid":%s,"user":%s,"inode":%d}\n'
+
+# Encoded records buffered before a write
+EXPORT_BUFFER_SIZE = 1 << 16
+
+TCP_LISTEN = 10
+
+
+def rows(netstat, tables, timestamp=None):
+    """
+    Generate the sockets of collected tables, one at a time
+
+    Arguments:
+    netstat -- NetStat which collected the tables, used to decode them
+    tables -- List of SocketTable, as returned by NetStat.collect()
+    timestamp -- Time of the collection, now by default
+
+    Returns:
+    Return a generator of tuples of the FIELDS values
+    """
+    if timestamp is None:
+        timestamp = time.time()
+
+    state_names = dict((int(state), name)
+                       for state, name in netstat.conn_status.items())
+    for table in tables:
+        # Few distinct users and ips, each is decoded once
+        users = dict((uid, netstat.username(uid))
+                     for uid in set(table.uid) if uid != NO_UID)
+        users[NO_UID] = None
+        uids = dict((uid, uid) for uid in users)
+        uids[NO_UID] = None
+
+        if table.family == socket.AF_UNIX:
+            local_addresses = table.paths
+            rem_addresses = itertools.repeat("", len(table))
+        else:
+            local_addresses = table.addresses(table.local_ip)
+            rem_addresses = table.addresses(table.rem_ip)
+            ips = dict((ip_address, netstat.human_ip(ip_address))
+                       for ip_address in
+                       set(local_addresses).union(rem_addresses))
+            local_addresses = map(ips.__getitem__, local_addresses)
+            rem_addresses = map(ips.__getitem__, rem_addresses)
+
+        for (local_address, local_port, rem_address, rem_port, state,
+             tx_queue, rx_queue, uid, inode) in itertools.izip(
+                local_addresses, table.local_port, rem_addresses,
+                table.rem_port, table.state, table.tx_queue,
+                table.rx_queue, table.uid, table.inode):
+            yield (timestamp, table.proto, local_address, local_port,
+                   rem_address, rem_port, state_names[state], tx_queue,
+                   rx_queue, uids[uid], users[uid], inode)
+
+
+def records(netstat, protocols, socket_filter=None):
+    """
+    Collect the sockets and generate them as they are decoded
+
+    Arguments:
+    netstat -- NetStat collecting
+    protocols -- List of protocols, see netstat.PROTOCOLS
+    socket_filter -- SocketFilter of the sockets to collect, None for
+                     all
+
+    Returns:
+    Return a generator of dicts with the FIELDS as keys
+    """
+    tables = netstat.collect(protocols, "hex", socket_filter)
+    for row in rows(netstat, tables):
+        yield dict(zip(FIELDS, row))
+
+
+def counter_rows(counters):
+    """
+    Generate the counters of a sample, one at a time
+
+    Arguments:
+    counters -- counters.Counters sampled
+
+    Returns:
+    Return a generator of tuples of the COUNTER_FIELDS values
+    """
+    timestamp = counters.time
+    for name, values, rates in counters.interfaces:
+        if rates is None:
+            rates = itertools.repeat(None)
+        for counter, value, rate in itertools.izip(INTERFACE_COUNTERS,
+                                                   values, rates):
+            yield (timestamp, "interface", name, counter, value, rate)
+
+    for group, counter, value, rate in counters.protocols:
+        yield (timestamp, "protocol", group, counter, value, rate)
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class _Buffer:
+    """
+    File like object batching the small writes of the encoders
+
+    Arguments:
+    output -- File receiving the data
+    size -- Bytes buffered before writing them in one go
+    """
+
+    def __init__(self, output, size=EXPORT_BUFFER_SIZE):
+        self.output = output
+        self.size = size
+        self._chunks = []
+        self._length = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._length += len(data)
+        if self._length >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            self.output.write("".join(self._chunks))
+            self._chunks = []
+            self._length = 0
+        self.output.flush()
+
+
+class JSONLinesWriter:
+    """
+    Write the sockets as one JSON object per line
+
+    Arguments:
+    output -- File receiving the records
+    """
+
+    def __init__(self, output):
+        self.buffer = _Buffer(output)
+        self.encode = json.JSONEncoder().encode
+
+    def write(self, netstat, tables):
+        # Only the paths and user names may need escaping, the few
+        # distinct values are encoded once
+        encoded = {}
+
+        def encode(value):
+            try:
+                return encoded[value]
+            except KeyError:
+                encoded[value] = self.encode(value)
+                return encoded[value]
+
+        write = self.buffer.write
+        for (timestamp, proto, local_address, local_port, rem_address,
+             rem_port, state, tx_queue, rx_queue, uid, user, inode) in \
+                rows(netstat, tables):
+            write(JSON_LINE % (
+                timestamp, proto, encode(local_address), local_port,
+                rem_address, rem_port, state, tx_queue, rx_queue,
+                encode(uid), encode(user), inode
+            ))
+        self.buffer.flush()
+
+    def write_counters(self, counters):
+        write = self.buffer.write
+        for row in counter_rows(counters):
+            write(self.encode(collections.OrderedDict(
+                zip(COUNTER_FIELDS, row))) + "\n")
+        self.buffer.flush()
+
+
+class CSVWriter:
+    """
+    Write the sockets as CSV, the FIELDS header first, or the counters,
+    the COUNTER_FIELDS header first
+
+    Arguments:
+    output -- File receiving the records
+    """
+
+    def __init__(self, output):
+        self.buffer = _Buffer(output)
+        self.writer = csv.writer(self.buffer, lineterminator="\n")
+        # Written with the first records
+        self.header = None
+
+    def write(self, netstat, tables):
+        self._write(FIELDS, rows(netstat, tables))
+
+    def write_counters(self, counters):
+        self._write(COUNTER_FIELDS, counter_rows(counters))
+
+    def _write(self, header, records):
+        if self.header is None:
+            self.header = header
+            self.writer.writerow(header)
+        self.writer.writerows(records)
+        self.buffer.flush()
+
+
+class PrometheusWriter:
+    """
+    Write the number of sockets per state, listening port and user, or
+    the interface and protocol counters, in the Prometheus text format
+
+    The connections are counted per local port only for the ports
+    listening, the ephemeral ports would make a serie per connection.
+    The counters are written as counters, their rates are left to the
+    queries.
+
+    Arguments:
+    output -- File receiving the expositions, or the path of a file
+              rewritten on every collection, as read by the node
+              exporter textfile collector
+    """
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, netstat, tables):
+        self._publish(self.exposition(netstat, tables))
+
+    def write_counters(self, counters):
+        self._publish(self.counters_exposition(counters))
+
+    def _publish(self, exposition):
+        if not isinstance(self.output, basestring):
+            self.output.write(exposition)
+            self.output.flush()
+            return
+
+        # Replaced at once, a scrape never reads half a file
+        with open(self.output + ".tmp", "w") as fd:
+            fd.write(exposition)
+        os.rename(self.output + ".tmp", self.output)
+
+    def exposition(self, netstat, tables):
+        """
+        Returns:
+        Return the metrics of collected tables as a string
+        """
+        states = collections.Counter()
+        ports = collections.Counter()
+        users = collections.Counter()
+        for table in tables:
+            for state, count in collections.Counter(table.state).items():
+                states[table.proto, netstat.conn_status[str(state)]] += \
+                    count
+
+            if table.family != socket.AF_UNIX:
+                listening = set(
+                    port for port, state in zip(table.local_port,
+                                                table.state)
+                    if state == TCP_LISTEN
+                )
+                for port in table.local_port:
+                    if port in listening:
+                        ports[table.proto, port] += 1
+
+            for uid, count in collections.Counter(table.uid).items():
+                if uid != NO_UID:
+                    users[netstat.username(uid)] += count
+
+        lines = [
+            "# HELP netpath_sockets Sockets per protocol and state",
+            "# TYPE netpath_sockets gauge",
+        ]
+        lines.extend('netpath_sockets{proto="%s",state="%s"} %d' % (
+            proto, state, count) for (proto, state), count in
+            sorted(states.items()))
+
+        lines.extend([
+            "# HELP netpath_port_sockets Sockets per listening port, the "
+            "listeners included",
+            "# TYPE netpath_port_sockets gauge",
+        ])
+        lines.extend('netpath_port_sockets{proto="%s",port="%d"} %d' % (
+            proto, port, count) for (proto, port), count in
+            sorted(ports.items()))
+
+        lines.extend([
+            "# HELP netpath_user_sockets Sockets per user",
+            "# TYPE netpath_user_sockets gauge",
+        ])
+        lines.extend('netpath_user_sockets{user="%s"} %d' % (
+            _label(user), count) for user, count in sorted(users.items()))
+
+        return "\n".join(lines) + "\n"
+
+    def counters_exposition(self, counters):
+        """
+        Returns:
+        Return the metrics of sampled counters as a string
+        """
+        lines = [
+            "# HELP netpath_interface_total Counters of /proc/net/dev per "
+            "interface",
+            "# TYPE netpath_interface_total counter",
+        ]
+        for name, values, _ in counters.interfaces:
+            name = _label(name)
+            lines.extend(
+                'netpath_interface_total{interface="%s",counter="%s"} %d' % (
+                    name, counter, value)
+                for counter, value in zip(INTERFACE_COUNTERS, values))
+
+        protocols = [item for item in counters.protocols
+                     if item[:2] not in GAUGES]
+        lines.extend([
+            "# HELP netpath_protocol_total Counters of /proc/net/snmp and "
+            "/proc/net/netstat",
+            "# TYPE netpath_protocol_total counter",
+        ])
+        lines.extend(
+            'netpath_protocol_total{group="%s",counter="%s"} %d' % (
+                group, counter, value)
+            for group, counter, value, _ in protocols)
+
+        lines.extend([
+            "# HELP netpath_protocol_gauge Gauges of /proc/net/snmp",
+            "# TYPE netpath_protocol_gauge gauge",
+        ])
+        lines.extend(
+            'netpath_protocol_gauge{group="%s",counter="%s"} %d' % (
+                group, counter, value)
+            for group, counter, value, _ in counters.protocols
+            if (group, counter) in GAUGES)
+
+        return "\n".join(lines) + "\n"
+
+
+WRITERS = {
+    'jsonl': JSONLinesWriter,
+    'csv': CSVWriter,
+    'prometheus': PrometheusWriter,
+}
+
+
+def run(netstat, protocols, writer, interval, count=0, socket_filter=None,
+        counters=False):
+    """
+    Collect and write the sockets, or the counters, every interval
+    seconds
+
+    Arguments:
+    netstat -- NetStat collecting
+    protocols -- List of protocols, see netstat.PROTOCOLS
+    writer -- A writer of WRITERS
+    interval -- Seconds between two collections
+    count -- Number of collections, 0 for no end
+    socket_filter -- SocketFilter of the sockets to collect, None for
+                     all
+    counters -- True to write the counters instead of the sockets
+    """
+    deadline = time.time()
+    done = 0
+    while True:
+        if counters:
+            writer.write_counters(netstat.collect_counters())
+        else:
+            writer.write(netstat, netstat.collect(protocols, "hex",
+                                                  socket_filter))
+        done += 1
+        if done == count:
+            return
+
+        deadline += interval
+        delay = deadline - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Late, the ticks missed are skipped
+            deadline = time.time()
@@ -0,0 +1,413 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Collection of the sockets of many hosts
+
+An Agent serves the sockets of its host over TCP, a Fleet collects
+them from the agents of many hosts and merges them.
+
+A request is one JSON line:
+
+    {"protocols": ["tcp", "tcp6"], "filter": ["port", "22"]}
+
+"filter" is the type and data of a SocketFilter, or null. The reply is
+the sockets as parsed by the agent:
+
+    length  uint32, bytes of the JSON header after it
+    header  {"byteorder", "itemsizes", "tables": [{"proto", "rows",
+            "paths"}]} or {"error"}
+    per table, the bytes of every column in the sockettable.COLUMNS
+    order, then the unix socket paths joined by newlines
+
+A connection serves requests until closed.
+"""
+
+import json
+import socket
+import SocketServer
+import struct
+import sys
+import threading
+import time
+
+from array import array
+from multiprocessing.pool import ThreadPool
+
+from netstat import NetStat, PROTOCOLS
+from socketfilter import SocketFilter
+from sockettable import COLUMNS, SocketTable
+
+AGENT_PORT = 7878
+
+# Interface an agent listens on when not given, the agents serve without
+# authentication
+AGENT_HOST = "127.0.0.1"
+
+HEADER_LENGTH = struct.Struct("<I")
+
+# Seconds to connect to an agent, and to wait for a reply before the
+# connection is dropped. The screen doesn't wait for that long, see
+# Fleet.
+CONNECT_TIMEOUT = 5
+REPLY_TIMEOUT = 60
+
+# Columns of IPv6 tables with 4 entries per socket
+_ADDRESS_COLUMNS = ("local_ip", "rem_ip")
+
+
+def parse_address(address):
+    """
+    Parse an agent address, "host", "host:port" or "[::1]:port"
+
+    Returns:
+    Return the (host, port), the port is AGENT_PORT if not given
+    """
+    host, port = address, AGENT_PORT
+    if address.startswith("["):
+        host, _, port = address[1:].partition("]")
+        port = port[1:] or AGENT_PORT
+    elif ":" in address:
+        host, port = address.rsplit(":", 1)
+
+    try:
+        return host, int(port)
+    except ValueError:
+        raise ValueError("invalid agent address: %s" % address)
+
+
+def parse_listen_address(address):
+    """
+    Parse the address an agent listens on, "port" or "host:port"
+
+    Returns:
+    Return the (host, port), the host is AGENT_HOST if not given. Every
+    interface is listened on only when asked, as "0.0.0.0:port".
+
+    Raises ValueError when the address isn't valid.
+    """
+    host, port = AGENT_HOST, address
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        if not host:
+            raise ValueError("no host to listen on: %s, as 0.0.0.0:%s for "
+                             "every interface" % (address, port))
+
+    try:
+        return host, int(port)
+    except ValueError:
+        raise ValueError("invalid listen address: %s" % address)
+
+
+def encode_tables(tables):
+    """
+    Build the reply to a request
+
+    Arguments:
+    tables -- List of SocketTable, as returned by NetStat.collect()
+
+    Returns:
+    Return the reply as a string
+    """
+    header = {
+        "byteorder": sys.byteorder,
+        "itemsizes": [array(typecode).itemsize for _, typecode in COLUMNS],
+        "tables": [],
+    }
+    chunks = []
+    for table in tables:
+        paths = "\n".join(table.paths)
+        header["tables"].append({
+            "proto": table.proto,
+            "rows": len(table),
+            "paths": len(paths),
+        })
+        for name, _ in COLUMNS:
+            chunks.append(getattr(table, name).tostring())
+        chunks.append(paths)
+
+    header = json.dumps(header)
+    return HEADER_LENGTH.pack(len(header)) + header + "".join(chunks)
+
+
+def encode_error(message):
+    header = json.dumps({"error": message})
+    return HEADER_LENGTH.pack(len(header)) + header
+
+
+def _read(fd, size):
+    data = fd.read(size)
+    if len(data) != size:
+        raise IOError("connection closed by the agent")
+
+    return data
+
+
+def read_tables(fd, ret_format, netstat):
+    """
+    Read a reply of an agent
+
+    Arguments:
+    fd -- File of the connection to the agent
+    ret_format -- "hex" or "human_being", format of the tables
+    netstat -- NetStat decoding the "human being" fields
+
+    Returns:
+    Return the list of SocketTable
+
+    Raises ValueError when the agent refused the request or runs on a
+    machine with other integer sizes.
+    """
+    length = HEADER_LENGTH.unpack(_read(fd, HEADER_LENGTH.size))[0]
+    header = json.loads(_read(fd, length))
+    if "error" in header:
+        raise ValueError(header["error"])
+
+    tables = []
+    for item in header["tables"]:
+        table = SocketTable(str(item["proto"]), ret_format, netstat)
+        rows = item["rows"]
+        for (name, _), itemsize in zip(COLUMNS, header["itemsizes"]):
+            column = getattr(table, name)
+            if itemsize != column.itemsize:
+                raise ValueError("agent with other integer sizes")
+
+            count = rows
+            if name in _ADDRESS_COLUMNS:
+                count *= table.words
+            column.fromstring(_read(fd, count * itemsize))
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+
+        paths = _read(fd, item["paths"])
+        if table.family == socket.AF_UNIX:
+            table.paths = paths.split("\n") if rows else []
+        tables.append(table)
+
+    return tables
+
+
+class _AgentHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        self.server.agent.serve(self.rfile, self.wfile)
+
+
+class _AgentServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Agent:
+    """
+    Serve the sockets collected by a NetStat to Fleets
+
+    Every request is collected when received, the connections are
+    served by one thread each.
+
+    Arguments:
+    netstat -- NetStat collecting, on the kernel or a source
+    address -- (host, port) to listen on, see parse_listen_address()
+    """
+
+    def __init__(self, netstat, address):
+        self.netstat = netstat
+        # NetStat and its snapshot are not shared between threads
+        self._lock = threading.Lock()
+
+        self.server = _AgentServer(address, _AgentHandler)
+        self.server.agent = self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve(self, rfile, wfile):
+        """
+        Answer the requests of a connection until it is closed
+        """
+        for line in iter(rfile.readline, ""):
+            try:
+                reply = encode_tables(self.collect(json.loads(line)))
+            except ValueError as e:
+                reply = encode_error(str(e))
+            wfile.write(reply)
+            wfile.flush()
+
+    def collect(self, request):
+        """
+        Returns:
+        Return the tables of a request, see the module help
+
+        Raises ValueError when the request isn't valid.
+        """
+        protocols = [str(proto) for proto in request.get("protocols", ())]
+        for proto in protocols:
+            if proto not in PROTOCOLS:
+                raise ValueError("unknown protocol: %s" % proto)
+
+        with self._lock:
+            socket_filter = None
+            if request.get("filter"):
+                filter_type, filter_data = request["filter"]
+                socket_filter = SocketFilter(str(filter_type),
+                                             str(filter_data),
+                                             self.netstat.conn_status)
+
+            return self.netstat.collect(protocols, "hex", socket_filter)
+
+
+def _filter_spec(socket_filter):
+    if socket_filter is None:
+        return None
+
+    return [socket_filter.filter_type, socket_filter.filter_data]
+
+
+class Fleet(NetStat):
+    """
+    NetStat collecting from the agents of many hosts
+
+    The hosts are collected concurrently, one thread and one
+    persistent connection per host. collect() waits for them timeout
+    seconds at most: a host not done by then is marked "slow" and its
+    previous sockets are returned, its reply is used by the next
+    collect(). A reply asked with the settings before a change is
+    dropped and asked again at once, the previous sockets are returned
+    until the new one comes. The filters are applied by the agents.
+
+    The tables have the host they come from as host, the sockets of
+    the hosts are told apart by their keys. The users are named from
+    the local users database.
+
+    Arguments:
+    hosts -- List of agent addresses, see parse_address()
+    timeout -- Seconds collect() waits for the hosts
+    """
+
+    def __init__(self, hosts, timeout=0.5):
+        NetStat.__init__(self)
+        self.hosts = hosts
+        self.timeout = timeout
+        # The agents only serve the sockets
+        self.counters = None
+
+        # Seconds of the last reply and sockets received, by host
+        self.latency = {}
+        self.sockets = {}
+        # "ok", "slow", "connecting" or the error of the host, by host
+        self.status = dict((host, "connecting") for host in hosts)
+
+        # Persistent (socket, file) to every agent connected, by host
+        self._connections = {}
+        # (settings, AsyncResult) of the request of every host
+        self._pending = {}
+        # Tables of the last reply, by host
+        self._tables = {}
+
+        self.pool = ThreadPool(len(hosts))
+
+    def close(self):
+        NetStat.close(self)
+        for host in list(self._connections):
+            self._disconnect(host)
+
+    def collect(self, protocols, ret_format, socket_filter=None):
+        """
+        Collect the sockets of all the hosts, as NetStat.collect()
+
+        Returns:
+        Return the list of SocketTable, the tables of every host in the
+        hosts order
+        """
+        settings = (tuple(protocols), ret_format, _filter_spec(socket_filter))
+        deadline = time.time() + self.timeout
+        for host in self.hosts:
+            if host not in self._pending:
+                self._request_async(host, settings)
+
+        tables = []
+        for host in self.hosts:
+            request_settings, result = self._pending[host]
+            result.wait(max(deadline - time.time(), 0))
+            if result.ready() and request_settings != settings:
+                # Sent before the settings changed, its reply or error
+                # is of no use
+                request_settings, result = \
+                    self._request_async(host, settings)
+                result.wait(max(deadline - time.time(), 0))
+            if not result.ready():
+                self.status[host] = "slow"
+                tables.extend(self._tables.get(host, ()))
+                continue
+
+            del self._pending[host]
+            try:
+                received, latency = result.get()
+            except Exception as e:
+                self.status[host] = str(e) or e.__class__.__name__
+                self._tables.pop(host, None)
+                continue
+
+            self.status[host] = "ok"
+            self.latency[host] = latency
+            self.sockets[host] = sum(len(table) for table in received)
+            self._tables[host] = received
+            tables.extend(received)
+
+        return tables
+
+    def _request_async(self, host, settings):
+        self._pending[host] = (settings, self.pool.apply_async(
+            self._request, (host, settings)
+        ))
+        return self._pending[host]
+
+    def _request(self, host, settings):
+        protocols, ret_format, spec = settings
+        start = time.time()
+        try:
+            connection = self._connections.get(host)
+            if connection is None:
+                sock = socket.create_connection(parse_address(host),
+                                                CONNECT_TIMEOUT)
+                sock.settimeout(REPLY_TIMEOUT)
+                connection = self._connections[host] = \
+                    (sock, sock.makefile("rb"))
+
+            connection[0].sendall(json.dumps({
+                "protocols": protocols,
+                "filter": spec,
+            }) + "\n")
+            tables = read_tables(connection[1], ret_format, self)
+        except Exception:
+            # The replies could be out of step, start over
+            self._disconnect(host)
+            raise
+
+        for table in tables:
+            table.host = host
+        return tables, time.time() - start
+
+    def _disconnect(self, host):
+        connection = self._connections.pop(host, None)
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
@@ -0,0 +1,297 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Counters of the last collections, kept in fixed size ring buffers
+
+Every series is an array allocated once, a sample overwrites the
+oldest one, so the memory used doesn't grow with the time running.
+"""
+
+import bisect
+import heapq
+import itertools
+import operator
+from array import array
+
+# Seconds of collections kept by default
+HISTORY_SECONDS = 600
+
+# Tables whose state column holds the TCP states, the udp and raw ones
+# reuse a few of the values
+TCP_PROTOCOLS = ("tcp", "tcp6")
+
+TCP_LISTEN = 10
+
+# Series kept for the listening ports with the most connections, and
+# for the connections with the most data queued
+MAX_PORT_SERIES = 16
+MAX_QUEUE_SERIES = 16
+
+SPARK_CHARS = u"\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
+
+
+def sparkline(values):
+    """
+    Draw values as a line of block chars, scaled to the highest
+
+    Returns:
+    Return the sparkline as unicode, one char per value
+    """
+    if not values:
+        return u""
+
+    highest = max(values)
+    if highest <= 0:
+        return SPARK_CHARS[0] * len(values)
+
+    top = len(SPARK_CHARS) - 1
+    return u"".join(SPARK_CHARS[int(max(value, 0) * top / highest)]
+                    for value in values)
+
+
+class RingBuffer:
+    """
+    The last size values appended, in an array
+
+    Arguments:
+    size -- Number of values kept
+    typecode -- array typecode of the values
+    """
+
+    def __init__(self, size, typecode='d'):
+        self.data = array(typecode, [0]) * size
+        self.size = size
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        if self.count < self.size:
+            self.data[self.count] = value
+            self.count += 1
+        else:
+            self.data[self.start] = value
+            self.start = (self.start + 1) % self.size
+
+    def values(self, last=None):
+        """
+        Returns:
+        Return the values as a list, oldest first, only the last ones
+        if given
+        """
+        if self.count < self.size:
+            values = self.data[:self.count].tolist()
+        else:
+            values = (self.data[self.start:] +
+                      self.data[:self.start]).tolist()
+
+        if last is not None:
+            return values[-last:]
+        return values
+
+    def last(self):
+        """
+        Returns:
+        Return the newest value, None if empty
+        """
+        if not self.count:
+            return None
+
+        return self.data[(self.start + self.count - 1) % self.size]
+
+
+class History:
+    """
+    Per collection counters of the sockets
+
+    Every sample records the number of TCP sockets per state, the
+    connections opened and closed per second, and the sum of the
+    retransmit counters and of the queues.
+
+    The connections of the MAX_PORT_SERIES listening ports with the
+    most of them, and the queues of the MAX_QUEUE_SERIES connections
+    with the most data queued, have their own series. A port or a
+    connection takes the place of the least active one when busier,
+    its series starts then.
+
+    The buffers are sized for the shortest interval, a longer one
+    makes them span more time: recent() gives how many samples are
+    within the last seconds.
+
+    Arguments:
+    size -- Number of collections kept
+    seconds -- Seconds of collections shown, None for all the ones kept
+    """
+
+    def __init__(self, size, seconds=None):
+        self.size = size
+        self.seconds = seconds
+        self.clear()
+
+    def clear(self):
+        size = self.size
+        self.times = RingBuffer(size)
+        self.sockets = RingBuffer(size, 'L')
+        self.opened = RingBuffer(size)
+        self.closed = RingBuffer(size)
+        self.retransmits = RingBuffer(size, 'L')
+        self.tx_queue = RingBuffer(size, 'L')
+        self.rx_queue = RingBuffer(size, 'L')
+        self.states = dict((state, RingBuffer(size, 'L'))
+                           for state in range(1, 12))
+        # Connections per listening port, by port
+        self.ports = {}
+        # (tx queue, rx queue) series, by socket key of NetStat.delta()
+        self.queues = {}
+
+    def add(self, delta, timestamp):
+        """
+        Record a collection
+
+        Arguments:
+        delta -- SnapshotDelta of the collection
+        timestamp -- Time of the collection
+        """
+        tables = delta.tables
+
+        self.times.append(timestamp)
+        self.sockets.append(len(delta.keys))
+        opened, closed = delta.churn()
+        self.opened.append(opened)
+        self.closed.append(closed)
+
+        # The columns are counted and summed by C loops
+        tcp_tables = [table for table in tables
+                      if table.proto in TCP_PROTOCOLS]
+        for state, series in self.states.items():
+            series.append(sum(table.state.count(state)
+                              for table in tcp_tables))
+        self.retransmits.append(sum(sum(table.retrnsmt) for table in tables))
+        self.tx_queue.append(sum(sum(table.tx_queue) for table in tables))
+        self.rx_queue.append(sum(sum(table.rx_queue) for table in tables))
+
+        self._add_ports(tcp_tables)
+        self._add_queues(delta)
+
+    def _add_ports(self, tables):
+        # The local ports are sorted once, the sockets of every listening
+        # port are then counted by bisection, but its listeners
+        listening = {}
+        ports = array('H')
+        for table in tables:
+            for port in itertools.compress(table.local_port, itertools.imap(
+                    operator.eq, table.state, itertools.repeat(TCP_LISTEN))):
+                listening[port] = listening.get(port, 0) + 1
+            ports.extend(table.local_port)
+        ports = sorted(ports)
+        counts = dict(
+            (port, bisect.bisect_right(ports, port) -
+             bisect.bisect_left(ports, port) - listeners)
+            for port, listeners in listening.iteritems())
+
+        self._top(self.ports, counts, MAX_PORT_SERIES,
+                  lambda: RingBuffer(self.size, 'L'))
+        for port, series in self.ports.iteritems():
+            series.append(counts[port])
+
+    def _add_queues(self, delta):
+        for key in delta.removed:
+            self.queues.pop(key, None)
+
+        # The queued bytes of every socket are summed by C loops, only
+        # the busiest ones and the ones followed are looked at then
+        totals = []
+        for table in delta.tables:
+            totals.extend(itertools.imap(operator.add, table.tx_queue,
+                                         table.rx_queue))
+        largest = heapq.nlargest(MAX_QUEUE_SERIES, totals)
+        counts = {}
+        if largest and largest[-1] > 0:
+            for position in itertools.islice(itertools.compress(
+                    itertools.count(), itertools.imap(
+                        operator.ge, totals,
+                        itertools.repeat(largest[-1]))), MAX_QUEUE_SERIES):
+                counts[delta.keys[position]] = totals[position]
+
+        # (state, tx queue, rx queue, uid, pid) by key
+        snapshot = delta.snapshot
+        queues = {}
+        for key in itertools.chain(counts, self.queues):
+            values = snapshot.get(key)
+            if values is not None:
+                queues[key] = values[1:3]
+                counts[key] = values[1] + values[2]
+
+        self._top(self.queues, counts, MAX_QUEUE_SERIES,
+                  lambda: (RingBuffer(self.size, 'L'),
+                           RingBuffer(self.size, 'L')))
+        for key, (tx_series, rx_series) in self.queues.iteritems():
+            tx, rx = queues[key]
+            tx_series.append(tx)
+            rx_series.append(rx)
+
+    def _top(self, series, counts, limit, new_series):
+        # Keep the series of the limit keys with the highest counts, the
+        # keys without count are gone
+        for key in list(series):
+            if key not in counts:
+                del series[key]
+
+        for key, count in heapq.nlargest(limit, counts.iteritems(),
+                                         key=operator.itemgetter(1)):
+            if key in series or count <= 0:
+                continue
+            if len(series) >= limit:
+                least = min(series, key=counts.get)
+                if counts[least] >= count:
+                    continue
+                del series[least]
+            series[key] = new_series()
+
+    def recent(self, last=None):
+        """
+        Returns:
+        Return the number of samples taken during the last seconds, at
+        most last if given
+        """
+        times = self.times.values(last)
+        if self.seconds is None or not times:
+            return len(times)
+
+        oldest = times[-1] - self.seconds
+        return len(times) - bisect.bisect_left(times, oldest)
+
+    def rate(self, series, last=None):
+        """
+        Per second increase of a counter series, as the retransmits
+
+        Returns:
+        Return the rate between every two samples, oldest first, only
+        the last ones if given. A counter going down, as sockets close,
+        counts as no increase.
+        """
+        count = None
+        if last is not None:
+            count = last + 1
+        times = self.times.values(count)
+        values = series.values(count)
+        return [max(value - previous, 0) / max(now - then, 1e-6)
+                for then, now, previous, value in
+                zip(times, times[1:], values, values[1:])]
@@ -0,0 +1,198 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Collection of the sockets of every network namespace of the host
+
+/proc/net only shows the namespace of the reader, the sockets of the
+containers are in /proc/<pid>/net of their processes. The namespace of
+a process is the inode of /proc/<pid>/ns/net: the processes sharing it
+see the same tables, which are read once through one of them.
+"""
+
+import os
+
+from multiprocessing.pool import ThreadPool
+
+from netstat import NetStat
+from source import ProcSource
+
+# Threads reading the tables of the namespaces
+NAMESPACE_WORKERS = 8
+
+# Name of the namespace netpath runs in
+HOST_NAMESPACE = "host"
+
+
+def _namespace(proc, pid, kind="net"):
+    # Inode of a namespace of a pid, None if gone or denied
+    try:
+        return os.stat(os.path.join(proc, pid, "ns", kind)).st_ino
+    except OSError:
+        return None
+
+
+def _hostname(proc, pid):
+    # Hostname of the container of a pid, as its /etc/hostname has it
+    try:
+        with open(os.path.join(proc, pid, "root", "etc", "hostname")) as fd:
+            return fd.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+class Namespaces(NetStat):
+    """
+    NetStat collecting the sockets of every network namespace
+
+    The pids are listed on every collect(), only the ones started
+    since the previous collect() have their namespace looked up. The
+    tables of a namespace are read through its smallest pid, the
+    namespaces concurrently.
+
+    The tables have the name of their namespace as host: the hostname
+    of its container, "host" for the namespace of netpath, or
+    "netns:<inode>" when not known. The counters are the ones of the
+    namespace of netpath.
+
+    Arguments:
+    proc -- Mount point of procfs
+    workers -- Threads reading the namespaces
+    parallel -- parallel.ParallelParser of the big tables, see NetStat
+    """
+
+    def __init__(self, proc="/proc", workers=NAMESPACE_WORKERS,
+                 parallel=None):
+        NetStat.__init__(self, parallel=parallel)
+        self.proc = proc
+
+        # Namespace inode of every pid, as found when first seen, None
+        # if denied
+        self.pid_namespaces = {}
+        # Pid the tables of every namespace are read through, and the
+        # name of every namespace, by inode
+        self.readers = {}
+        self.names = {}
+        # Sockets of the last collect(), by namespace name
+        self.sockets = {}
+
+        self.host = _namespace(proc, "self")
+        self.mount = _namespace(proc, "self", "mnt")
+        self.workers = ThreadPool(workers)
+
+    def close(self):
+        NetStat.close(self)
+        self.workers.terminate()
+
+    def refresh(self):
+        """
+        Update the namespaces from the pids running
+        """
+        pids = {}
+        known = self.pid_namespaces
+        for pid in os.listdir(self.proc):
+            if not pid.isdigit():
+                continue
+            if pid in known:
+                pids[pid] = known[pid]
+            else:
+                pids[pid] = _namespace(self.proc, pid)
+        self.pid_namespaces = pids
+
+        readers = {}
+        for pid, inode in pids.iteritems():
+            if inode is None:
+                continue
+            reader = readers.get(inode)
+            if reader is None or int(pid) < int(reader):
+                readers[inode] = pid
+        self.readers = readers
+
+        names = self.names
+        for inode in list(names):
+            if inode not in readers:
+                del names[inode]
+        taken = set(names.itervalues())
+        for inode, pid in readers.iteritems():
+            if inode in names:
+                continue
+            name = None
+            if inode == self.host:
+                name = HOST_NAMESPACE
+            elif _namespace(self.proc, pid, "mnt") != self.mount:
+                # Not the /etc/hostname of netpath
+                name = _hostname(self.proc, pid)
+            name = name or "netns:%d" % inode
+            if name in taken:
+                name = "%s:%d" % (name, inode)
+            names[inode] = name
+            taken.add(name)
+
+    def collect(self, protocols, ret_format, socket_filter=None):
+        """
+        Collect the sockets of every namespace, as NetStat.collect()
+
+        Returns:
+        Return the list of SocketTable, the tables of every namespace in
+        the order of their names
+        """
+        with self.stats.timer("namespaces"):
+            self.refresh()
+        self.stats.count("namespaces", len(self.readers))
+
+        namespaces = sorted(self.readers.items(),
+                            key=lambda item: self.names[item[0]])
+        contents = self.workers.map(
+            lambda namespace: self._read(namespace, protocols), namespaces)
+
+        tables = []
+        sockets = {}
+        for (inode, pid), tables_content in zip(namespaces, contents):
+            if tables_content is None:
+                # Exited or joined another namespace while read, found
+                # again by the next refresh()
+                self.pid_namespaces.pop(pid, None)
+                continue
+
+            name = self.names[inode]
+            sockets[name] = 0
+            for proto, content in zip(protocols, tables_content):
+                table = self.parse_net(proto, content, ret_format,
+                                       socket_filter)
+                table.host = name
+                sockets[name] += len(table)
+                tables.append(table)
+        self.sockets = sockets
+
+        return tables
+
+    def _read(self, namespace, protocols):
+        # The tables of a namespace, None if its reader left it
+        inode, pid = namespace
+        source = ProcSource(os.path.join(self.proc, pid, "net"))
+        contents = []
+        with self.stats.timer("read"):
+            for proto in protocols:
+                try:
+                    contents.append(source.read(proto))
+                except IOError:
+                    contents.append("")
+
+        if _namespace(self.proc, pid) != inode:
+            return None
+
+        return contents
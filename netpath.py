@@ -17,20 +17,46 @@
 # MA  02110-1301, USA.  A copy of the GNU General Public License is
 # also available at http://www.gnu.org/copyleft/gpl.html.
 
+import argparse
 import datetime
+import errno
 import fcntl
 import getpass
+import operator
 import os
+import select
+import signal
+import socket
+import struct
 import sys
-import time
+import tarfile
 import tty
 import termios
+import time
 
-from netstat import NetStat
+import aggregate
+import export
+
+from collector import Collector, MAX_INTERVAL, MIN_INTERVAL
+from export import EXPORT_FORMATS
+from fleet import AGENT_HOST, AGENT_PORT, Agent, Fleet, parse_address, \
+    parse_listen_address
+from history import HISTORY_SECONDS, History, sparkline
+from namespaces import Namespaces
+from netstat import NetStat, PROTOCOLS
+from parallel import ParallelParser
+from procindex import ProcessIndex
+from profiling import Profiler, Stats
+from recorder import RECORD_MAX_BYTES, Recorder, Replay
+from resolver import Resolver
+from scheduler import DEGRADE_NONE, DEGRADE_SUMMARY, DEGRADE_USERS, Scheduler
+from socketfilter import SocketFilter, filter_expression
+from socketindex import SocketIndex
+from source import open_source
 
 
 class FormatDisplay:
-    LISTEN, HUMAN_BEING, HEX = range(0, 3)
+    LISTEN, HUMAN_BEING, HEX, SUMMARY, INTERFACES, PROTOCOLS = range(0, 6)
 
 
 class Color:
@@ -38,31 +64,118 @@ class Color:
 
 
 class Filter:
-    IP, PORT, IP_PORT, STATE, USER = range(0, 5)
+    IP, PORT, IP_PORT, STATE, USER, EXPRESSION = range(0, 6)
 
 
 class Highlight:
-    IP, PORT, IP_PORT, STATE, USER = range(0, 5)
+    IP, PORT, IP_PORT, STATE, USER, EXPRESSION = range(0, 6)
 
 
-def _print_colored(color, raw_str):
-    ASCII_WHITE_TEXT_BACKGROUND_RED = "\x1b[41m"
-    ASCII_WHITE_TEXT_BACKGROUND_BLUE = "\x1b[44m"
-    ASCII_WHITE_TEXT_BACKGROUND_BLACK = "\x1b[49m\r"
+# Filter type and prompt of the Filter and Highlight menu entries
+FILTER_PROMPTS = (
+    ("ip", "Type the IP:"),
+    ("port", "Type the Port:"),
+    ("ip:port", "Type the IP:Port:"),
+    ("state", "Type State:"),
+    ("user", "Type User:"),
+    ("expression", "Type the expression:"),
+)
+
+
+ASCII_WHITE_TEXT_BACKGROUND_RED = "\x1b[41m"
+ASCII_WHITE_TEXT_BACKGROUND_BLUE = "\x1b[44m"
+ASCII_WHITE_TEXT_BACKGROUND_BLACK = "\x1b[49m"
+ASCII_CLEAR_SCREEN = "\x1b[H\x1b[2J"
+ASCII_CLEAR_LINE = "\x1b[K"
+ASCII_CLEAR_BELOW = "\x1b[J"
+ASCII_MOVE_CURSOR = "\x1b[%d;1H"
+
+# Collections drawn by every sparkline
+SPARKLINE_WIDTH = 20
+
+# Labels and counters.INTERFACE_COUNTERS positions of the columns of the
+# interfaces screen, the rates per second then the totals
+INTERFACE_COLUMNS = ("RX B/s", "RX pkt/s", "RX err/s", "RX drop/s",
+                     "TX B/s", "TX pkt/s", "TX err/s", "TX drop/s",
+                     "RX bytes", "TX bytes")
+INTERFACE_RATES = (0, 1, 2, 3, 8, 9, 10, 11)
+INTERFACE_TOTALS = (0, 8)
+# Counters turning an interface red when rising
+INTERFACE_ERRORS = (2, 3, 10, 11)
 
+NO_COUNTERS = "No counters: only the sockets are replayed or collected " \
+    "from agents"
+
+# Width of the host column when showing a fleet or the namespaces
+HOST_WIDTH = 20
+
+# Keys scrolling the sockets, by lines or by pages
+SCROLL_LINE_KEYS = {'j': 1, 'k': -1, '\x1b[B': 1, '\x1b[A': -1}
+SCROLL_PAGE_KEYS = {' ': 1, 'b': -1, '\x1b[6~': 1, '\x1b[5~': -1}
+
+
+def _colored(color, raw_str):
     if color == Color.RED:
-        print("%s" %
-              ASCII_WHITE_TEXT_BACKGROUND_RED +
-              raw_str +
-              ASCII_WHITE_TEXT_BACKGROUND_BLACK
-              )
+        return ASCII_WHITE_TEXT_BACKGROUND_RED + raw_str + \
+            ASCII_WHITE_TEXT_BACKGROUND_BLACK
 
     if color == Color.BLUE:
-        print("%s" %
-              ASCII_WHITE_TEXT_BACKGROUND_BLUE +
-              raw_str +
-              ASCII_WHITE_TEXT_BACKGROUND_BLACK
-              )
+        return ASCII_WHITE_TEXT_BACKGROUND_BLUE + raw_str + \
+            ASCII_WHITE_TEXT_BACKGROUND_BLACK
+
+
+def _scaled(value):
+    # A counter or a rate with a K, M or G suffix, "-" if unknown
+    if value is None:
+        return "-"
+
+    for suffix in ("", "K", "M", "G"):
+        if value < 1000 or suffix == "G":
+            break
+        value /= 1000.0
+
+    if suffix or isinstance(value, float):
+        return "%.1f%s" % (value, suffix)
+    return str(value)
+
+
+def _print_colored(color, raw_str):
+    print(_colored(color, raw_str) + "\r")
+
+
+def _read_filter(choice, conn_status):
+    """
+    Read the value of a filter or highlight chosen in the menu, again
+    until valid
+
+    Returns:
+    Return the (filter_type, filter_data), None if nothing typed
+    """
+    filter_type, prompt = FILTER_PROMPTS[choice]
+    while True:
+        filter_data = raw_input(prompt).strip()
+        if not filter_data:
+            return None
+
+        try:
+            SocketFilter(filter_type, filter_data, conn_status)
+        except ValueError as e:
+            print "Invalid filter: %s" % e
+            continue
+
+        return filter_type, filter_data
+
+
+def _compile_filter(compiled, filter_type, filter_data, conn_status):
+    # The SocketFilter compiled before is kept while the same
+    if compiled is None or compiled.filter_type != filter_type or \
+            compiled.filter_data != filter_data:
+        try:
+            compiled = SocketFilter(filter_type, filter_data, conn_status)
+        except ValueError:
+            compiled = None
+
+    return compiled
 
 
 class Terminal:
@@ -79,9 +192,22 @@ class Terminal:
         )
 
     def set_raw(self):
-        fcntl.fcntl(sys.stdin, fcntl.F_SETFL, os.O_NDELAY)
         tty.setraw(sys.stdin.fileno())
 
+    def size(self):
+        """
+        Returns:
+        Return the (rows, columns) of the terminal, 24x80 if unknown
+        """
+        try:
+            rows, columns = struct.unpack("hh", fcntl.ioctl(
+                sys.stdout.fileno(), termios.TIOCGWINSZ, "\0" * 4
+            ))
+        except IOError:
+            return 24, 80
+
+        return rows or 24, columns or 80
+
 
 class NetPath:
     def __init__(self):
@@ -91,23 +217,70 @@ class NetPath:
         self.filter = None
         self.filter_data = None
         self.filter_type = None
+        self._socket_filter = None
 
         self.highlight = None
         self.highlight_data = None
         self.highlight_type = None
+        self._highlight_filter = None
+
+        # Recorder of the 'l' key while logging, Replay when replaying
+        self.recorder = None
+        self.replay = None
+        # fleet.Fleet when showing the sockets of many hosts
+        self.fleet = None
+        # namespaces.Namespaces when showing the sockets of every
+        # network namespace
+        self.namespaces = None
+        # resolver.Resolver of the NetStat while showing the host names
+        self.resolver = None
+        # scheduler.Scheduler of --max-cpu, and its degradation level
+        # when the last collection was received
+        self.scheduler = None
+        self.level = DEGRADE_NONE
+
+        # Stats of NetStat, shown over the sockets by the 's' key
+        self.stats = Stats()
+        self.show_stats = False
+        self.overlay = []
+        # profiling.Profiler of --profile
+        self.profiler = None
+
+        # Last frame written by draw(), None forces a full redraw
+        self.frame = None
+        # Connections opened and closed per second
+        self.churn = (0.0, 0.0)
 
         self.terminal = Terminal()
+        self.height, self.width = self.terminal.size()
+        # First socket shown and sockets in the table, see render()
+        self.scroll = 0
+        self.rows = 0
+        # history.History drawn as sparklines over the footer, if any
+        self.history = None
 
     def help(self):
         self.terminal.set_default()
 
         print("c - clear any created highlight or filter")
-        print("f - filter the screen by ip address, port, state or user")
+        print("f - filter the screen by ip address, port, state, user or "
+              "expression")
         print("h - print this screen")
-        print("H - highlight a ip address, port, state or user")
+        print("H - highlight a ip address, port, state, user or expression")
+        print("    expressions as: state established and ip 10.0.0.0/8 "
+              "and port 5432 and rx_queue > 0")
+        print("j/k, arrows - scroll one line down/up")
+        print("space/b, page down/up - scroll one page down/up")
         print("l - logging filtered or highlight hosts")
-        print("n - next (mode) system status screen")
+        if self.replay is not None:
+            print(", / . - replay the previous / next collection")
+            print("p - pause or resume the replay")
+        print("n - next mode: listen, all connections, hex, summary, "
+              "interfaces, protocols")
         print("q - quit")
+        print("r - show the names of the remote hosts, resolved in the "
+              "background, or their ips")
+        print("s - show or hide the time spent per stage")
 
         # stdin already consumed to get the option from while
         # reopening stdin
@@ -117,28 +290,48 @@ class NetPath:
         self.terminal.set_raw()
 
     def header(self):
-        if self.output_format != FormatDisplay.HEX:
-            header = "{0} {1} {2} {3} {4} {5} {6}\r".format(
+        if self.output_format == FormatDisplay.SUMMARY or \
+                self.summary_only():
+            header = "{0} {1}".format("Summary".ljust(40), "Sockets")
+
+        elif self.output_format == FormatDisplay.INTERFACES:
+            header = "{0} {1}".format("Interface".ljust(16), " ".join(
+                label.rjust(9) for label in INTERFACE_COLUMNS))
+
+        elif self.output_format == FormatDisplay.PROTOCOLS:
+            header = "{0} {1} {2}".format(
+                "Counter".ljust(32), "Total".rjust(12),
+                "Per second".rjust(12))
+
+        elif self.output_format != FormatDisplay.HEX:
+            header = "{0} {1} {2} {3} {4} {5} {6} {7}".format(
                 "Proto",
                 "Recv-Q",
                 "Send-Q".rjust(6),
                 "Local Address".ljust(27),
                 "Foreign Address".ljust(27),
                 "State".ljust(12),
-                "User"
+                "User".ljust(10),
+                "PID/Program name"
             )
         else:
-            header = "{0} {1} {2} {3} {4} {5} {6}\r".format(
+            header = "{0} {1} {2} {3} {4} {5} {6} {7}".format(
                 "Proto",
                 "Recv-Q",
                 "Send-Q".rjust(8),
                 "Local Address".ljust(27),
                 "Foreign Address".ljust(27),
                 "State".ljust(12),
-                "User"
+                "User".ljust(10),
+                "PID/Program name"
             )
 
-        _print_colored(Color.BLUE, header)
+        if self.host_column() is not None and \
+                self.output_format < FormatDisplay.SUMMARY and \
+                not self.summary_only():
+            header = self.host_column().ljust(HOST_WIDTH) + " " + header
+
+        return header
 
     def footer(self):
         if self.output_format == FormatDisplay.LISTEN:
@@ -150,14 +343,189 @@ class NetPath:
         if self.output_format == FormatDisplay.HEX:
             mode = " | Mode: All Connections (Hex)"
 
+        if self.output_format == FormatDisplay.SUMMARY:
+            mode = " | Mode: Summary"
+
+        if self.output_format == FormatDisplay.INTERFACES:
+            mode = " | Mode: Interfaces"
+
+        if self.output_format == FormatDisplay.PROTOCOLS:
+            mode = " | Mode: Protocols"
+
+        if self.summary_only():
+            mode = " | Mode: Summary (saving CPU)"
+
         footer = "Logged as " + getpass.getuser() + \
             " | Press h for help | " + \
             datetime.datetime.now().strftime(
                 '%Y/%m/%d %H:%M'
-            ) + mode
+            ) + mode + \
+            self.filter_status() + \
+            " | Churn: +%d/s -%d/s" % self.churn + \
+            self.recording_status() + \
+            self.fleet_status() + \
+            self.namespace_status() + \
+            self.resolver_status() + \
+            self.scheduler_status() + \
+            self.profile_status() + \
+            " | Rows %d-%d of %d" % (
+                min(self.scroll + 1, self.rows),
+                min(self.scroll + self.page_size(), self.rows),
+                self.rows
+            )
 
         return footer
 
+    def filter_status(self):
+        status = ""
+        if self.filter is not None:
+            status += " | Filter: " + \
+                filter_expression(self.filter_type, self.filter_data)
+        if self.highlight is not None:
+            status += " | Highlight: " + \
+                filter_expression(self.highlight_type, self.highlight_data)
+
+        return status
+
+    def recording_status(self):
+        if self.recorder is not None:
+            return " | Logging to " + self.recorder.path
+
+        replay = self.replay
+        if replay is not None and replay.time is not None:
+            return " | Replay %s %d/%d%s" % (
+                datetime.datetime.fromtimestamp(replay.time).strftime(
+                    '%Y/%m/%d %H:%M:%S'),
+                replay.position + 1, len(replay),
+                " (paused)" if replay.paused else ""
+            )
+
+        return ""
+
+    def profile_status(self):
+        if self.profiler is None:
+            return ""
+
+        if self.profiler.done:
+            return " | Profile in " + self.profiler.path
+
+        return " | Profiling"
+
+    def host_column(self):
+        """
+        Returns:
+        Return the title of the column of the host of the sockets, None
+        if they are all of this host
+        """
+        if self.fleet is not None:
+            return "Host"
+        if self.namespaces is not None:
+            return "Namespace"
+        return None
+
+    def summary_only(self):
+        """
+        Returns:
+        Return True while the summary is shown in place of the sockets,
+        the scheduler saving CPU
+        """
+        return self.level >= DEGRADE_SUMMARY and \
+            self.output_format < FormatDisplay.SUMMARY
+
+    def scheduler_status(self):
+        scheduler = self.scheduler
+        if scheduler is None:
+            return ""
+
+        status = " | %.1f/s" % scheduler.rate()
+        if scheduler.cpu is not None:
+            status += ", CPU %.1f%%" % (scheduler.cpu * 100)
+        status += " of %g%%" % (scheduler.max_cpu * 100)
+        if self.level >= DEGRADE_USERS:
+            status += ", uids"
+        return status
+
+    def resolver_status(self):
+        resolver = self.resolver
+        if resolver is None:
+            return ""
+
+        return " | Names %d pending" % (len(resolver.pending) +
+                                        len(resolver.waiting))
+
+    def namespace_status(self):
+        if self.namespaces is None:
+            return ""
+
+        return " | Namespaces %d" % len(self.namespaces.sockets)
+
+    def fleet_status(self):
+        fleet = self.fleet
+        if fleet is None:
+            return ""
+
+        up = [host for host in fleet.hosts if fleet.status[host] == "ok"]
+        status = " | Hosts %d/%d" % (len(up), len(fleet.hosts))
+        if up:
+            slowest = max(up, key=fleet.latency.get)
+            status += ", slowest %s %d ms" % (
+                slowest, fleet.latency[slowest] * 1000)
+
+        return status
+
+    def page_size(self):
+        # Lines left for the sockets between the header and the footer
+        footer = 1
+        if self.history is not None:
+            footer = 2
+        return max(self.height - 1 - len(self.overlay) - footer, 1)
+
+    def sparklines(self):
+        """
+        Build the line of the trends of the last collections
+
+        Returns:
+        Return the line, encoded in UTF-8
+        """
+        history = self.history
+        # Nothing older than --history, whatever the interval
+        count = history.recent(SPARKLINE_WIDTH)
+        trends = (
+            ("New/s", history.opened.values(count)),
+            ("Closed/s", history.closed.values(count)),
+            ("Retrans/s", history.rate(history.retransmits, count - 1)),
+            ("SYN_RECV", history.states[3].values(count)),
+            ("Recv-Q", history.rx_queue.values(count)),
+        )
+
+        line = u" | ".join(
+            u"%s %s %.1f" % (label, sparkline(values),
+                             values[-1] if values else 0)
+            for label, values in trends
+        )
+        return line[:self.width].encode("utf-8")
+
+    def update_size(self):
+        """
+        Read the terminal size again
+
+        Returns:
+        Return True if it changed, the screen must then be reformatted
+        """
+        size = self.terminal.size()
+        if size == (self.height, self.width):
+            return False
+
+        self.height, self.width = size
+        self.frame = None
+        return True
+
+    def scroll_by(self, lines):
+        """
+        Scroll the sockets, render() keeps the scroll within the table
+        """
+        self.scroll = max(self.scroll + lines, 0)
+
     @property
     def output_format(self):
         return self.output_format
@@ -166,89 +534,410 @@ class NetPath:
     def output_format(self, value):
         self.output_format = value
 
-    def print_highlight(self, hlight_data, hlight_type, message, data):
-        if hlight_type == "ip":
-            if hlight_data == data['rem_address'].split(":")[0] or \
-                    hlight_data == data['local_address'].split(":")[0]:
-                _print_colored(Color.RED, message)
-
-        if hlight_type == "port":
-            if hlight_data == data['rem_address'].split(":")[1] or \
-                    hlight_data == data['local_address'].split(":")[1]:
-                _print_colored(Color.RED, message)
-
-        if hlight_type == "ip:port":
-            if hlight_data == data['rem_address'] or \
-                    hlight_data == data['local_address']:
-                _print_colored(Color.RED, message)
-
-        if hlight_type == "state" and hlight_data == data['st']:
-            _print_colored(Color.RED, message)
-
-        if hlight_type == "user" and hlight_data == data['uid']:
-            _print_colored(Color.RED, message)
+    def format_line(self, data, highlighted=False):
+        """
+        Build the screen line of a socket
 
-    def print_filter(self, filter_data, filter_type, message, data):
-        if filter_type == "ip":
-            if filter_data == data['rem_address'].split(":")[0] or \
-                    filter_data == data['local_address'].split(":")[0]:
-                print(message)
+        Arguments:
+        data -- The row returned by NetStat.collect_net_tcp()
+        highlighted -- True if the highlight matches the socket, see
+                       socketindex.SocketIndex.select()
 
-        if filter_type == "port":
-            if filter_data == data['rem_address'].split(":")[1] or \
-                    filter_data == data['local_address'].split(":")[1]:
-                print(message)
+        Returns:
+        Return the line, colored if highlighted
+        """
+        rx, tx = data['tx_queue_rx_queue'].split(":")
 
-        if filter_type == "ip:port":
-            if filter_data == data['rem_address'] or \
-                    filter_data == data['local_address']:
-                print(message)
+        # Layout for non hex screen
+        if self.output_format != FormatDisplay.HEX:
+            line = "{0} {1} {2} {3} {4} {5} {6} {7}".format(
+                data['proto'],
+                rx.rjust(8),
+                tx.rjust(6),
+                data['local_address'].ljust(27),
+                data['rem_address'].ljust(27),
+                data['st'].ljust(12),
+                data['uid'].ljust(10),
+                data['program']
+            )
 
-        if filter_type == "state" and filter_data == data['st']:
-            print(message)
+        # Layout for hex screen (the fields size are different)
+        if self.output_format == FormatDisplay.HEX:
+            line = "{0} {1} {2} {3} {4} {5} {6} {7}".format(
+                data['proto'],
+                rx.rjust(8),
+                tx.rjust(6),
+                data['local_address'].ljust(27),
+                data['rem_address'].ljust(27),
+                data['st'].ljust(12),
+                data['uid'].ljust(10),
+                data['program']
+            )
 
-        if filter_type == "user" and filter_data == data['uid']:
-            print(message)
+        if self.host_column() is not None:
+            line = data['host'][:HOST_WIDTH].ljust(HOST_WIDTH) + " " + line
+
+        # Wrapped lines would shift the rows below
+        line = line[:self.width]
+
+        if highlighted:
+            return _colored(Color.RED, line)
+
+        return line
+
+    def render(self, lines, keys, format_line=None):
+        """
+        Draw the sockets fitting in the terminal, between the header
+        and the footer
+
+        Arguments:
+        lines -- Screen line of every socket, by socket key
+        keys -- Keys of the sockets, in the display order
+        format_line -- Function formatting the line of the socket of a
+                       position in keys, the lines are then a cache of
+                       the dict filled for the sockets shown
+        """
+        self.overlay = []
+        if self.show_stats:
+            self.overlay = self.stats_lines()
+
+        page_size = self.page_size()
+        self.rows = len(keys)
+        self.scroll = max(min(self.scroll, self.rows - page_size), 0)
+
+        shown = keys[self.scroll:self.scroll + page_size]
+        if format_line is not None:
+            formatted = 0
+            with self.stats.timer("format"):
+                for position, key in enumerate(shown, self.scroll):
+                    if key not in lines:
+                        lines[key] = format_line(position)
+                        formatted += 1
+            self.stats.count("lines formatted", formatted)
+
+        frame = [_colored(Color.BLUE, self.header()[:self.width])]
+        frame.extend(self.overlay)
+        frame.extend(lines[key] for key in shown)
+        if self.history is not None:
+            frame.append(self.sparklines())
+        frame.append(_colored(
+            Color.BLUE, self.footer().center(self.width)[:self.width]
+        ))
+        self.draw(frame)
+
+    def stats_lines(self):
+        """
+        Build the lines of the stats overlay: time per stage, counters
+        and cache hit rates
+
+        Returns:
+        Return the list of lines
+        """
+        stats = self.stats
+        width = self.width
+        lines = [_colored(Color.BLUE, "{0} {1} {2} {3}".format(
+            "Stage".ljust(16), "Calls".rjust(8), "Last ms".rjust(10),
+            "Avg ms".rjust(10)).ljust(48)[:width])]
+        for name in list(stats.stages):
+            calls, seconds, last = stats.timers[name]
+            lines.append("{0} {1:8d} {2:10.2f} {3:10.2f}".format(
+                name.ljust(16), calls, last * 1000,
+                seconds * 1000 / calls)[:width])
+
+        counters = sorted(stats.counters.items())
+        lines.append(" | ".join("%s %d" % item for item in counters)[:width])
+        lines.append(" | ".join(
+            "%s cache %d%% hits" % (
+                name, cache.hits * 100 / max(cache.hits + cache.misses, 1))
+            for name, cache in sorted(stats.caches.items())
+        )[:width])
+
+        return lines
+
+    def summary_lines(self, summary, netstat):
+        """
+        Build the lines of the summary screen
+
+        Arguments:
+        summary -- aggregate.Summary of the collection
+        netstat -- NetStat which collected, to name the counters keys
+
+        Returns:
+        Return the list of lines, only the top counters are formatted
+        """
+        width = self.width
+        lines = ["{0} {1}".format("All".ljust(40), summary.total)[:width]]
+
+        def section(title, counter, name):
+            lines.append("")
+            lines.append(_colored(Color.BLUE, title.ljust(48)[:width]))
+            for key, count in aggregate.top(counter):
+                lines.append(
+                    "{0} {1}".format(name(key).ljust(40), count)[:width])
+
+        section("State", summary.states,
+                lambda state: netstat.conn_status[str(state)])
+        section("Top %d remote hosts" % aggregate.TOP_COUNT,
+                summary.remote_hosts, netstat.human_ip)
+        section("TIME_WAIT per local port", summary.time_wait_ports, str)
+        section("Top %d local ports" % aggregate.TOP_COUNT,
+                summary.local_ports, str)
+        section("User", summary.users, netstat.username)
+
+        if self.namespaces is not None:
+            section("Top %d namespaces" % aggregate.TOP_COUNT,
+                    self.namespaces.sockets, str)
+
+        if self.history is not None:
+            lines.extend(self.trend_lines(netstat))
+
+        fleet = self.fleet
+        if fleet is not None:
+            lines.append("")
+            lines.append(_colored(Color.BLUE, "Host".ljust(48)[:width]))
+            for host in fleet.hosts:
+                status = fleet.status[host]
+                if status == "ok":
+                    status = "%d sockets in %d ms" % (
+                        fleet.sockets[host], fleet.latency[host] * 1000)
+                lines.append(
+                    "{0} {1}".format(host.ljust(40), status)[:width])
+
+        return lines
+
+    def trend_lines(self, netstat):
+        """
+        Build the lines of the busiest listening ports and of the most
+        queued connections of the history, with their sparklines
+
+        Arguments:
+        netstat -- NetStat which collected, to name the addresses
+
+        Returns:
+        Return the list of lines
+        """
+        history = self.history
+        width = self.width
+        count = history.recent(SPARKLINE_WIDTH)
+        lines = []
+
+        def trend(name, values, last):
+            lines.append(u"{0} {1} {2}".format(
+                name.ljust(46), sparkline(values).ljust(SPARKLINE_WIDTH),
+                last)[:width].encode("utf-8"))
+
+        ports = sorted(history.ports.iteritems(),
+                       key=lambda item: -item[1].last())
+        if ports:
+            lines.append("")
+            lines.append(_colored(Color.BLUE, "Connections per listening "
+                                  "port".ljust(48)[:width]))
+            for port, series in ports:
+                trend(str(port), series.values(count), series.last())
+
+        queues = sorted(history.queues.iteritems(),
+                        key=lambda item: -(item[1][0].last() +
+                                           item[1][1].last()))
+        if queues:
+            lines.append("")
+            lines.append(_colored(Color.BLUE, "Most queued connections, "
+                                  "Recv-Q:Send-Q".ljust(48)[:width]))
+            for key, (tx_series, rx_series) in queues:
+                # The host first in the keys of the tables of a fleet
+                proto, local_ip, local_port, rem_ip, rem_port = key[-6:-1]
+                name = "%s %s %s" % (
+                    proto, netstat.human_address(local_ip, local_port),
+                    netstat.human_address(rem_ip, rem_port))
+                trend(name, map(operator.add, tx_series.values(count),
+                                rx_series.values(count)),
+                      "%d:%d" % (rx_series.last(), tx_series.last()))
+
+        return lines
+
+    def interface_lines(self, counters):
+        """
+        Build the lines of the interfaces screen
+
+        Arguments:
+        counters -- counters.Counters sampled, None if the NetStat has no
+                    counters
+
+        Returns:
+        Return the list of lines, an interface with errors or drops in
+        the last interval is red
+        """
+        if counters is None:
+            return [NO_COUNTERS[:self.width]]
+
+        lines = []
+        for name, values, rates in counters.interfaces:
+            shown = [values[column] for column in INTERFACE_TOTALS]
+            if rates is None:
+                shown = [None] * len(INTERFACE_RATES) + shown
+            else:
+                shown = [rates[column] for column in INTERFACE_RATES] + shown
+            line = "{0} {1}".format(name.ljust(16), " ".join(
+                _scaled(value).rjust(9) for value in shown))[:self.width]
+            if rates is not None and \
+                    any(rates[column] for column in INTERFACE_ERRORS):
+                line = _colored(Color.RED, line)
+            lines.append(line)
+
+        return lines
+
+    def protocol_lines(self, counters):
+        """
+        Build the lines of the protocols screen, the counters under the
+        title of their group
+
+        Arguments:
+        counters -- counters.Counters sampled, None if the NetStat has no
+                    counters
+
+        Returns:
+        Return the list of lines
+        """
+        if counters is None:
+            return [NO_COUNTERS[:self.width]]
+
+        width = self.width
+        lines = []
+        last_group = None
+        for group, name, value, rate in counters.protocols:
+            if group != last_group:
+                if lines:
+                    lines.append("")
+                lines.append(_colored(Color.BLUE, group.ljust(58)[:width]))
+                last_group = group
+            lines.append("{0} {1} {2}".format(
+                name.ljust(32), str(value).rjust(12),
+                _scaled(rate).rjust(12))[:width])
+
+        return lines
+
+    def draw(self, frame):
+        """
+        Write a frame to the terminal
+
+        Arguments:
+        frame -- List of lines of the screen, from the top
+
+        Only the lines which differ from the previous frame are written,
+        the cursor is moved to them instead of clearing the screen.
+        """
+        previous = self.frame
+        output = []
+        if previous is None:
+            previous = []
+            output.append(ASCII_CLEAR_SCREEN)
+
+        for row, line in enumerate(frame):
+            if row >= len(previous) or previous[row] != line:
+                output.append(ASCII_MOVE_CURSOR % (row + 1))
+                output.append(line + ASCII_CLEAR_LINE)
+
+        if len(frame) < len(previous):
+            output.append(ASCII_MOVE_CURSOR % (len(frame) + 1))
+            output.append(ASCII_CLEAR_BELOW)
+
+        output = "".join(output)
+        with self.stats.timer("draw"):
+            sys.stdout.write(output)
+            sys.stdout.flush()
+        self.stats.count("terminal bytes", len(output))
+        self.frame = frame
 
     def set_display_filter(self):
         fmt = "human_being"
-        self.filter = Filter.STATE
-        self.filter_type = "state"
-        self.filter_data = "LISTEN"
-
-        if self.output_format == FormatDisplay.HUMAN_BEING:
-            fmt = "human_being"
-            self.filter = None
-            self.filter_type = None
-            self.filter_data = None
 
         if self.output_format == FormatDisplay.HEX:
             fmt = "hex"
-            self.filter = None
-            self.filter_type = None
-            self.filter_data = None
-        return fmt
-
-    def set_filter(self, filter):
-        if filter == Filter.IP:
-            self.filter_type = "ip"
-            self.filter_data = raw_input("Type the IP:")
-
-        if filter == Filter.PORT:
-            self.filter_type = "port"
-            self.filter_data = raw_input("Type the Port:")
 
-        if filter == Filter.IP_PORT:
-            self.filter_type = "ip:port"
-            self.filter_data = raw_input("Type the IP:Port:")
-
-        if filter == Filter.STATE:
-            self.filter_type = "state"
-            self.filter_data = raw_input("Type State:")
+        # Only counters, the rows are never formatted
+        if self.output_format >= FormatDisplay.SUMMARY:
+            fmt = "hex"
+        return fmt
 
-        if filter == Filter.USER:
-            self.filter_type = "user"
-            self.filter_data = raw_input("Type User:")
+    def filter_expression(self):
+        """
+        Returns:
+        Return the expression of the sockets shown, the filter typed
+        and the listening state of the Listen mode, None for all
+        """
+        expressions = []
+        if self.output_format == FormatDisplay.LISTEN:
+            expressions.append("state LISTEN")
+        if self.filter is not None:
+            expressions.append(
+                filter_expression(self.filter_type, self.filter_data))
+
+        if not expressions:
+            return None
+        if len(expressions) == 1:
+            return expressions[0]
+        return " and ".join("(%s)" % expression
+                            for expression in expressions)
+
+    def socket_filter(self, conn_status):
+        """
+        Compile the current filter for the collector
+
+        Arguments:
+        conn_status -- NetStat.conn_status
+
+        Returns:
+        Return the SocketFilter, the same object while the filter
+        doesn't change, or None if there is no valid filter
+        """
+        expression = self.filter_expression()
+        if expression is None:
+            return None
+
+        self._socket_filter = _compile_filter(
+            self._socket_filter, "expression", expression, conn_status
+        )
+        return self._socket_filter
+
+    def highlight_filter(self, conn_status):
+        """
+        Compile the current highlight, as socket_filter() does
+        """
+        if self.highlight is None:
+            return None
+
+        self._highlight_filter = _compile_filter(
+            self._highlight_filter, self.highlight_type,
+            self.highlight_data, conn_status
+        )
+        return self._highlight_filter
+
+    def set_filter(self, filter, conn_status):
+        """
+        Read the value of a filter of the Filter menu, nothing typed
+        keeps the current filter
+
+        Arguments:
+        filter -- Filter entry
+        conn_status -- NetStat.conn_status, to check the value
+        """
+        typed = _read_filter(filter, conn_status)
+        if typed is None:
+            return
+
+        self.filter = filter
+        self.filter_type, self.filter_data = typed
+
+    def toggle_resolver(self, netstat):
+        """
+        Show the names of the remote hosts, or stop showing them
+        """
+        if netstat.resolver is None:
+            netstat.resolver = self.resolver = Resolver(netstat.human_ip)
+            self.stats.caches["names"] = self.resolver.cache
+        else:
+            netstat.resolver.close()
+            netstat.resolver = self.resolver = None
+            del self.stats.caches["names"]
 
     def cleandata(self):
         self.highlight = None
@@ -258,100 +947,436 @@ class NetPath:
         self.filter_data = None
         self.filter_type = None
 
-    def set_highlight(self, highlight):
-        if highlight == Highlight.IP:
-            self.highlight_type = "ip"
-            self.highlight_data = raw_input("Type the IP:")
-
-        if highlight == Highlight.PORT:
-            self.highlight_type = "port"
-            self.highlight_data = raw_input("Type the Port:")
-
-        if highlight == Highlight.IP_PORT:
-            self.highlight_type = "ip:port"
-            self.highlight_data = raw_input("Type the IP:Port:")
+    def set_highlight(self, highlight, conn_status):
+        """
+        Read the value of a highlight of the Highlight menu, as
+        set_filter()
+        """
+        typed = _read_filter(highlight, conn_status)
+        if typed is None:
+            return
 
-        if highlight == Highlight.STATE:
-            self.highlight_type = "state"
-            self.highlight_data = raw_input("Type State:")
-
-        if highlight == Highlight.USER:
-            self.highlight_type = "user"
-            self.highlight_data = raw_input("Type User:")
+        self.highlight = highlight
+        self.highlight_type, self.highlight_data = typed
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="netstat like in python")
+    parser.add_argument(
+        "--backend", choices=("proc", "netlink"), default="proc",
+        help="collect from /proc/net/tcp or netlink sock_diag"
+    )
+    parser.add_argument(
+        "--protocols", default="tcp,tcp6",
+        help="comma separated tables to collect, from " +
+        ",".join(PROTOCOLS) + " (default: tcp,tcp6)"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1.0,
+        help="seconds between two refreshes, from %.1f to %.1f "
+        "(default: 1)" % (MIN_INTERVAL, MAX_INTERVAL)
+    )
+    parser.add_argument(
+        "--filter", metavar="EXPRESSION",
+        help="show or export only the sockets matching an expression, "
+        "as 'state established and port 5432 and rx_queue > 0'"
+    )
+    parser.add_argument(
+        "--highlight", metavar="EXPRESSION",
+        help="highlight the sockets matching an expression"
+    )
+    parser.add_argument(
+        "--export", choices=EXPORT_FORMATS,
+        help="write the sockets to the output instead of showing them"
+    )
+    parser.add_argument(
+        "--counters", action="store_true",
+        help="export the interface and protocol counters instead of the "
+        "sockets"
+    )
+    parser.add_argument(
+        "--count", type=int, default=0,
+        help="collections exported, 0 for no end (default: 0)"
+    )
+    parser.add_argument(
+        "--output",
+        help="file receiving the export, rewritten on every collection "
+        "for prometheus (default: stdout)"
+    )
+    parser.add_argument(
+        "--history", type=int, default=HISTORY_SECONDS,
+        help="seconds of counters kept for the trends, 0 to disable "
+        "them (default: %d)" % HISTORY_SECONDS
+    )
+    parser.add_argument(
+        "--record", default="netpath.rec",
+        help="file written while logging with the l key "
+        "(default: netpath.rec)"
+    )
+    parser.add_argument(
+        "--record-size", type=int, default=RECORD_MAX_BYTES >> 20,
+        help="MB of a recording before it is rotated (default: %d)" %
+        (RECORD_MAX_BYTES >> 20)
+    )
+    parser.add_argument(
+        "--replay",
+        help="show a file recorded with the l key instead of the sockets"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0,
+        help="processes parsing the big tables, 0 for one per core, 1 to "
+        "parse on one core (default: 0)"
+    )
+    parser.add_argument(
+        "--hosts",
+        help="comma separated agents to collect from instead of this "
+        "host, as host or host:port (default port: %d)" % AGENT_PORT
+    )
+    parser.add_argument(
+        "--agent", metavar="[HOST:]PORT",
+        help="serve the sockets of this host, or of --source, to --hosts, "
+        "on %s unless a host is given, as 0.0.0.0:%d" % (AGENT_HOST,
+                                                        AGENT_PORT)
+    )
+    parser.add_argument(
+        "--max-cpu", metavar="PERCENT",
+        help="share of one core netpath may use, as 5%%: the refreshes "
+        "slow down past --interval and show fewer details to stay under "
+        "it"
+    )
+    parser.add_argument(
+        "--resolve", action="store_true",
+        help="show the names of the remote hosts, as the r key"
+    )
+    parser.add_argument(
+        "--namespaces", action="store_true",
+        help="show the sockets of every network namespace, of the "
+        "containers of the host, with their namespace"
+    )
+    parser.add_argument(
+        "--profile", type=int, default=0, metavar="FRAMES",
+        help="write the cProfile stats of the first frames to "
+        "--profile-output"
+    )
+    parser.add_argument(
+        "--profile-output", default="netpath.prof",
+        help="pstats file of --profile (default: netpath.prof)"
+    )
+    parser.add_argument(
+        "--source",
+        help="read the tables captured in a file, a directory or a "
+        "tarball instead of /proc/net"
+    )
+    args = parser.parse_args()
+
+    if args.interval < MIN_INTERVAL or args.interval > MAX_INTERVAL:
+        parser.error("interval out of range: %s" % args.interval)
+
+    protocols = args.protocols.split(",")
+    for proto in protocols:
+        if proto not in PROTOCOLS:
+            parser.error("unknown protocol: %s" % proto)
+
+    if args.workers < 0:
+        parser.error("invalid number of workers: %d" % args.workers)
+
+    max_cpu = None
+    if args.max_cpu:
+        try:
+            max_cpu = float(args.max_cpu.rstrip("%")) / 100
+        except ValueError:
+            max_cpu = 0
+        if not 0 < max_cpu <= 1:
+            parser.error("invalid CPU share: %s" % args.max_cpu)
+
+    if args.counters and not args.export:
+        parser.error("--counters is only exported, see --export")
+
+    if args.namespaces and (args.export or args.agent or args.hosts or
+                            args.replay or args.source):
+        parser.error("--namespaces only shows the sockets of this host")
+
+    # The tables are given to the workers once big enough for them to
+    # be faster, as measured while parsing
+    parallel = None
+    if args.workers != 1:
+        parallel = ParallelParser(args.workers or None)
+
+    try:
+        source = open_source(args.source)
+    except (IOError, tarfile.TarError) as e:
+        parser.error(str(e))
+
+    if args.agent:
+        # Headless, serves until interrupted
+        netstat = NetStat(backend=args.backend, source=source,
+                         parallel=parallel)
+        try:
+            agent = Agent(netstat, parse_listen_address(args.agent))
+        except (ValueError, socket.error) as e:
+            parser.error(str(e))
+        try:
+            agent.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            agent.shutdown()
+            netstat.close()
+        sys.exit(0)
+
+    if args.export:
+        # Headless, nothing touches the terminal
+        output = sys.stdout
+        if args.output and args.export == "prometheus":
+            output = args.output
+        elif args.output:
+            output = open(args.output, "w")
+
+        netstat = NetStat(backend=args.backend, source=source,
+                         parallel=parallel)
+        socket_filter = None
+        if args.filter:
+            try:
+                socket_filter = SocketFilter("expression", args.filter,
+                                             netstat.conn_status)
+            except ValueError as e:
+                parser.error(str(e))
+        try:
+            export.run(netstat, protocols,
+                       export.WRITERS[args.export](output), args.interval,
+                       args.count, socket_filter, args.counters)
+        except KeyboardInterrupt:
+            pass
+        except IOError as e:
+            # The reader went away, as head does
+            if e.errno != errno.EPIPE:
+                raise
+        finally:
+            netstat.close()
+        sys.exit(0)
+
     netpath = NetPath()
-    netstat = NetStat()
+    if args.replay:
+        try:
+            netstat = netpath.replay = Replay(args.replay)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+    elif args.hosts:
+        # A host slower than half the interval doesn't delay the screen,
+        # its previous sockets are shown
+        try:
+            for host in args.hosts.split(","):
+                parse_address(host)
+        except ValueError as e:
+            parser.error(str(e))
+        netstat = netpath.fleet = Fleet(args.hosts.split(","),
+                                        args.interval / 2)
+    elif args.namespaces:
+        # The socket inodes are unique across the namespaces, the
+        # owners are found as for the host
+        netstat = netpath.namespaces = Namespaces(parallel=parallel)
+        netstat.process_index = ProcessIndex()
+        netstat.process_index.start()
+    else:
+        netstat = NetStat(backend=args.backend, source=source,
+                         parallel=parallel)
+
+        # The owners of the sockets are looked up in the background,
+        # the screen shows "-" until the first scan is done. The
+        # processes of a capture are not known.
+        if not source.offline:
+            netstat.process_index = ProcessIndex()
+            netstat.process_index.start()
+
+    for expression in (args.filter, args.highlight):
+        if expression:
+            try:
+                SocketFilter("expression", expression, netstat.conn_status)
+            except ValueError as e:
+                parser.error(str(e))
+    if args.filter:
+        netpath.filter = Filter.EXPRESSION
+        netpath.filter_type = "expression"
+        netpath.filter_data = args.filter
+    if args.highlight:
+        netpath.highlight = Highlight.EXPRESSION
+        netpath.highlight_type = "expression"
+        netpath.highlight_data = args.highlight
     terminal = Terminal()
 
     # Set raw because raw_input() expect 'enter' from users
     # after they press any key
     terminal.set_raw()
 
-    while True:
-        os.system('clear')
-
-        header = netpath.header()
-        format = netpath.set_display_filter()
-
-        for data in netstat.collect_net_tcp(ret_format=format):
-            rx, tx = data['tx_queue_rx_queue'].split(":")
-
-            # Layout for non hex screen
-            if netpath.output_format != FormatDisplay.HEX:
-                line = "{0} {1} {2} {3} {4} {5} {6}\r".format(
-                    data['proto'],
-                    rx.rjust(8),
-                    tx.rjust(6),
-                    data['local_address'].ljust(27),
-                    data['rem_address'].ljust(27),
-                    data['st'].ljust(12),
-                    data['uid']
-                )
-
-            # Layout for hex screen (the fields size are different)
-            if netpath.output_format == FormatDisplay.HEX:
-                line = "{0} {1} {2} {3} {4} {5} {6}\r".format(
-                    data['proto'],
-                    rx.rjust(8),
-                    tx.rjust(6),
-                    data['local_address'].ljust(27),
-                    data['rem_address'].ljust(27),
-                    data['st'].ljust(12),
-                    data['uid']
-                )
-
-            if netpath.highlight is not None:
-                netpath.print_highlight(
-                    hlight_data=netpath.highlight_data,
-                    hlight_type=netpath.highlight_type,
-                    message=line,
-                    data=data
-                )
-                continue
+    if args.history > 0:
+        # Sized for --interval, --max-cpu may stretch it
+        netpath.history = History(int(args.history / args.interval) + 1,
+                                  args.history)
+
+    collector = Collector(netstat, protocols, args.interval,
+                          netpath.history)
+    collector.configure(netpath.set_display_filter(),
+                        netpath.socket_filter(netstat.conn_status))
+
+    if max_cpu is not None:
+        netpath.scheduler = collector.scheduler = \
+            Scheduler(args.interval, max_cpu, parallel)
+
+    # The stats are only taken while shown or profiling
+    stats = netpath.stats = netstat.stats
+    if args.resolve:
+        netpath.toggle_resolver(netstat)
+    if args.profile > 0:
+        netpath.profiler = collector.profiler = \
+            Profiler(args.profile, args.profile_output)
+        stats.enabled = True
+        netpath.profiler.start()
+    collector.start()
+
+    # A resize interrupts select(), the screen is then reformatted
+    signal.signal(signal.SIGWINCH, lambda signum, frame: None)
+
+    # Screen line of the sockets shown since they last changed, by the
+    # socket key of NetStat.delta()
+    lines = {}
+    # The sockets of the last collection, and the highlighted ones
+    index = SocketIndex()
+    highlighted = frozenset()
+    delta = None
+
+    def format_line(position):
+        # Only the sockets scrolled to are formatted, see render()
+        return netpath.format_line(delta.row(position),
+                                   delta.keys[position] in highlighted)
+    # Lines and keys of the screen, as given to render()
+    shown = None
 
-            if netpath.filter is not None:
-                netpath.print_filter(
-                    filter_data=netpath.filter_data,
-                    filter_type=netpath.filter_type,
-                    message=line,
-                    data=data
-                )
+    while True:
+        # Wait for a key or a collection, whichever comes first. A key
+        # resetting the screen has it drawn again at once.
+        timeout = None
+        if delta is not None and netpath.frame is None:
+            timeout = 0
+        try:
+            readable = select.select([sys.stdin, collector], [], [],
+                                     timeout)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = []
+
+        received = None
+        if collector in readable:
+            received = collector.get()
+
+        if received is not None:
+            delta = received
+            netpath.churn = delta.churn()
+            with stats.timer("index"):
+                index.update(delta)
+                highlight_filter = netpath.highlight_filter(
+                    netstat.conn_status)
+                highlighted = index.select(highlight_filter) \
+                    if highlight_filter is not None else frozenset()
+            if netpath.recorder is not None:
+                # The highlighted sockets, or all the ones shown
+                netpath.recorder.record(
+                    delta, highlight_filter,
+                    highlighted if highlight_filter is not None else None)
+            # The lines of the sockets changed since the previous
+            # collection are formatted again once shown, all of them
+            # when the screen is being reset
+            update = delta.added + delta.changed
+            if netpath.scheduler is not None and \
+                    netpath.scheduler.level != netpath.level:
+                # Fewer or more details, the screen is made again
+                netpath.level = netpath.scheduler.level
+                netstat.lookup_users = netpath.level < DEGRADE_USERS
+                netpath.frame = None
+            if netpath.resolver is not None:
+                # The sockets of the ips named since, shown as ips, the
+                # remote ip third from the end of the keys
+                resolved = netpath.resolver.tick()
+                if resolved:
+                    update = list(set(update).union(
+                        position for position, key in enumerate(delta.keys)
+                        if key[-3] in resolved))
+            for key in delta.removed:
+                lines.pop(key, None)
+            for position in update:
+                lines.pop(delta.keys[position], None)
+
+        if netpath.update_size() or received is not None or \
+                netpath.frame is None:
+            if delta is None:
                 continue
 
-            print(line)
-
-        footer = netpath.footer()
-        _print_colored(Color.BLUE, footer.center(95))
+            frame_start = time.time()
+            keys = delta.keys
+            if netpath.frame is None:
+                lines.clear()
+                if received is None:
+                    # The highlight may have changed since the collection
+                    highlight_filter = netpath.highlight_filter(
+                        netstat.conn_status)
+                    highlighted = index.select(highlight_filter) \
+                        if highlight_filter is not None else frozenset()
+
+            if netpath.output_format == FormatDisplay.SUMMARY or \
+                    netpath.summary_only():
+                # Counted on the integer columns, no line per socket
+                with stats.timer("summary"):
+                    summary = netpath.summary_lines(
+                        aggregate.Summary(delta.tables), netstat)
+                shown = (summary, range(len(summary)))
+            elif netpath.output_format == FormatDisplay.INTERFACES:
+                with stats.timer("counter lines"):
+                    counters = netpath.interface_lines(netstat.counters)
+                shown = (counters, range(len(counters)))
+            elif netpath.output_format == FormatDisplay.PROTOCOLS:
+                with stats.timer("counter lines"):
+                    counters = netpath.protocol_lines(netstat.counters)
+                shown = (counters, range(len(counters)))
+            else:
+                shown = (lines, keys, format_line)
+
+            netpath.render(*shown)
+            if stats.enabled:
+                stats.add_time("frame", time.time() - frame_start)
+                stats.count("frames")
+
+            profiler = netpath.profiler
+            if received is not None and profiler is not None and \
+                    not profiler.done and profiler.frame():
+                stats.enabled = netpath.show_stats
+
+        if sys.stdin not in readable:
+            continue
+
+        getch = os.read(sys.stdin.fileno(), 1)
+        # Escape sequences of the arrows and page keys come at once
+        if getch == '\x1b' and select.select([sys.stdin], [], [], 0)[0]:
+            getch += os.read(sys.stdin.fileno(), 8)
+
+        # Scrolling only moves the lines already formatted
+        if getch in SCROLL_LINE_KEYS or getch in SCROLL_PAGE_KEYS:
+            netpath.scroll_by(SCROLL_LINE_KEYS.get(getch, 0) +
+                              SCROLL_PAGE_KEYS.get(getch, 0) *
+                              netpath.page_size())
+            if shown is not None:
+                netpath.render(*shown)
+            continue
 
         try:
-            getch = sys.stdin.read(1)
+            if getch:
+                # Any key may change the screen or print over it
+                netpath.frame = None
+
             if getch == 'c':
                 netpath.cleandata()
 
             if getch == 'n':
-                if netpath.output_format < FormatDisplay.HEX:
+                if netpath.output_format < FormatDisplay.PROTOCOLS:
                     netpath.output_format += 1
                 else:
                     netpath.output_format = FormatDisplay.LISTEN
@@ -359,7 +1384,39 @@ if __name__ == "__main__":
             if getch == 'h':
                 netpath.help()
 
+            if getch == 's':
+                netpath.show_stats = not netpath.show_stats
+                stats.clear()
+                stats.enabled = netpath.show_stats or \
+                    (netpath.profiler is not None and
+                     not netpath.profiler.done)
+
+            if getch == 'l' and netpath.replay is None:
+                if netpath.recorder is None:
+                    netpath.recorder = Recorder(
+                        args.record, args.record_size << 20)
+                    netpath.recorder.start()
+                else:
+                    netpath.recorder.stop()
+                    netpath.recorder = None
+
+            if getch in (',', '.') and netpath.replay is not None:
+                netpath.replay.step(-1 if getch == ',' else 1)
+                collector.wake()
+
+            if getch == 'r':
+                netpath.toggle_resolver(netstat)
+
+            if getch == 'p' and netpath.replay is not None:
+                netpath.replay.paused = not netpath.replay.paused
+
             if getch == 'q':
+                collector.stop()
+                if netstat.process_index is not None:
+                    netstat.process_index.stop()
+                if netpath.recorder is not None:
+                    netpath.recorder.stop()
+                netstat.close()
                 terminal.set_default()
                 sys.exit(0)
 
@@ -370,19 +1427,21 @@ if __name__ == "__main__":
                 sys.stdin = open('/dev/tty')
 
                 print "Filter mode, please select the field below:"
-                print "[1] IP [2] Port [3] IP:PORT [4] State [5] User"
+                print "[1] IP [2] Port [3] IP:PORT [4] State [5] User " \
+                    "[6] Expression"
 
+                # The entries are numbered from 1
                 try:
-                    _FILTER = int(raw_input(">"))
+                    _FILTER = int(raw_input(">")) - 1
                 except ValueError:
-                    Terminal.set_raw()
+                    terminal.set_raw()
                     continue
 
-                if _FILTER < Filter.IP or _FILTER > Filter.USER:
-                    Terminal.set_raw()
+                if _FILTER < Filter.IP or _FILTER > Filter.EXPRESSION:
+                    terminal.set_raw()
                     continue
 
-                netpath.get_filter_data(_FILTER)
+                netpath.set_filter(_FILTER, netstat.conn_status)
                 terminal.set_raw()
 
             if getch == 'H':
@@ -392,22 +1451,26 @@ if __name__ == "__main__":
                 sys.stdin = open('/dev/tty')
 
                 print "Highlight mode, please select the field below:"
-                print "[1] IP [2] Port [3] IP:PORT [4] State [5] User"
+                print "[1] IP [2] Port [3] IP:PORT [4] State [5] User " \
+                    "[6] Expression"
 
                 try:
-                    _HIGHLIGHT = int(raw_input(">"))
+                    _HIGHLIGHT = int(raw_input(">")) - 1
                 except ValueError:
                     terminal.set_raw()
                     continue
 
                 if _HIGHLIGHT < Highlight.IP or \
-                        _HIGHLIGHT > Highlight.USER:
+                        _HIGHLIGHT > Highlight.EXPRESSION:
                     terminal.set_raw()
                     continue
 
-                netpath.set_highlight(_HIGHLIGHT)
+                netpath.set_highlight(_HIGHLIGHT, netstat.conn_status)
                 terminal.set_raw()
         except IOError:
             pass
-
-        time.sleep(1)
+        finally:
+            # The key may have changed the format, filter or highlight,
+            # collect again at once
+            collector.configure(netpath.set_display_filter(),
+                                netpath.socket_filter(netstat.conn_status))
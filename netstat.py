@@ -15,17 +15,209 @@
 # MA  02110-1301, USA.  A copy of the GNU General Public License is
 # also available at http://www.gnu.org/copyleft/gpl.html.
 
+import itertools
 import pwd
+import re
 import socket
 import struct
+import time
 import utils
 
+from multiprocessing.pool import ThreadPool
+
+from counters import COUNTER_FILES, Counters
+from profiling import Stats
+from sockdiag import SockDiag
+from source import ProcSource
+from sockettable import NO_UID, SnapshotDelta, SocketTable
+
+# Tables of /proc/net collected, in the order they are displayed
+PROTOCOLS = ("tcp", "tcp6", "udp", "udp6", "raw", "raw6", "unix")
+
+# Tables collected through netlink sock_diag with the "netlink" backend
+SOCK_DIAG_PROTOCOLS = {
+    'tcp': socket.IPPROTO_TCP,
+    'tcp6': socket.IPPROTO_TCP,
+    'udp': socket.IPPROTO_UDP,
+    'udp6': socket.IPPROTO_UDP,
+}
+
+TCP_ESTABLISHED = 1
+TCP_SYN_SENT = 2
+TCP_CLOSE = 7
+TCP_LISTEN = 10
+TCP_CLOSING = 11
+
+# Unix socket states (SS_* of linux/net.h) as the TCP state shown
+UNIX_STATES = {1: TCP_CLOSE, 2: TCP_SYN_SENT, 3: TCP_ESTABLISHED,
+               4: TCP_CLOSING}
+# Flag of the listening unix sockets
+SO_ACCEPTCON = 0x10000
+
+ADDRESS_CACHE_SIZE = 65536
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60
+
+# Characters of an address with a host name, as the Foreign Address
+# column holds them
+HOST_ADDRESS_LENGTH = 27
+
+# Chars of /proc/net/tcp parsed at a time, around 7000 lines
+PARSE_CHUNK_SIZE = 1 << 20
+
+_HEX = "([0-9A-Fa-f]+)"
+# Group matching nothing, for filters accepting no value
+_NONE = "((?!))"
+
+
+def net_tcp_re(states=None, uids=None):
+    """
+    Build the regex of a /proc/net/tcp line, one group per SocketTable
+    column. A line is matched with the newline preceding it.
+
+    Arguments:
+    states -- Only match the lines with these state numbers
+    uids -- Only match the lines with these uids
+    """
+    state = _HEX
+    if states is not None:
+        state = "(" + "|".join("%02X" % s for s in sorted(states)) + ")" \
+            if states else _NONE
+
+    uid = r"(\d+)"
+    if uids is not None:
+        uid = "(" + "|".join(str(u) for u in sorted(uids)) + ")" \
+            if uids else _NONE
+
+    # Anchored on the newline rather than ^, the regex engine then jumps
+    # from line to line instead of trying to match at every char
+    return re.compile(
+        r"\n *(\d+): " +
+        _HEX + ":" + _HEX + " " +       # local_address
+        _HEX + ":" + _HEX + " " +       # rem_address
+        state + " " +                   # st
+        _HEX + ":" + _HEX + " " +       # tx_queue rx_queue
+        _HEX + ":" + _HEX + " " +       # tr tm->when
+        _HEX + " +" +                   # retrnsmt
+        uid + r" +(\d+) +(\d+)",        # uid timeout inode
+    )
+
+NET_TCP_RE = net_tcp_re()
+
+# A /proc/net/unix line, groups are flags, st, inode and path
+NET_UNIX_RE = re.compile(
+    r"\n[0-9A-Fa-f]+: [0-9A-Fa-f]+ [0-9A-Fa-f]+ ([0-9A-Fa-f]+) "
+    r"[0-9A-Fa-f]+ ([0-9A-Fa-f]+) +(\d+) ?([^\n]*)"
+)
+
+_WORD_RE = re.compile("[0-9A-Fa-f]{8}")
+
+
+def _address_words(column):
+    """
+    Split a column of IPv6 hex addresses in the 4 words of every one
+    """
+    words = _WORD_RE.findall("".join(column))
+    return map(int, words, itertools.repeat(16, len(words)))
+
+
+# Number base of the NET_TCP_RE groups
+NET_TCP_BASES = (10, 16, 16, 16, 16, 16, 16, 16, 16, 16, 16, 10, 10, 10)
+
+
+def parse_net(proto, content, ret_format="hex", socket_filter=None,
+              netstat=None, pos=0, endpos=None):
+    """
+    Parse a /proc/net/<proto> table
+
+    Arguments:
+    proto -- A protocol of PROTOCOLS
+    content -- The whole table (header included), as a string or any
+               buffer the re module reads, an mmap is parsed in place
+    ret_format -- "hex" or "human_being", see NetStat.collect_net_tcp()
+    socket_filter -- SocketFilter of the sockets to keep, None for all
+    netstat -- NetStat decoding the "human being" fields
+    pos, endpos -- Part of content to parse, starting on the newline
+                   ending the line before
+
+    Returns:
+    Return the table as a SocketTable
+    """
+    if endpos is None:
+        endpos = len(content)
+
+    table = SocketTable(proto, ret_format, netstat)
+    if proto == "unix":
+        _parse_unix(table, content, socket_filter, pos, endpos)
+    else:
+        _parse_inet(table, content, socket_filter, pos, endpos)
+
+    return table
+
+
+def _parse_inet(table, content, socket_filter, pos, endpos):
+    # tcp, udp and raw tables, IPv4 or IPv6, share the same layout
+
+    # The state and uid of the filter are checked by the regex, the
+    # other fields on the hex strings, before any conversion
+    pattern = NET_TCP_RE
+    match_hex = None
+    if socket_filter is not None:
+        pattern = net_tcp_re(socket_filter.states, socket_filter.uids)
+        match_hex = socket_filter.match_hex
+
+    # One C level pass per chunk of the table, the header doesn't
+    # match. The fields are then converted a column at a time.
+    # Chunks keep the temporary strings of a huge table bounded.
+    end = endpos
+    while pos < end:
+        endpos = content.find("\n", pos + PARSE_CHUNK_SIZE, end)
+        if endpos == -1:
+            endpos = end
+
+        rows = pattern.findall(content, pos, endpos)
+        if match_hex is not None:
+            rows = [row for row in rows if match_hex(row)]
+        if rows:
+            columns = []
+            for index, column in enumerate(zip(*rows)):
+                if table.words != 1 and index in (1, 3):
+                    columns.append(_address_words(column))
+                else:
+                    columns.append(map(int, column, itertools.repeat(
+                        NET_TCP_BASES[index], len(rows)
+                    )))
+            table.extend(columns)
+        # The next chunk starts at the newline its first line needs
+        pos = endpos
+
+
+def _parse_unix(table, content, socket_filter, pos, endpos):
+    # Unix sockets have neither addresses nor ports
+    match = None
+    if socket_filter is not None:
+        if not socket_filter.unix:
+            return
+        match = socket_filter.match_unix
+
+    for sl, (flags, st, inode, path) in \
+            enumerate(NET_UNIX_RE.findall(content, pos, endpos)):
+        # Mapped to the TCP states, as netstat shows them
+        state = UNIX_STATES.get(int(st, 16), TCP_CLOSE)
+        if int(flags, 16) & SO_ACCEPTCON:
+            state = TCP_LISTEN
+
+        if match is not None and not match(state, 0, 0, 0, 0, NO_UID, 0, 0):
+            continue
+
+        table.append(sl, 0, 0, 0, 0, state, 0, 0, 0, 0, 0, NO_UID, 0,
+                     int(inode))
+        table.paths.append(path)
+
 
 class NetStat:
 
-    def __init__(self):
-        # TODO: Collectar /proc/net/tcp e tcp6.
-        # icmp, udp, estatisticas, interfaces de rede
+    def __init__(self, backend="proc", source=None, parallel=None):
         self.conn_status = {'1': 'ESTABLISHED', '2': 'SYN_SENT',
                             '3': 'SYN_RECV',    '4': 'FIN_WAIT1',
                             '5': 'FIN_WAIT2',   '6': 'TIME_WAIT',
@@ -33,121 +225,359 @@ class NetStat:
                             '9': 'LAST_ACK',     '10': 'LISTEN',
                             '11': 'CLOSING'}
 
-    def collect_net_tcp(self, ret_format):
+        self.address_cache = utils.LRUCache(ADDRESS_CACHE_SIZE)
+        self.user_cache = utils.LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        # False to show the uids not cached instead of looking them up,
+        # while saving CPU
+        self.lookup_users = True
+
+        # Previous collection, see delta()
+        self.snapshot = None
+        self.snapshot_time = None
+
+        # "proc" parses /proc/net/tcp, "netlink" asks the kernel through
+        # NETLINK_SOCK_DIAG and falls back to "proc" when not available
+        self.backend = backend
+        self.sock_diag = None
+
+        # Where the tables are read from, see source.open_source()
+        self.source = source or ProcSource()
+
+        # Threads reading the /proc tables, see collect()
+        self.pool = None
+
+        # ProcessIndex giving the owner of the sockets, None to skip it
+        self.process_index = None
+
+        # parallel.ParallelParser of the big tables, None to parse them
+        # on this core
+        self.parallel = parallel
+
+        # Timers and counters of the stages, disabled unless shown
+        self.stats = Stats()
+        self.stats.caches.update(address=self.address_cache,
+                                 user=self.user_cache)
+
+        # resolver.Resolver naming the remote ips, None to show them as
+        # numbers, see human_host()
+        self.resolver = None
+
+        # Interface and protocol counters of the source, see
+        # collect_counters(), None when it has none
+        self.counters = Counters()
+
+    def close(self):
+        """
+        Release the threads and the netlink socket
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+        if self.sock_diag is not None:
+            self.sock_diag.close()
+            self.sock_diag = None
+
+        if self.resolver is not None:
+            self.resolver.close()
+            self.resolver = None
+
+    def collect(self, protocols, ret_format, socket_filter=None):
+        """
+        Collect the sockets of several protocols
+
+        Arguments:
+        protocols -- List of protocols, see PROTOCOLS
+        ret_format -- "hex" or "human_being", see collect_net_tcp()
+        socket_filter -- SocketFilter of the sockets to collect, None
+                         for all
+
+        Returns:
+        Return a list of SocketTable, one per protocol in the protocols
+        order
+        """
+        proc_protocols = [proto for proto in protocols
+                          if not self._use_sock_diag(proto)]
+
+        # The /proc tables are read concurrently, the kernel formats one
+        # table while the previous one is parsed
+        tables = {}
+        if len(proc_protocols) > 1:
+            if self.pool is None:
+                self.pool = ThreadPool(len(PROTOCOLS))
+            contents = self.pool.imap(self.read, proc_protocols)
+            for proto, content in zip(proc_protocols, contents):
+                tables[proto] = self.parse_net(proto, content, ret_format,
+                                               socket_filter)
+
+        return [tables[proto] if proto in tables else
+                self.collect_net(proto, ret_format, socket_filter)
+                for proto in protocols]
+
+    def collect_counters(self):
+        """
+        Sample the interface and protocol counters, from /proc/net/dev,
+        snmp and netstat
+
+        Returns:
+        Return the counters.Counters, None if not collected
+        """
+        if self.counters is None:
+            return None
+
+        with self.stats.timer("counters"):
+            contents = []
+            for name in COUNTER_FILES:
+                try:
+                    contents.append(self.source.read(name))
+                except IOError:
+                    contents.append("")
+            self.counters.update(*contents + [time.time()])
+
+        return self.counters
+
+    def collect_net(self, proto, ret_format, socket_filter=None):
+        """
+        Collect the sockets of a protocol, from /proc/net/<proto> or
+        netlink sock_diag
+
+        Arguments:
+        proto -- A protocol of PROTOCOLS
+        ret_format -- "hex" or "human_being", see collect_net_tcp()
+        socket_filter -- SocketFilter of the sockets to collect, None
+                         for all
+
+        Returns:
+        Return the sockets as a SocketTable
+        """
+        if self._use_sock_diag(proto):
+            table = self._collect_sock_diag(proto, ret_format, socket_filter)
+            if table is not None:
+                return table
+
+        return self.parse_net(proto, self.read(proto), ret_format,
+                              socket_filter)
+
+    def read(self, proto):
+        """
+        Read the table of a protocol from the source
+        """
+        with self.stats.timer("read"):
+            content = self.source.read(proto)
+        self.stats.count("bytes read", len(content))
+
+        return content
+
+    def collect_net_tcp(self, ret_format, socket_filter=None):
         """
         Method to collect all data from /proc/net/tcp
 
         Arguments:
         ret_format -- Return data as hexadecimal or "human being" format ;-)
                       Use as: ret_format="hex" or ret_format="human_being"
+        socket_filter -- SocketFilter of the sockets to collect, None
+                         for all
 
         Returns:
-        Return the /proc/net/tcp fields as list of dict
-        """
-
-        # Creates a List of dictionaries
-        netdata = {}
-        list_netdata = []
-
-        data = ""
-        with open("/proc/net/tcp", "r") as fd:
-        #with open("/proc/net/tcp6", "r") as fd:
-            for i, line in enumerate(fd):
-                # Jumping header output
-                if i == 0:
-                    continue
-
-                index_netstat_fields = 0
-                for char in line:
-                    if " " in char:
-                        if data == "" or data == " " or data == "\n":
-                            continue
-
-                        data = data.strip("\n")
-                        netdata['proto'] = "tcp"
-                        if index_netstat_fields == 0:
-                            netdata['sl'] = data
-
-                        if index_netstat_fields == 1:
-                            if ret_format == "human_being":
-                                ip_address, port = data.split(":")
-                                # Convert from little endian to big endian
-                                ip_address = socket.inet_ntoa(
-                                    struct.pack(
-                                        "<L",
-                                        int(ip_address, 16)
-                                    )
-                                )
-                                netdata['local_address'] = ip_address
-                                netdata['local_address'] += ":" + \
-                                    str(utils.hex_to_dec(port))
-                            else:
-                                netdata['local_address'] = data
-
-                        if index_netstat_fields == 2:
-                            if ret_format == "human_being":
-                                ip_address, port = data.split(":")
-                                # Convert from little endian to big endian
-                                ip_address = socket.inet_ntoa(
-                                    struct.pack(
-                                        "<L",
-                                        int(ip_address, 16)
-                                    )
-                                )
-                                netdata['rem_address'] = ip_address
-                                netdata['rem_address'] += ":" + \
-                                    str(utils.hex_to_dec(port))
-
-                                if "0.0.0.0:0" in netdata['rem_address']:
-                                    netdata['rem_address'] = "0.0.0.0:*"
-                            else:
-                                netdata['rem_address'] = data
-
-                        if index_netstat_fields == 3:
-                            if ret_format == "human_being":
-                                netdata['st'] = self.conn_status[str(
-                                    utils.hex_to_dec(data)
-                                )]
-                            else:
-                                netdata['st'] = data
-
-                        if index_netstat_fields == 4:
-                            if ret_format == "human_being":
-                                tx, rx = data.split(':')
-                                netdata['tx_queue_rx_queue'] = str(
-                                    utils.hex_to_dec(rx)
-                                )
-                                netdata['tx_queue_rx_queue'] += ":" + \
-                                    str(utils.hex_to_dec(tx))
-                            else:
-                                netdata['tx_queue_rx_queue'] = data
-
-                        if index_netstat_fields == 5:
-                            netdata['tr_tm_when'] = data
-
-                        if index_netstat_fields == 6:
-                            netdata['retrnsmt'] = data
-
-                        if index_netstat_fields == 7:
-                            if ret_format == "human_being":
-                                netdata['uid'] = pwd.getpwuid(int(data))[0]
-                            else:
-                                netdata['uid'] = data
-
-                        if index_netstat_fields == 8:
-                            netdata['timeout'] = data
-
-                        if index_netstat_fields == 9:
-                            netdata['inode'] = data
-
-                        if index_netstat_fields > 9:
-                            netdata['inode'] += " " + data
-
-                        data = ""
-                        index_netstat_fields += 1
-                        continue
-
-                    data += char
-                list_netdata.append(netdata.copy())
-
-            return list_netdata
+        Return the /proc/net/tcp sockets as a SocketTable, its rows
+        have the table fields as keys
+        """
+        return self.collect_net("tcp", ret_format, socket_filter)
+
+    def _use_sock_diag(self, proto):
+        return self.backend == "netlink" and \
+            proto in SOCK_DIAG_PROTOCOLS and not self.source.offline
+
+    def _collect_sock_diag(self, proto, ret_format, socket_filter):
+        try:
+            if self.sock_diag is None:
+                self.sock_diag = SockDiag()
+
+            with self.stats.timer("netlink"):
+                table = self.sock_diag.collect(
+                    SocketTable(proto, ret_format, self),
+                    SOCK_DIAG_PROTOCOLS[proto],
+                    socket_filter=socket_filter
+                )
+            self.stats.count("sockets parsed", len(table))
+            return table
+        except socket.error:
+            # Kernel without sock_diag or netlink denied, stay on /proc
+            self.backend = "proc"
+            self.sock_diag = None
+            return None
+
+    def parse_net(self, proto, content, ret_format, socket_filter=None):
+        """
+        Parse the content of a /proc/net/<proto> table
+
+        Arguments:
+        proto -- A protocol of PROTOCOLS
+        content -- The whole table as a string (header included)
+        ret_format -- "hex" or "human_being", see collect_net_tcp()
+        socket_filter -- SocketFilter of the sockets to keep, None for all
+
+        Returns:
+        Return the table as a SocketTable
+        """
+        with self.stats.timer("parse"):
+            if self.parallel is not None:
+                table = self.parallel.parse(proto, content, ret_format,
+                                            socket_filter, self)
+            else:
+                table = parse_net(proto, content, ret_format,
+                                  socket_filter, self)
+
+        if self.stats.enabled:
+            self.stats.count("sockets parsed", len(table))
+            if socket_filter is not None:
+                # The lines of the table but its header
+                lines = content[:].count("\n") - 1
+                self.stats.count("sockets filtered out",
+                                 max(lines - len(table), 0))
+
+        return table
+
+    def parse_net_tcp(self, content, ret_format, socket_filter=None):
+        """
+        Parse the content of a /proc/net/tcp like table, see parse_net()
+        """
+        return self.parse_net("tcp", content, ret_format, socket_filter)
+
+    def delta(self, tables):
+        """
+        Compare a collection against the previous one
+
+        Arguments:
+        tables -- List of SocketTable, as returned by collect()
+
+        Returns:
+        Return a SnapshotDelta, on the first call all the sockets are
+        added. The tables become the snapshot of the next call.
+        """
+        with self.stats.timer("delta"):
+            return self._delta(tables)
+
+    def _delta(self, tables):
+        now = time.time()
+        keys = []
+        values = []
+        for table in tables:
+            keys.extend(table.keys())
+            values.extend(table.values())
+        snapshot = dict(zip(keys, values))
+
+        added = []
+        changed = []
+        removed = []
+        interval = None
+
+        if self.snapshot is None:
+            added = list(range(len(keys)))
+        else:
+            previous = self.snapshot
+            for index, key in enumerate(keys):
+                value = previous.get(key)
+                if value is None:
+                    added.append(index)
+                elif value != snapshot[key]:
+                    changed.append(index)
+
+            if len(previous) + len(added) != len(snapshot):
+                removed = list(set(previous).difference(snapshot))
+            interval = now - self.snapshot_time
+
+        self.snapshot = snapshot
+        self.snapshot_time = now
+
+        return SnapshotDelta(tables, keys, added, removed, changed,
+                             interval, snapshot)
+
+    def human_address(self, ip_address, port):
+        """
+        Convert an address of the table to "127.0.0.1:22"
+
+        Arguments:
+        ip_address -- The ip as SocketTable.address() returns it, an int
+                      or the 4 words of an IPv6 address
+        port -- The port number
+        """
+        return self.human_ip(ip_address) + ":" + str(port)
+
+    def human_host(self, ip_address, port):
+        """
+        Convert a remote address of the table to "example.org:22", the
+        ip as human_address() until the resolver named it
+        """
+        name = None
+        if self.resolver is not None:
+            name = self.resolver.name(ip_address)
+        if name is None:
+            return self.human_address(ip_address, port)
+
+        port = ":" + str(port)
+        return name[:HOST_ADDRESS_LENGTH - len(port)] + port
+
+    def human_ip(self, ip_address):
+        """
+        Convert an ip of the table to "127.0.0.1", see human_address()
+
+        The same few hosts show up on every refresh so the ip
+        conversions are cached.
+        """
+        ip_string = self.address_cache.get(ip_address)
+        if ip_string is None:
+            # Convert from little endian to big endian, IPv6 addresses
+            # are 4 words in the same order
+            if isinstance(ip_address, tuple):
+                ip_string = socket.inet_ntop(
+                    socket.AF_INET6, struct.pack("<4L", *ip_address)
+                )
+            else:
+                ip_string = socket.inet_ntoa(struct.pack("<L", ip_address))
+            self.address_cache.set(ip_address, ip_string)
+
+        return ip_string
+
+    def program(self, inode):
+        """
+        Returns:
+        Return "pid/command" of the process owning a socket inode, "-"
+        if not known
+        """
+        if self.process_index is None:
+            return "-"
+
+        return self.process_index.program(inode)
+
+    def pids(self, inodes):
+        """
+        Returns:
+        Return the pid owning every inode of a column, None if not
+        known, or None without process index
+        """
+        if self.process_index is None:
+            return None
+
+        return self.process_index.pids(inodes)
+
+    def username(self, uid):
+        """
+        Resolve an uid to the user name
+
+        Lookups may hit NSS backends as LDAP, so the names are cached
+        for USER_CACHE_TTL seconds. Uids without user, or not cached
+        while lookup_users is False, are returned as they are.
+        """
+        name = self.user_cache.get(uid)
+        if name is None and not self.lookup_users:
+            return str(uid)
+        if name is None:
+            try:
+                with self.stats.timer("user lookup"):
+                    name = pwd.getpwuid(uid)[0]
+            except KeyError:
+                name = str(uid)
+            self.user_cache.set(uid, name)
+
+        return name
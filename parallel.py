@@ -0,0 +1,209 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Parsing of the big /proc/net tables on several cores
+
+The table is split on line boundaries, one chunk per worker. The
+workers are forked for every table, they read the table from the
+memory of the parent without a copy, and write the columns of their
+sockets to an anonymous shared mapping. Only the number of sockets
+parsed is sent back.
+"""
+
+import mmap
+import multiprocessing
+import os
+import time
+
+from array import array
+
+from netstat import parse_net
+from sockettable import COLUMNS, SocketTable
+
+# Bytes of the shortest line the parser matches, bounds the number of
+# sockets of a chunk of a buffer whose lines can't be counted
+MIN_LINE_SIZE = 29
+
+# Tables smaller than this are timed to predict the gain of the workers
+MIN_SAMPLE_SIZE = 1 << 16
+
+# Seconds lost forking and gathering the workers until measured
+DEFAULT_OVERHEAD = 0.05
+
+# Weight of a new timing in the averages of ParallelParser
+SMOOTHING = 0.3
+
+# Columns of IPv6 tables with 4 entries per socket
+_ADDRESS_COLUMNS = ("local_ip", "rem_ip")
+
+# (content, bounds, proto, socket_filter, output, regions) of the table
+# being parsed, inherited by the workers
+_job = None
+
+
+def _entries(name, words):
+    if name in _ADDRESS_COLUMNS:
+        return words
+    return 1
+
+
+def _layout(words):
+    """
+    Returns:
+    Return the offset of every column in a region of a chunk, in
+    bytes per socket of the chunk, and the bytes of a socket
+    """
+    offsets = []
+    size = 0
+    for name, typecode in COLUMNS:
+        offsets.append(size)
+        size += array(typecode).itemsize * _entries(name, words)
+
+    return offsets, size
+
+
+def _parse_chunk(index):
+    # Runs in a worker
+    content, bounds, proto, socket_filter, output, regions = _job
+    table = parse_net(proto, content, "hex", socket_filter, None,
+                      bounds[index], bounds[index + 1])
+
+    start, capacity = regions[index]
+    offsets = _layout(table.words)[0]
+    for (name, _), offset in zip(COLUMNS, offsets):
+        data = getattr(table, name).tostring()
+        position = start + capacity * offset
+        output[position:position + len(data)] = data
+
+    return len(table)
+
+
+class ParallelParser:
+    """
+    Parse the tables of NetStat on several cores when it pays off
+
+    The parser times the tables it parses: the seconds per byte of the
+    serial parser, and the overhead of the workers. A table is given to
+    the workers when that predicts it is parsed faster, see threshold().
+
+    Unix tables are always parsed serially, their paths are strings.
+
+    Arguments:
+    workers -- Processes parsing a table, the number of cores if None
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        # Measured as the tables are parsed, byte_time is None until
+        # a table of MIN_SAMPLE_SIZE bytes was parsed serially
+        self.byte_time = None
+        self.overhead = DEFAULT_OVERHEAD
+        # CPU seconds of the workers of every table parsed so far
+        self.cpu_time = 0.0
+
+    def threshold(self):
+        """
+        Returns:
+        Return the size in bytes from which the tables are parsed by
+        the workers, None if never or not known yet
+        """
+        if self.workers < 2 or self.byte_time is None:
+            return None
+
+        return int(self.overhead /
+                   (self.byte_time * (1 - 1.0 / self.workers)))
+
+    def parse(self, proto, content, ret_format, socket_filter, netstat):
+        """
+        Parse a table, as netstat.parse_net()
+        """
+        size = len(content)
+        threshold = self.threshold()
+        start = time.time()
+
+        if proto != "unix" and threshold is not None and size >= threshold:
+            table = self.parse_chunks(proto, content, ret_format,
+                                      socket_filter, netstat)
+            overhead = time.time() - start - \
+                size * self.byte_time / self.workers
+            self.overhead += SMOOTHING * (max(overhead, 0) - self.overhead)
+            return table
+
+        table = parse_net(proto, content, ret_format, socket_filter, netstat)
+        if size >= MIN_SAMPLE_SIZE:
+            byte_time = (time.time() - start) / size
+            if self.byte_time is None:
+                self.byte_time = byte_time
+            else:
+                self.byte_time += SMOOTHING * (byte_time - self.byte_time)
+
+        return table
+
+    def parse_chunks(self, proto, content, ret_format, socket_filter,
+                     netstat):
+        """
+        Parse a table on the workers, whatever its size
+        """
+        global _job
+
+        # Chunks start on the newline ending the line before them
+        bounds = [0]
+        for number in range(1, self.workers):
+            bound = content.find("\n", len(content) * number // self.workers)
+            if bound == -1 or bound <= bounds[-1]:
+                continue
+            bounds.append(bound)
+        bounds.append(len(content))
+
+        table = SocketTable(proto, ret_format, netstat)
+        offsets, socket_size = _layout(table.words)
+        regions = []
+        size = 0
+        for first, last in zip(bounds, bounds[1:]):
+            if isinstance(content, str):
+                capacity = content.count("\n", first, last)
+            else:
+                capacity = (last - first) // MIN_LINE_SIZE + 1
+            regions.append((size, capacity))
+            size += capacity * socket_size
+
+        output = mmap.mmap(-1, max(size, 1))
+        _job = (content, bounds, proto, socket_filter, output, regions)
+        # The workers are waited for by terminate(), their CPU time is
+        # then the one of the children of the process
+        before = os.times()
+        pool = multiprocessing.Pool(len(regions))
+        try:
+            counts = pool.map(_parse_chunk, range(len(regions)))
+        finally:
+            pool.terminate()
+            _job = None
+        after = os.times()
+        self.cpu_time += after[2] + after[3] - before[2] - before[3]
+
+        for (start, capacity), count in zip(regions, counts):
+            for (name, _), offset in zip(COLUMNS, offsets):
+                column = getattr(table, name)
+                position = start + capacity * offset
+                column.fromstring(output[
+                    position:position +
+                    count * column.itemsize * _entries(name, table.words)
+                ])
+        output.close()
+
+        return table
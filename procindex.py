@@ -0,0 +1,262 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Map the socket inodes to the processes owning them
+
+Every open socket of a process is a /proc/<pid>/fd/<n> link to
+"socket:[<inode>]". Reading all the links is the expensive part, so
+after the first pass only the fds a process opened since, as listed by
+/proc/<pid>/fd, have their links read. A fd number closed and reused
+leaves the names as they were: when sockets looked up still have no
+owner after that, all the links are read again, at most once every
+FULL_SCAN_INTERVAL seconds.
+"""
+
+import os
+import threading
+import time
+
+# Seconds between two passes of the background thread
+SCAN_INTERVAL = 2
+
+# Seconds between two reads of the links of every process
+FULL_SCAN_INTERVAL = 30
+
+
+def _read_comm(pid):
+    try:
+        with open("/proc/%s/comm" % pid, "r") as fd:
+            return fd.read().rstrip("\n")
+    except (IOError, OSError):
+        return "-"
+
+
+class ProcessIndex:
+    """
+    Index of the socket inodes by pid, updated incrementally
+
+    Lookups only read the dicts, the updates are done by scan() from
+    one thread at a time.
+
+    Arguments:
+    proc -- Mount point of procfs
+    """
+
+    def __init__(self, proc="/proc"):
+        self.proc = proc
+
+        # Socket inode to the pids sharing it, as the workers forked
+        # by a server after opening its listening socket, and to the
+        # smallest of them
+        self.owners = {}
+        self.inodes = {}
+        # Command of every pid indexed
+        self.commands = {}
+        # Increased by every scan() which changed the index
+        self.generation = 0
+
+        # Fd names of every pid, and the socket inode of its socket fds,
+        # at its last read
+        self._fds = {}
+        # Inodes looked up by pids() without owner since the last scan,
+        # and the ones a full pass didn't find an owner for
+        self._missed = set()
+        self._unresolved = set()
+        # Time of the last read of every link, the first scan reads
+        # them all
+        self._full_scan = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def pid(self, inode):
+        """
+        Returns:
+        Return the pid owning a socket inode, the smallest one when
+        shared, None if not known
+        """
+        return self.inodes.get(inode)
+
+    def pids(self, inodes):
+        """
+        Returns:
+        Return the pid owning every inode of a column, None if not
+        known. The next scan() looks for the owners of the inodes not
+        known.
+        """
+        pids = map(self.inodes.get, inodes)
+        if None in pids:
+            self._missed.update(inode for inode, pid in zip(inodes, pids)
+                                if pid is None)
+
+        return pids
+
+    def program(self, inode):
+        """
+        Returns:
+        Return "pid/command" of the process owning a socket inode, as
+        netstat -p, "-" if not known
+        """
+        pid = self.inodes.get(inode)
+        if pid is None:
+            return "-"
+
+        return "%d/%s" % (pid, self.commands.get(pid, "-"))
+
+    def scan(self, now=None):
+        """
+        Update the index against the running processes
+
+        Arguments:
+        now -- Current time, time.time() if None
+
+        Returns:
+        Return True if the index changed
+        """
+        if now is None:
+            now = time.time()
+        if self._full_scan is None:
+            self._full_scan = now
+        pids = set(int(name) for name in os.listdir(self.proc)
+                   if name.isdigit())
+        changed = False
+
+        for pid in set(self._fds).difference(pids):
+            self._evict(pid)
+            changed = True
+
+        for pid in pids:
+            changed = self._scan_pid(pid, False) or changed
+
+        # Sockets without owner once the fds opened since are read, or
+        # for the first time since the last full pass. Time-wait
+        # sockets have no inode.
+        missed, self._missed = self._missed, set()
+        missed.discard(0)
+        missed = set(inode for inode in missed if inode not in self.inodes)
+        if not missed.issubset(self._unresolved):
+            if now - self._full_scan < FULL_SCAN_INTERVAL:
+                # Looked for again by a next scan
+                self._missed.update(missed)
+            else:
+                self._full_scan = now
+                for pid in pids:
+                    changed = self._scan_pid(pid, True) or changed
+                # The sockets of the processes not ours to read stay
+                # unknown
+                self._unresolved = set(inode for inode in missed
+                                       if inode not in self.inodes)
+        else:
+            self._unresolved = missed
+
+        if changed:
+            self.generation += 1
+
+        return changed
+
+    def _scan_pid(self, pid, full):
+        # Read the fds of a pid, only the ones opened since unless full,
+        # returns True if its sockets changed
+        fd_dir = "%s/%d/fd" % (self.proc, pid)
+        try:
+            names = frozenset(os.listdir(fd_dir))
+        except OSError:
+            # Exited, or not ours to read
+            names = frozenset()
+
+        previous = self._fds.get(pid)
+        if previous is not None and previous[0] == names and not full:
+            return False
+
+        # Only the links of the fds opened since are read, the sockets
+        # of the fds still open are kept
+        sockets = {}
+        opened = names
+        if previous is not None and not full:
+            for fd, inode in previous[1].iteritems():
+                if fd in names:
+                    sockets[fd] = inode
+            opened = names.difference(previous[0])
+        for fd in opened:
+            try:
+                link = os.readlink(fd_dir + "/" + fd)
+            except OSError:
+                continue
+            if link.startswith("socket:["):
+                sockets[fd] = int(link[8:-1])
+
+        if previous is not None:
+            self._evict(pid)
+        if sockets:
+            self.commands[pid] = _read_comm(pid)
+            for inode in sockets.itervalues():
+                self._own(inode, pid)
+        self._fds[pid] = (names, sockets)
+
+        if previous is None:
+            return bool(sockets)
+        return sockets != previous[1]
+
+    def _own(self, inode, pid):
+        owners = self.owners.setdefault(inode, set())
+        owners.add(pid)
+        self.inodes[inode] = min(owners)
+
+    def _evict(self, pid):
+        names, sockets = self._fds.pop(pid)
+        for inode in sockets.itervalues():
+            # The socket stays indexed while another process shares it
+            owners = self.owners.get(inode)
+            if owners is None:
+                continue
+            owners.discard(pid)
+            if owners:
+                self.inodes[inode] = min(owners)
+            else:
+                del self.owners[inode]
+                del self.inodes[inode]
+        self.commands.pop(pid, None)
+
+    def start(self, interval=SCAN_INTERVAL):
+        """
+        Scan every interval seconds from a background thread, the first
+        scan reads the fds of every process
+        """
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except OSError:
+                # procfs not readable, try again at the next pass
+                pass
+            self._stop.wait(interval)
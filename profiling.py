@@ -0,0 +1,183 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Timers and counters of the stages of a refresh, and cProfile of the
+first refreshes
+"""
+
+import cProfile
+import pstats
+import threading
+import time
+
+
+class _NoTimer:
+    # Returned while the stats are disabled, times nothing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+class _Timer:
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.name, time.time() - self.start)
+        return False
+
+
+class Stats:
+    """
+    Time spent per stage and counters of the collections and frames
+
+    Use as:
+
+        with stats.timer("parse"):
+            ...
+        stats.count("sockets parsed", len(table))
+
+    While disabled, timer() returns a timer doing nothing and count()
+    returns at once, the stages cost one call each.
+
+    The stages are timed and counted from several threads.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # [calls, seconds, seconds of the last call], by stage
+        self.timers = {}
+        self.counters = {}
+        # utils.LRUCache whose hit rate is shown, by name
+        self.caches = {}
+        # Stage names in the order first timed
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        """
+        Returns:
+        Return the context manager timing a stage
+        """
+        if not self.enabled:
+            return _NO_TIMER
+
+        return _Timer(self, name)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0, 0.0]
+                self.stages.append(name)
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = seconds
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def clear(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+            self.stages = []
+
+
+class Profiler:
+    """
+    cProfile of the first frames, of the UI and of the collector
+    thread, dumped to a pstats file once done
+
+    cProfile only profiles the thread enabling it, the collector thread
+    has its own Profile, merged in the file.
+
+    Arguments:
+    frames -- Number of frames profiled
+    path -- File of the pstats
+    """
+
+    def __init__(self, frames, path):
+        self.path = path
+        self.done = False
+        self.ui = cProfile.Profile()
+        self.collector = cProfile.Profile()
+        self._ui_frames = frames
+        self._collector_frames = frames
+
+    def start(self):
+        # From the UI thread
+        self.ui.enable()
+
+    def start_collection(self):
+        """
+        Profile a collection, from the collector thread
+
+        Returns:
+        Return True if profiling, end_collection() must then be called
+        """
+        if self._collector_frames <= 0:
+            return False
+
+        self.collector.enable()
+        return True
+
+    def end_collection(self):
+        self.collector.disable()
+        self._collector_frames -= 1
+
+    def frame(self):
+        """
+        Count a frame drawn, from the UI thread. The pstats are dumped
+        once the frames and the collections are profiled.
+
+        Returns:
+        Return True once the pstats are dumped
+        """
+        if self.done:
+            return True
+
+        self._ui_frames -= 1
+        if self._ui_frames == 0:
+            self.ui.disable()
+
+        if self._ui_frames > 0 or self._collector_frames > 0:
+            return False
+
+        stats = pstats.Stats(self.ui)
+        stats.add(self.collector)
+        stats.dump_stats(self.path)
+        self.done = True
+        return True
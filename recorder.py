@@ -0,0 +1,512 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Recording of the collections to a binary file, and their replay
+
+The file starts with MAGIC, followed by one record per collection:
+
+    length  uint32, bytes of the record after it
+    TICK    time, flags, sockets added, removed and changed
+    ROW     per socket added: id, protocol, addresses, state, queues,
+            uid and inode
+    uint32  per socket removed: id
+    CHANGE  per socket changed: id, state, queues and uid
+
+Sockets are given an id when added and referred to by it afterwards.
+A record flagged FULL holds all the sockets recorded and starts new
+ids. One is written every KEYFRAME_INTERVAL collections, at the start
+of every file and when the filter changes, so a file can be replayed
+on its own and stepped back quickly.
+
+IPv4 addresses are stored in the first of the 4 words of an address.
+Unix socket paths are not recorded.
+"""
+
+import itertools
+import mmap
+import os
+import Queue
+import socket
+import struct
+import threading
+import time
+
+from netstat import NetStat, PROTOCOLS
+from sockettable import SocketTable
+
+MAGIC = "NETPATH\x01"
+
+FULL = 0x01
+
+RECORD_LENGTH = struct.Struct("<I")
+TICK = struct.Struct("<dBIII")
+ROW = struct.Struct("<IB4LH4LHBIIIQ")
+CHANGE = struct.Struct("<IBIII")
+REMOVED = struct.Struct("<I")
+
+# Collections between two FULL records
+KEYFRAME_INTERVAL = 60
+
+# Bytes of records buffered, and seconds at most, before a write
+WRITE_BUFFER_SIZE = 1 << 16
+WRITE_BUFFER_TIME = 1.0
+
+# Size of a file before it is rotated, and rotated files kept
+RECORD_MAX_BYTES = 64 << 20
+RECORD_BACKUPS = 3
+
+# Collections waiting for the writer, beyond them one is dropped and a
+# FULL record is written next
+QUEUE_SIZE = 64
+
+
+def _words(ip_address):
+    if isinstance(ip_address, tuple):
+        return ip_address
+
+    return (ip_address, 0, 0, 0)
+
+
+class Recorder:
+    """
+    Record collections from a background thread
+
+    record() only queues the collection, the thread selects the
+    sockets, encodes them and writes the file.
+
+    Arguments:
+    path -- File written, rotated to path.1, path.2... when full
+    max_bytes -- Size of a file before it is rotated
+    backups -- Rotated files kept
+    """
+
+    def __init__(self, path, max_bytes=RECORD_MAX_BYTES,
+                 backups=RECORD_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self._queue = Queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = None
+        self._file = None
+        self._size = 0
+        self._chunks = []
+        self._buffered = 0
+        self._last_write = 0
+
+        # Id of every socket recorded, by socket key
+        self._ids = {}
+        self._next_id = 0
+        self._ticks = 0
+        self._filter = None
+        self._full = True
+        # A collection was dropped, set by record() for the next one
+        # queued
+        self._dropped = False
+
+    def record(self, delta, socket_filter=None, selected=None):
+        """
+        Queue a collection
+
+        Arguments:
+        delta -- SnapshotDelta of the collection, every collection must
+                 be given in order
+        socket_filter -- SocketFilter of the sockets recorded, None for
+                         all the collected ones
+        selected -- Set of the keys of the sockets socket_filter
+                    matches, as socketindex.SocketIndex.select() finds
+                    them, None to match them here
+        """
+        try:
+            self._queue.put_nowait((delta, socket_filter, selected,
+                                    self._dropped))
+        except Queue.Full:
+            # The sockets diverged, the record of the next collection
+            # queued restarts from all
+            self._dropped = True
+        else:
+            self._dropped = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._open()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write the collections queued and close the file
+        """
+        if self._thread is None:
+            return
+
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._flush()
+        self._file.close()
+        self._file = None
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=WRITE_BUFFER_TIME)
+            except Queue.Empty:
+                self._flush()
+                continue
+
+            if item is None:
+                return
+
+            if self._size + self._buffered >= self.max_bytes:
+                self._flush()
+                self._rotate()
+            self._write(self._encode(*item))
+            if time.time() - self._last_write >= WRITE_BUFFER_TIME:
+                self._flush()
+
+    def _encode(self, delta, socket_filter, keys_selected=None,
+                dropped=False):
+        keys = delta.keys
+        def selected(index):
+            if socket_filter is None:
+                return True
+            if keys_selected is not None:
+                return keys[index] in keys_selected
+            row = delta.row(index)
+            match = socket_filter.match_family(row.table.family)
+            return match is None or match(
+                row.state, row.local_ip, row.local_port, row.rem_ip,
+                row.rem_port, row.uid, row.tx_queue, row.rx_queue)
+
+        full = self._full or dropped or delta.interval is None or \
+            socket_filter is not self._filter or \
+            self._ticks % KEYFRAME_INTERVAL == 0
+        self._full = False
+        self._filter = socket_filter
+        self._ticks += 1
+
+        if full:
+            return self._encode_full(delta, socket_filter, keys_selected)
+
+        ids = self._ids
+        added = [index for index in delta.added if selected(index)]
+        removed = []
+        changed = []
+        for key in delta.removed:
+            if key in ids:
+                removed.append(ids.pop(key))
+        # A change may select or unselect the socket
+        for index in delta.changed:
+            key = keys[index]
+            if not selected(index):
+                if key in ids:
+                    removed.append(ids.pop(key))
+            elif key in ids:
+                changed.append(index)
+            else:
+                added.append(index)
+
+        chunks = [TICK.pack(time.time(), 0, len(added), len(removed),
+                            len(changed))]
+        proto_numbers = {}
+        for index in added:
+            row = delta.row(index)
+            table = row.table
+            if table.proto not in proto_numbers:
+                proto_numbers[table.proto] = PROTOCOLS.index(table.proto)
+
+            ids[keys[index]] = self._next_id
+            chunks.append(ROW.pack(
+                self._next_id, proto_numbers[table.proto],
+                *(_words(row.local_ip) + (row.local_port,) +
+                  _words(row.rem_ip) +
+                  (row.rem_port, row.state, row.tx_queue, row.rx_queue,
+                   row.uid, row.inode))
+            ))
+            self._next_id += 1
+        chunks.extend(REMOVED.pack(socket_id) for socket_id in removed)
+        for index in changed:
+            row = delta.row(index)
+            chunks.append(CHANGE.pack(ids[keys[index]], row.state,
+                                      row.tx_queue, row.rx_queue, row.uid))
+
+        record = "".join(chunks)
+        return RECORD_LENGTH.pack(len(record)) + record
+
+    def _encode_full(self, delta, socket_filter, keys_selected):
+        # Every socket, read from the columns rather than by row
+        ids = self._ids
+        ids.clear()
+        pack = ROW.pack
+        chunks = []
+        socket_id = 0
+        offset = 0
+
+        for table in delta.tables:
+            keys = delta.keys[offset:offset + len(table)]
+            offset += len(table)
+            proto = PROTOCOLS.index(table.proto)
+            local_ips = table.addresses(table.local_ip)
+            rem_ips = table.addresses(table.rem_ip)
+            ipv4 = table.words == 1
+            match = None
+            if socket_filter is not None:
+                match = socket_filter.match_family(table.family)
+
+            for (key, local_ip, local_port, rem_ip, rem_port, state,
+                 tx_queue, rx_queue, uid, inode) in itertools.izip(
+                    keys, local_ips, table.local_port, rem_ips,
+                    table.rem_port, table.state, table.tx_queue,
+                    table.rx_queue, table.uid, table.inode):
+                if keys_selected is not None:
+                    if key not in keys_selected:
+                        continue
+                elif match is not None and not match(
+                        state, local_ip, local_port, rem_ip, rem_port, uid,
+                        tx_queue, rx_queue):
+                    continue
+
+                ids[key] = socket_id
+                if ipv4:
+                    chunks.append(pack(
+                        socket_id, proto, local_ip, 0, 0, 0, local_port,
+                        rem_ip, 0, 0, 0, rem_port, state, tx_queue,
+                        rx_queue, uid, inode))
+                else:
+                    chunks.append(pack(
+                        socket_id, proto, *(local_ip + (local_port,) +
+                                            rem_ip +
+                                            (rem_port, state, tx_queue,
+                                             rx_queue, uid, inode))))
+                socket_id += 1
+
+        self._next_id = socket_id
+        record = TICK.pack(time.time(), FULL, socket_id, 0, 0) + \
+            "".join(chunks)
+        return RECORD_LENGTH.pack(len(record)) + record
+
+    def _write(self, record):
+        self._chunks.append(record)
+        self._buffered += len(record)
+        if self._buffered >= WRITE_BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._chunks:
+            self._file.write("".join(self._chunks))
+            self._size += self._buffered
+            self._chunks = []
+            self._buffered = 0
+        self._file.flush()
+        self._last_write = time.time()
+
+    def _open(self):
+        self._file = open(self.path, "wb")
+        self._file.write(MAGIC)
+        self._size = len(MAGIC)
+        # The file must be readable on its own
+        self._full = True
+
+    def _rotate(self):
+        self._file.close()
+        for number in range(self.backups - 1, 0, -1):
+            name = "%s.%d" % (self.path, number)
+            if os.path.exists(name):
+                os.rename(name, "%s.%d" % (self.path, number + 1))
+        if self.backups > 0:
+            os.rename(self.path, self.path + ".1")
+        self._open()
+
+
+class Replay(NetStat):
+    """
+    NetStat collecting from a recording instead of the kernel
+
+    Every collect() returns the sockets of the current collection of
+    the file and moves to the next one, unless paused. The file is
+    mapped in memory and only the offsets of the records are indexed.
+
+    Arguments:
+    path -- File written by a Recorder
+    """
+
+    def __init__(self, path):
+        NetStat.__init__(self)
+        self.path = path
+        # Only the sockets are recorded
+        self.counters = None
+
+        with open(path, "rb") as fd:
+            self.data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a netpath recording: %s" % path)
+
+        # Offset of every record, and of the FULL ones
+        self.offsets = []
+        self.keyframes = []
+        offset = len(MAGIC)
+        while offset + RECORD_LENGTH.size + TICK.size <= len(self.data):
+            length = RECORD_LENGTH.unpack_from(self.data, offset)[0]
+            if offset + RECORD_LENGTH.size + length > len(self.data):
+                # Cut while being written
+                break
+            if TICK.unpack_from(self.data,
+                                offset + RECORD_LENGTH.size)[1] & FULL:
+                self.keyframes.append(len(self.offsets))
+            self.offsets.append(offset)
+            offset += RECORD_LENGTH.size + length
+
+        # The records before the first FULL one can't be decoded
+        if self.keyframes:
+            del self.offsets[:self.keyframes[0]]
+            first = self.keyframes[0]
+            self.keyframes = [index - first for index in self.keyframes]
+        else:
+            self.offsets = []
+
+        self.position = -1
+        self.paused = False
+        self.time = None
+        # Fields of every socket, by id, at position, only used from
+        # the thread calling collect()
+        self._sockets = {}
+        # Moves asked by step() and seek(), (relative, position)
+        self._moves = Queue.Queue()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        NetStat.close(self)
+        self.data.close()
+
+    def step(self, count):
+        """
+        Move count collections forward, or backward if negative, and
+        pause
+
+        The move is done by the next collect(), on its thread.
+        """
+        self.paused = True
+        self._moves.put((True, count))
+
+    def seek(self, position):
+        """
+        Move to a collection of the file
+
+        The move is done by the next collect(), on its thread.
+        """
+        self._moves.put((False, position))
+
+    def _seek(self, position):
+        position = max(min(position, len(self.offsets) - 1), 0)
+        if position < self.position or self.position < 0:
+            # Restart from the FULL record at or before it
+            start = 0
+            for keyframe in self.keyframes:
+                if keyframe <= position:
+                    start = keyframe
+            self.position = start
+            self._apply(start)
+
+        while self.position < position:
+            self.position += 1
+            self._apply(self.position)
+
+    def _apply(self, position):
+        data = self.data
+        offset = self.offsets[position] + RECORD_LENGTH.size
+        self.time, flags, added, removed, changed = \
+            TICK.unpack_from(data, offset)
+        offset += TICK.size
+
+        sockets = self._sockets
+        if flags & FULL:
+            sockets.clear()
+        for _ in range(added):
+            fields = ROW.unpack_from(data, offset)
+            sockets[fields[0]] = list(fields[1:])
+            offset += ROW.size
+        for _ in range(removed):
+            sockets.pop(REMOVED.unpack_from(data, offset)[0], None)
+            offset += REMOVED.size
+        for _ in range(changed):
+            socket_id, state, tx_queue, rx_queue, uid = \
+                CHANGE.unpack_from(data, offset)
+            fields = sockets.get(socket_id)
+            if fields is not None:
+                fields[11:15] = [state, tx_queue, rx_queue, uid]
+            offset += CHANGE.size
+
+    def collect(self, protocols, ret_format, socket_filter=None):
+        """
+        Return the sockets of the current collection of the file, as
+        NetStat.collect(), and move to the next one
+
+        All the protocols recorded are returned, whatever protocols.
+        """
+        if not self.offsets:
+            return []
+
+        # The moves asked so far, more may be while they are done
+        position = self.position
+        if self._moves.empty() and not self.paused:
+            position += 1
+        for _ in range(self._moves.qsize()):
+            relative, target = self._moves.get_nowait()
+            if relative:
+                target += max(position, 0)
+            position = max(min(target, len(self.offsets) - 1), 0)
+        self._seek(max(position, 0))
+
+        tables = {}
+        for socket_id in sorted(self._sockets):
+            fields = self._sockets[socket_id]
+            proto = PROTOCOLS[fields[0]]
+            table = tables.get(proto)
+            if table is None:
+                table = tables[proto] = SocketTable(proto, ret_format, self)
+
+            local_ip = fields[1:5]
+            rem_ip = fields[6:10]
+            if table.words == 1:
+                local_ip = local_ip[0]
+                rem_ip = rem_ip[0]
+            else:
+                local_ip = tuple(local_ip)
+                rem_ip = tuple(rem_ip)
+
+            state, tx_queue, rx_queue, uid, inode = fields[11:16]
+            if socket_filter is not None:
+                match = socket_filter.match_family(table.family)
+                if match is not None and not match(
+                        state, local_ip, fields[5], rem_ip, fields[10], uid,
+                        tx_queue, rx_queue):
+                    continue
+
+            table.append(len(table), local_ip, fields[5], rem_ip,
+                         fields[10], state, tx_queue, rx_queue, 0, 0, 0,
+                         uid, 0, inode)
+            if table.family == socket.AF_UNIX:
+                table.paths.append("")
+
+        return [tables[proto] for proto in PROTOCOLS if proto in tables]
@@ -0,0 +1,150 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Reverse DNS of the remote ips, resolved in the background
+
+A lookup can take seconds, the screen never waits for one: an ip is
+shown as a number until its name is resolved, and redrawn then.
+"""
+
+import collections
+import socket
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+import utils
+
+# Threads resolving the ips
+RESOLVER_WORKERS = 4
+
+# Lookups started per tick at most, the others wait for the next ticks
+RESOLVER_LOOKUPS = 32
+
+# Names kept, and seconds an ip is kept with its name or without one
+RESOLVER_CACHE_SIZE = 4096
+RESOLVER_TTL = 600
+RESOLVER_NEGATIVE_TTL = 60
+
+
+def _lookup(ip_string):
+    # The name of an ip, None if it has none
+    try:
+        return socket.gethostbyaddr(ip_string)[0]
+    except (socket.herror, socket.gaierror, socket.error):
+        return None
+
+
+class Resolver:
+    """
+    Names of the ips, looked up by a pool of threads
+
+    name() and tick() are called from one thread, the one formatting
+    the sockets. An ip is looked up once at a time whoever asks for it,
+    the names and the failures are cached for RESOLVER_TTL and
+    RESOLVER_NEGATIVE_TTL seconds.
+
+    Arguments:
+    address -- Function converting an ip of the tables to a string, as
+               NetStat.human_ip()
+    lookup -- Function returning the name of an ip string, None if it
+              has none
+    workers -- Threads resolving the ips
+    lookups -- Lookups started per tick at most
+    """
+
+    def __init__(self, address, lookup=_lookup, workers=RESOLVER_WORKERS,
+                 lookups=RESOLVER_LOOKUPS):
+        self.address = address
+        self.lookup = lookup
+        self.lookups = lookups
+        # Name of the ips resolved, "" for the ones without name
+        self.cache = utils.LRUCache(RESOLVER_CACHE_SIZE, RESOLVER_TTL)
+
+        # Ips waiting for a lookup, oldest first, to their string
+        self.waiting = collections.OrderedDict()
+        # Ips being looked up
+        self.pending = set()
+        # Lookups which can still be started during this tick
+        self.budget = lookups
+
+        # (ip, name) resolved by the threads, not cached yet
+        self._done = []
+        self._lock = threading.Lock()
+        self.pool = ThreadPool(workers)
+
+    def close(self):
+        self.pool.terminate()
+
+    def name(self, ip_address):
+        """
+        Returns:
+        Return the name of an ip, None if not resolved yet or if it has
+        none. The ip is looked up then, never waited for.
+        """
+        name = self.cache.get(ip_address)
+        if name is not None:
+            return name or None
+
+        if ip_address not in self.pending and \
+                ip_address not in self.waiting and \
+                len(self.waiting) < RESOLVER_CACHE_SIZE:
+            self.waiting[ip_address] = self.address(ip_address)
+            self._start()
+        return None
+
+    def tick(self):
+        """
+        Cache the names resolved and start the lookups waiting, once per
+        refresh
+
+        Returns:
+        Return the set of the ips named since the previous tick
+        """
+        with self._lock:
+            done, self._done = self._done, []
+
+        resolved = set()
+        for ip_address, name in done:
+            self.pending.discard(ip_address)
+            if name is None:
+                self.cache.set(ip_address, "", RESOLVER_NEGATIVE_TTL)
+            else:
+                self.cache.set(ip_address, name)
+                resolved.add(ip_address)
+
+        self.budget = self.lookups
+        self._start()
+        return resolved
+
+    def _start(self):
+        while self.waiting and self.budget > 0:
+            ip_address, ip_string = self.waiting.popitem(last=False)
+            self.pending.add(ip_address)
+            self.budget -= 1
+            self.pool.apply_async(self._resolve, (ip_address, ip_string))
+
+    def _resolve(self, ip_address, ip_string):
+        # In a thread of the pool
+        try:
+            name = self.lookup(ip_string)
+        except Exception:
+            name = None
+
+        with self._lock:
+            self._done.append((ip_address, name))
@@ -0,0 +1,153 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Refresh interval adapted to the CPU netpath may use
+
+The CPU time of the process is measured between two collections: it
+covers the collection, the screen drawn from it and the background
+threads, plus the workers of the tables parsed in parallel. The
+interval is the one keeping that cost within the budget, and the work
+is cut down when backing off isn't enough.
+"""
+
+import os
+import time
+
+from collector import MAX_INTERVAL
+
+# Levels of degradation, each one keeps the savings of the ones before:
+# the user names are no longer looked up, then only the summary of the
+# sockets is shown
+DEGRADE_NONE, DEGRADE_USERS, DEGRADE_SUMMARY = range(0, 3)
+
+# Degraded a level further when the budget would need an interval this
+# many times the one asked, restored when it fits in the one asked
+PRESSURE = 4
+
+# Collections a level is kept before changing again, doubled every time
+# a level restored had to be degraded again
+HOLD_COLLECTIONS = 3
+MAX_HOLD_COLLECTIONS = 48
+
+# Weight of a new measure in the smoothed cost and CPU share
+SMOOTHING = 0.3
+
+
+def _cpu_time():
+    # CPU seconds of the threads of the process
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Scheduler:
+    """
+    Interval of the collections keeping the CPU used under a share of
+    one core
+
+    tick() is called after every collection and returns the interval
+    until the next one: the interval asked while the cost fits the
+    budget, longer when it doesn't, up to MAX_INTERVAL. When the budget
+    would need more than PRESSURE times the interval asked, level goes
+    up; when the cost fits the interval asked again, it goes down.
+
+    Arguments:
+    interval -- Shortest interval between two collections, in seconds
+    max_cpu -- Share of one core the process may use, 0.05 for 5%, None
+               to keep the interval
+    parallel -- parallel.ParallelParser whose workers are counted, None
+                if the tables are parsed serially
+    """
+
+    def __init__(self, interval, max_cpu=None, parallel=None):
+        self.interval = interval
+        self.max_cpu = max_cpu
+        self.parallel = parallel
+
+        # Interval of the next collection
+        self.current = interval
+        # Smoothed CPU seconds per collection, and share of one core
+        # used, None until measured
+        self.cost = None
+        self.cpu = None
+        # Degradation, see DEGRADE_NONE
+        self.level = DEGRADE_NONE
+
+        self._hold = 0
+        self._hold_collections = HOLD_COLLECTIONS
+        self._restored = False
+        # (time, CPU time) of the previous tick
+        self._last = None
+
+    def rate(self):
+        """
+        Returns:
+        Return the collections per second
+        """
+        return 1.0 / self.current
+
+    def tick(self):
+        """
+        Measure the cost of the collection done, once per collection
+
+        Returns:
+        Return the seconds until the next collection
+        """
+        now = time.time()
+        cpu = _cpu_time()
+        if self.parallel is not None:
+            cpu += self.parallel.cpu_time
+        last = self._last
+        self._last = (now, cpu)
+        if last is None or now <= last[0]:
+            return self.current
+
+        cost = cpu - last[1]
+        share = cost / (now - last[0])
+        if self.cost is None:
+            self.cost, self.cpu = cost, share
+        else:
+            self.cost += SMOOTHING * (cost - self.cost)
+            self.cpu += SMOOTHING * (share - self.cpu)
+
+        if self.max_cpu is None:
+            return self.current
+
+        wanted = self.cost / self.max_cpu
+        self.current = min(max(wanted, self.interval), MAX_INTERVAL)
+
+        if self._hold > 0:
+            self._hold -= 1
+        elif wanted > PRESSURE * self.interval and \
+                self.level < DEGRADE_SUMMARY:
+            if self._restored:
+                # Restoring cost too much, wait longer before retrying
+                self._hold_collections = min(self._hold_collections * 2,
+                                             MAX_HOLD_COLLECTIONS)
+            self._change(self.level + 1, False)
+        elif wanted <= self.interval and self.level > DEGRADE_NONE:
+            self._change(self.level - 1, True)
+        elif self._restored:
+            self._restored = False
+            self._hold_collections = HOLD_COLLECTIONS
+
+        return self.current
+
+    def _change(self, level, restored):
+        self.level = level
+        self._restored = restored
+        self._hold = self._hold_collections
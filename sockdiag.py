@@ -0,0 +1,174 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Socket collection through NETLINK_SOCK_DIAG (see sock_diag(7))
+
+The kernel sends the sockets as binary inet_diag_msg structs, there
+is no table to format and parse again as with /proc/net/tcp, and the
+states not requested are skipped by the kernel.
+"""
+
+import os
+import socket
+import struct
+import sys
+from array import array
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+# All the TCP states, as bits of inet_diag_req_v2.idiag_states
+TCPF_ALL = 0xFFF
+TCP_LISTEN = 10
+
+# struct nlmsghdr
+NLMSGHDR = struct.Struct("=LHHLL")
+# struct inet_diag_req_v2 with an empty inet_diag_sockid
+INET_DIAG_REQ_V2 = struct.Struct("=BBBxI48x")
+# struct inet_diag_msg, sockid ports are in network order and swapped
+# afterwards
+INET_DIAG_MSG = struct.Struct("=BBBBHH4L4L4x8xIIIII")
+
+RECV_BUFFER_SIZE = 1 << 17
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _swap16(port):
+    # Network to host order of the ports
+    if sys.byteorder == "little":
+        return ((port & 0xFF) << 8) | (port >> 8)
+
+    return port
+
+
+class SockDiag:
+    """
+    Dump sockets through a NETLINK_SOCK_DIAG socket
+
+    Raises socket.error when netlink sock_diag is not available.
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG
+        )
+        self.sock.bind((0, 0))
+        self.seq = 0
+        # inet_diag_msg.idiag_expires is in ms, /proc in clock ticks
+        self.ms_per_tick = 1000 // os.sysconf("SC_CLK_TCK")
+
+    def close(self):
+        self.sock.close()
+
+    def collect(self, table, protocol=socket.IPPROTO_TCP, socket_filter=None):
+        """
+        Append the sockets of a protocol to a table
+
+        Arguments:
+        table -- SocketTable receiving the sockets, of the family to
+                 dump
+        protocol -- IPPROTO_TCP, IPPROTO_UDP...
+        socket_filter -- SocketFilter of the sockets to append, None for
+                         all. The states are filtered by the kernel
+        """
+        idiag_states = TCPF_ALL
+        match = None
+        if socket_filter is not None:
+            match = socket_filter.match
+            if socket_filter.states is not None:
+                idiag_states = 0
+                for state in socket_filter.states:
+                    idiag_states |= 1 << state
+
+        self.seq += 1
+        request = INET_DIAG_REQ_V2.pack(
+            table.family, protocol, 0, idiag_states
+        )
+        self.sock.sendto(
+            NLMSGHDR.pack(
+                NLMSGHDR.size + len(request), SOCK_DIAG_BY_FAMILY,
+                NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0
+            ) + request,
+            (0, 0)
+        )
+
+        rem_ports = array('H')
+        local_ports = array('H')
+        append = table.append
+        start = sl = len(table)
+        ms_per_tick = self.ms_per_tick
+        ipv4 = table.words == 1
+        unpack_header = NLMSGHDR.unpack_from
+        unpack_msg = INET_DIAG_MSG.unpack_from
+
+        while True:
+            data = self.sock.recv(RECV_BUFFER_SIZE)
+            offset = 0
+            while offset < len(data):
+                length, msg_type, _, _, _ = unpack_header(data, offset)
+                if msg_type == NLMSG_DONE:
+                    table.local_port[start:] = \
+                        self._network_order(local_ports)
+                    table.rem_port[start:] = self._network_order(rem_ports)
+                    return table
+
+                if msg_type == NLMSG_ERROR:
+                    errno = -struct.unpack_from("=i", data, offset + 16)[0]
+                    raise socket.error(errno, os.strerror(errno))
+
+                msg = unpack_msg(data, offset + NLMSGHDR.size)
+                _, state, timer, retrans, sport, dport = msg[:6]
+                expires, rqueue, wqueue, uid, inode = msg[14:]
+                if ipv4:
+                    src = msg[6]
+                    dst = msg[10]
+                else:
+                    src = msg[6:10]
+                    dst = msg[10:14]
+
+                offset += _align(length)
+
+                # Listeners report the max backlog as wqueue, /proc 0
+                if state == TCP_LISTEN:
+                    wqueue = 0
+
+                if match is not None and not match(
+                        state, src, _swap16(sport), dst, _swap16(dport), uid,
+                        wqueue, rqueue):
+                    continue
+
+                local_ports.append(sport)
+                rem_ports.append(dport)
+                append(sl, src, 0, dst, 0, state, wqueue, rqueue,
+                       timer, expires // ms_per_tick, retrans, uid, 0,
+                       inode)
+                sl += 1
+
+    def _network_order(self, ports):
+        if sys.byteorder == "little":
+            ports.byteswap()
+
+        return ports
@@ -0,0 +1,634 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Filters of sockets, expressions compiled to Python functions
+
+An expression is terms joined by "and", "or", "not" and parentheses,
+terms next to each other are joined by "and":
+
+    state established and ip 10.0.0.0/8 and port 5432 and rx_queue > 0
+
+A term is a field, an optional operator, =, ==, !=, <, <=, > or >=, and
+a value or a comma separated list of values, any of them matching:
+
+    ip, local_ip, rem_ip      IPv4 or IPv6 address or CIDR network
+    port, local_port,         port or range, "8000-8080"
+    rem_port
+    ip:port                   "10.0.0.1:22", "[::1]:8000-8080", the ip
+                              and port of the same end
+    state                     state name, "established"
+    user                      user name or uid
+    tx_queue, rx_queue        bytes or range
+
+ip and port match either end of the socket. <, <=, > and >= compare the
+ports, users and queues. Unix sockets have no address, only the state,
+user and queue terms match them.
+"""
+
+import pwd
+import re
+import socket
+import struct
+
+
+def _proc_int(packed):
+    """
+    Convert a packed address to the integer /proc/net/tcp shows, the
+    IPv4 127.0.0.1 is 0100007F. IPv6 addresses are shown as 4 words in
+    the same order and are converted to a 128 bit integer.
+    """
+    if len(packed) == 4:
+        return struct.unpack("<L", packed)[0]
+
+    return words_int(struct.unpack("<4L", packed))
+
+
+def words_int(words):
+    """
+    Convert the 4 words of an IPv6 address of a SocketTable to the 128
+    bit integer of its /proc hex string
+    """
+    return (words[0] << 96) | (words[1] << 64) | (words[2] << 32) | words[3]
+
+
+def parse_network(ip_address):
+    """
+    Parse an IPv4 or IPv6 address or CIDR network, "10.0.0.0/8"
+
+    Returns:
+    Return the (family, network, mask), network and mask as /proc/net
+    integers. An address belongs to it when address & mask == network
+    """
+    family = socket.AF_INET
+    bits = 32
+    if ":" in ip_address:
+        family = socket.AF_INET6
+        bits = 128
+
+    prefix = bits
+    if "/" in ip_address:
+        ip_address, prefix = ip_address.split("/", 1)
+        prefix = int(prefix)
+        if prefix < 0 or prefix > bits:
+            raise ValueError("invalid network prefix: %d" % prefix)
+
+    try:
+        network = _proc_int(socket.inet_pton(family, ip_address.strip("[]")))
+    except socket.error:
+        raise ValueError("invalid ip address: %s" % ip_address)
+
+    # The mask in network order, converted as the addresses
+    mask = ((1 << bits) - 1) ^ ((1 << (bits - prefix)) - 1)
+    mask = _proc_int(struct.pack(
+        "!%dL" % (bits // 32),
+        *[mask >> shift & 0xFFFFFFFF for shift in range(bits - 32, -32, -32)]
+    ))
+
+    return family, network & mask, mask
+
+
+# Types of the filters of one term, see filter_expression()
+FILTER_TYPES = ("ip", "port", "ip:port", "state", "user")
+
+# Columns compared by the terms of every field, ip:port compares the ip
+# and port of either end
+_TERM_COLUMNS = {
+    'ip': ('local_ip', 'rem_ip'),
+    'local_ip': ('local_ip',),
+    'rem_ip': ('rem_ip',),
+    'port': ('local_port', 'rem_port'),
+    'local_port': ('local_port',),
+    'rem_port': ('rem_port',),
+    'ip:port': (('local_ip', 'local_port'), ('rem_ip', 'rem_port')),
+    'state': ('state',),
+    'user': ('uid',),
+    'tx_queue': ('tx_queue',),
+    'rx_queue': ('rx_queue',),
+}
+
+# Fields compared with <, <=, > and >=, and their greatest value
+_ORDERED_FIELDS = {
+    'port': 0xFFFF,
+    'local_port': 0xFFFF,
+    'rem_port': 0xFFFF,
+    'user': 0xFFFFFFFF,
+    'tx_queue': 0xFFFFFFFF,
+    'rx_queue': 0xFFFFFFFF,
+}
+
+_OPERATORS = ("=", "==", "!=", "<", "<=", ">", ">=")
+
+# A parenthesis, an operator or a word
+_TOKEN_RE = re.compile(r"\s*(?:([()]|[!=<>]=|[=<>])|([^\s()!=<>]+))")
+
+# Arguments of SocketFilter.match
+_COLUMN_ARGUMENTS = \
+    "state, local_ip, local_port, rem_ip, rem_port, uid, tx_queue, rx_queue"
+
+# Group of the column in the NET_TCP_RE rows, base and format of the
+# hex fields
+_HEX_COLUMNS = {
+    'local_ip': (1, 16, None),
+    'local_port': (2, 16, "%04X"),
+    'rem_ip': (3, 16, None),
+    'rem_port': (4, 16, "%04X"),
+    'state': (5, 16, "%02X"),
+    'tx_queue': (6, 16, "%08X"),
+    'rx_queue': (7, 16, "%08X"),
+    'uid': (11, 10, "%d"),
+}
+
+_ADDRESS_COLUMNS = ('local_ip', 'local_port', 'rem_ip', 'rem_port')
+
+
+def filter_expression(filter_type, filter_data):
+    """
+    Returns:
+    Return the expression of a filter, see SocketFilter
+
+    Raises ValueError when filter_type is not valid.
+    """
+    if filter_type == "expression":
+        return filter_data
+
+    if filter_type not in FILTER_TYPES:
+        raise ValueError("invalid filter type: %s" % filter_type)
+
+    return "%s %s" % (filter_type, filter_data.strip())
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if match is None:
+            raise ValueError("invalid character in filter: %s" %
+                             expression[position:].lstrip()[0])
+        tokens.append(match.group(1) or match.group(2))
+        position = match.end()
+
+    return tokens
+
+
+def _keyword(token):
+    if token is None:
+        return None
+    return token.lower()
+
+
+def _join(kind, nodes):
+    """
+    Build the "and" or "or" of expression nodes
+
+    The nested nodes of the same kind are flattened, and the values of
+    a column an "or" accepts merged in one set.
+    """
+    children = []
+    for node in nodes:
+        if node[0] == kind:
+            children.extend(node[1])
+        else:
+            children.append(node)
+
+    if kind == "or":
+        merged = []
+        positions = {}
+        for node in children:
+            if node[0] != "values":
+                merged.append(node)
+                continue
+
+            position = positions.get(node[1])
+            if position is None:
+                positions[node[1]] = len(merged)
+                merged.append(node)
+            else:
+                merged[position] = ("values", node[1],
+                                    merged[position][2] | node[2])
+        children = merged
+
+    if len(children) == 1:
+        return children[0]
+
+    return (kind, children)
+
+
+def _range(column, low, high):
+    # Node of the values from low to high, high None for no limit
+    if high is not None and low > high:
+        return ("values", column, frozenset())
+
+    if low == high:
+        return ("values", column, frozenset([low]))
+
+    return ("range", column, low, high)
+
+
+class _Parser:
+    """
+    Parse an expression to a tree of tuples:
+
+        ("and", [node, ...]), ("or", [node, ...]), ("not", node)
+        ("values", column, frozenset of values)
+        ("range", column, low, high), high None for no limit
+        ("network", column, (family, network, mask))
+
+    The columns are the ones of SocketTable.
+    """
+
+    def __init__(self, expression, conn_status):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.states = dict((name, int(number))
+                           for number, name in conn_status.items())
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("empty filter")
+
+        node = self._or()
+        if self.position < len(self.tokens):
+            raise ValueError("unexpected %s in filter" %
+                             self.tokens[self.position])
+
+        return node
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _next(self, expected):
+        token = self._peek()
+        if token is None:
+            raise ValueError("filter ends before %s" % expected)
+
+        self.position += 1
+        return token
+
+    def _or(self):
+        nodes = [self._and()]
+        while _keyword(self._peek()) == "or":
+            self.position += 1
+            nodes.append(self._and())
+
+        return _join("or", nodes)
+
+    def _and(self):
+        nodes = [self._not()]
+        while True:
+            token = self._peek()
+            if token is None or token == ")" or _keyword(token) == "or":
+                break
+            if _keyword(token) == "and":
+                self.position += 1
+            nodes.append(self._not())
+
+        return _join("and", nodes)
+
+    def _not(self):
+        token = self._next("a term")
+        if _keyword(token) == "not":
+            return ("not", self._not())
+
+        if token == "(":
+            node = self._or()
+            if self._next("')'") != ")":
+                raise ValueError("missing ')' in filter")
+            return node
+
+        return self._term(_keyword(token))
+
+    def _term(self, field):
+        if field not in _TERM_COLUMNS:
+            raise ValueError("unknown filter field: %s" % field)
+
+        operator = "="
+        if self._peek() in _OPERATORS:
+            operator = self._next("")
+
+        value = self._next("the value of %s" % field)
+        if value in ("(", ")") or value in _OPERATORS:
+            raise ValueError("missing value of %s" % field)
+
+        if operator in ("=", "==", "!="):
+            node = _join("or", [self._item(field, item)
+                                for item in value.split(",")])
+            if operator == "!=":
+                return ("not", node)
+            return node
+
+        if field not in _ORDERED_FIELDS:
+            raise ValueError("%s is only compared with = and !=" % field)
+
+        number = self._number(field, value)
+        low, high = {
+            "<": (0, number - 1),
+            "<=": (0, number),
+            ">": (number + 1, None),
+            ">=": (number, None),
+        }[operator]
+        return _join("or", [_range(column, low, high)
+                            for column in _TERM_COLUMNS[field]])
+
+    def _item(self, field, item):
+        if not item:
+            raise ValueError("empty value of %s" % field)
+
+        columns = _TERM_COLUMNS[field]
+        if field == "ip:port":
+            if ":" not in item:
+                raise ValueError("invalid ip:port: %s" % item)
+            address, port = item.rsplit(":", 1)
+            network = parse_network(address)
+            low, high = self._interval("port", port)
+            return _join("or", [
+                _join("and", [("network", ip_column, network),
+                              _range(port_column, low, high)])
+                for ip_column, port_column in columns
+            ])
+
+        if columns[0] in ("local_ip", "rem_ip"):
+            network = parse_network(item)
+            return _join("or", [("network", column, network)
+                                for column in columns])
+
+        if field == "state":
+            state = self.states.get(item.upper())
+            if state is None:
+                raise ValueError("unknown state: %s" % item)
+            return ("values", "state", frozenset([state]))
+
+        if field == "user":
+            return ("values", "uid", frozenset([self._number(field, item)]))
+
+        low, high = self._interval(field, item)
+        return _join("or", [_range(column, low, high) for column in columns])
+
+    def _number(self, field, value):
+        if field == "user" and not value.isdigit():
+            try:
+                return pwd.getpwnam(value).pw_uid
+            except KeyError:
+                raise ValueError("unknown user: %s" % value)
+
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError("invalid %s: %s" % (field, value))
+
+    def _interval(self, field, item):
+        # A number or a range of the field, "8000-8080"
+        first, _, last = item.partition("-")
+        try:
+            low = int(first)
+            high = int(last or first)
+        except ValueError:
+            raise ValueError("invalid %s: %s" % (field, item))
+
+        if low < 0 or high > _ORDERED_FIELDS[field] or low > high:
+            raise ValueError("invalid %s: %s" % (field, item))
+
+        return low, high
+
+
+def _constant(constants, value):
+    name = "_c%d" % len(constants)
+    constants[name] = value
+    return name
+
+
+def _compare_values(field, values, constants):
+    if not values:
+        return False
+
+    if len(values) == 1:
+        return "%s == %r" % (field, iter(values).next())
+
+    return "%s in %s" % (field, _constant(constants, values))
+
+
+def _compare_range(field, low, high):
+    if high is None:
+        return "%s >= %d" % (field, low)
+
+    if low == 0:
+        return "%s <= %d" % (field, high)
+
+    return "%d <= %s <= %d" % (low, field, high)
+
+
+def _column_term(node, constants):
+    # A term on the SocketTable columns, the IPv6 ips are tuples of 4
+    # words
+    kind, column = node[0], node[1]
+    if kind == "values":
+        return _compare_values(column, node[2], constants)
+
+    if kind == "range":
+        return _compare_range(column, node[2], node[3])
+
+    family, network, mask = node[2]
+    if family == socket.AF_INET:
+        if mask == 0xFFFFFFFF:
+            return "%s == %d" % (column, network)
+        return "(%s.__class__ is not _tuple and %s & %d == %d)" % (
+            column, column, mask, network)
+
+    if mask == (1 << 128) - 1:
+        words = tuple(network >> shift & 0xFFFFFFFF
+                      for shift in (96, 64, 32, 0))
+        return "%s == %s" % (column, _constant(constants, words))
+
+    return "(%s.__class__ is _tuple and _words_int(%s) & %s == %s)" % (
+        column, column, _constant(constants, mask),
+        _constant(constants, network))
+
+
+def _hex_term(node, constants):
+    # A term on the hex fields of a row matched by NET_TCP_RE
+    group, base, hex_format = _HEX_COLUMNS[node[1]]
+    field = "row[%d]" % group
+    if node[0] == "values":
+        return _compare_values(
+            field, frozenset(hex_format % value for value in node[2]),
+            constants)
+
+    if node[0] == "range":
+        return _compare_range("_int(%s, %d)" % (field, base),
+                              node[2], node[3])
+
+    # 8 hex digits for IPv4 addresses, 32 for IPv6
+    family, network, mask = node[2]
+    digits = 8
+    if family == socket.AF_INET6:
+        digits = 32
+
+    if mask == (1 << digits * 4) - 1:
+        return "%s == %r" % (field, "%0*X" % (digits, network))
+
+    return "(len(%s) == %d and _int(%s, 16) & %s == %s)" % (
+        field, digits, field, _constant(constants, mask),
+        _constant(constants, network))
+
+
+def _unix_term(node, constants):
+    # Unix sockets have neither addresses nor ports
+    if node[1] in _ADDRESS_COLUMNS:
+        return False
+
+    return _column_term(node, constants)
+
+
+def _source(node, term, constants):
+    """
+    Build the Python expression of a tree, the terms built by term()
+
+    Returns:
+    Return the source, or True or False when it is constant
+    """
+    kind = node[0]
+    if kind in ("and", "or"):
+        # True ends an "or", False an "and"
+        ends = kind == "or"
+        parts = []
+        for child in node[1]:
+            part = _source(child, term, constants)
+            if part is ends:
+                return ends
+            if part is not (not ends):
+                parts.append(part)
+
+        if not parts:
+            return not ends
+        if len(parts) == 1:
+            return parts[0]
+        return "(%s)" % (" %s " % kind).join(parts)
+
+    if kind == "not":
+        part = _source(node[1], term, constants)
+        if isinstance(part, bool):
+            return not part
+        return "(not %s)" % part
+
+    return term(node, constants)
+
+
+def _compile(arguments, source, constants):
+    # One lambda, the constants of the source are its globals
+    namespace = {'_int': int, '_tuple': tuple, '_words_int': words_int}
+    namespace.update(constants)
+    return eval("lambda %s: %s" % (arguments, source), namespace)
+
+
+def _match_none(*columns):
+    return False
+
+
+def _conjuncts(tree):
+    # Nodes every socket matched matches
+    if tree[0] == "and":
+        return tree[1]
+    return [tree]
+
+
+class SocketFilter:
+    """
+    A filter of sockets, an expression compiled to the checks of the
+    raw table fields and of the integer columns
+
+    The expression is parsed once and compiled to Python functions,
+    checking a socket is then one call. The parsers check the hex
+    fields of /proc/net/tcp before converting them, and the states and
+    users every socket matched has are pushed down to the line regex,
+    so the sockets filtered out are never built.
+
+    Arguments:
+    filter_type -- "expression", or a type of FILTER_TYPES for the
+                   filters of one term: "ip", "port", "ip:port",
+                   "state" or "user"
+    filter_data -- The expression, see the module help, or the value of
+                   the term
+    conn_status -- NetStat.conn_status, to resolve the state names
+
+    Raises ValueError when the expression is not valid.
+    """
+
+    def __init__(self, filter_type, filter_data, conn_status):
+        self.filter_type = filter_type
+        self.filter_data = filter_data
+
+        # The expression parsed, see _Parser
+        self.tree = _Parser(filter_expression(filter_type, filter_data),
+                            conn_status).parse()
+
+        # Sets of states and uids of all the sockets matched, None
+        # accepts any
+        self.states = None
+        self.uids = None
+        others = []
+        for node in _conjuncts(self.tree):
+            if node[0] == "values" and node[1] == "state":
+                self.states = node[2] if self.states is None \
+                    else self.states & node[2]
+            elif node[0] == "values" and node[1] == "uid":
+                self.uids = node[2] if self.uids is None \
+                    else self.uids & node[2]
+            else:
+                others.append(node)
+
+        # Check a socket given as the SocketTable integer columns, the
+        # ips as SocketTable.address() returns them, see
+        # _COLUMN_ARGUMENTS
+        constants = {}
+        self.match = _compile(_COLUMN_ARGUMENTS,
+                              _source(self.tree, _column_term, constants),
+                              constants)
+
+        # Check a row matched by the /proc/net/tcp regex, the states and
+        # uids already checked by the regex, None if nothing to check
+        constants = {}
+        source = _source(("and", others), _hex_term, constants)
+        self.match_hex = None
+        if source is not True:
+            self.match_hex = _compile("row", source, constants)
+
+        # False when no unix socket matches, match_unix checks the
+        # others as match() does, None if all match
+        constants = {}
+        source = _source(self.tree, _unix_term, constants)
+        self.unix = source is not False
+        self.match_unix = None
+        if not isinstance(source, bool):
+            self.match_unix = _compile(_COLUMN_ARGUMENTS, source, constants)
+
+    def match_family(self, family):
+        """
+        Returns:
+        Return the check of the sockets of an address family as match(),
+        None if they all match
+        """
+        if family != socket.AF_UNIX:
+            return self.match
+
+        if not self.unix:
+            return _match_none
+
+        return self.match_unix
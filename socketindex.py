@@ -0,0 +1,302 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Indexes of the sockets on their ports, ips, state, user and queues
+
+The indexes map a value to the set of keys of the sockets having it,
+see SocketTable.keys(). They are kept up to date with the collections
+from their SnapshotDelta, only the sockets added, removed or changed
+are indexed again. The filters are evaluated on them with set
+operations.
+"""
+
+import collections
+import itertools
+import socket
+
+from socketfilter import words_int
+
+# Position of the fields in the socket keys, from the end as the keys
+# of a fleet start with the host
+_PROTO = -6
+_FIELDS = {
+    'local_ip': -5,
+    'local_port': -4,
+    'rem_ip': -3,
+    'rem_port': -2,
+}
+
+
+def _ip_key(family, network):
+    # The ip as the keys hold it, an int or the 4 words of IPv6
+    if family == socket.AF_INET:
+        return network
+
+    return tuple(network >> shift & 0xFFFFFFFF for shift in (96, 64, 32, 0))
+
+
+# Position of the fields in the (state, uid, tx_queue, rx_queue) of the
+# sockets
+_VALUES = {
+    'state': 0,
+    'uid': 1,
+    'tx_queue': 2,
+    'rx_queue': 3,
+}
+
+
+def _value(name, key, values):
+    # Value of a socket in an index, None if not indexed there
+    if name in _VALUES:
+        return values[_VALUES[name]]
+    if key[_PROTO] == "unix":
+        return None
+    return key[_FIELDS[name]]
+
+
+def _discard(index_values, value, key):
+    keys = index_values.get(value)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del index_values[value]
+
+
+def _union(sets):
+    result = set()
+    for keys in sets:
+        result.update(keys)
+
+    return result
+
+
+class SocketIndex:
+    """
+    Sockets of the last collection, indexed on local_port, rem_port,
+    local_ip, rem_ip, state, uid, tx_queue and rx_queue
+
+    An index is built when first looked up and maintained after, the
+    ones never looked up cost nothing. Unix sockets are only in the
+    state and uid indexes, as filters on addresses never select them.
+    """
+
+    def __init__(self):
+        # (state, uid, tx_queue, rx_queue) of every socket, by key
+        self.sockets = {}
+        # defaultdict {value: set of keys}, by index name
+        self.indexes = {}
+
+    def __len__(self):
+        return len(self.sockets)
+
+    def clear(self):
+        self.sockets.clear()
+        self.indexes.clear()
+
+    def update(self, delta):
+        """
+        Apply a collection
+
+        Arguments:
+        delta -- SnapshotDelta of the collection, every collection must
+                 be given in order. The first one of a snapshot, with no
+                 interval, replaces all the sockets.
+        """
+        sockets = self.sockets
+        keys = delta.keys
+
+        if delta.interval is None:
+            self.clear()
+            sockets.update(itertools.izip(keys, itertools.izip(*[
+                itertools.chain(*[getattr(table, name)
+                                  for table in delta.tables])
+                for name in ('state', 'uid', 'tx_queue', 'rx_queue')
+            ])))
+            return
+
+        indexes = self.indexes
+        for key in delta.removed:
+            values = sockets.pop(key, None)
+            if values is not None:
+                for name, index_values in indexes.iteritems():
+                    value = _value(name, key, values)
+                    if value is not None:
+                        _discard(index_values, value, key)
+
+        added = [keys[index] for index in delta.added]
+        for key, values in itertools.izip(added, self._added_values(delta)):
+            sockets[key] = values
+        for name, index_values in indexes.iteritems():
+            self._index(index_values, name, added)
+
+        for index in delta.changed:
+            row = delta.row(index)
+            key = keys[index]
+            values = (row.state, row.uid, row.tx_queue, row.rx_queue)
+            previous = sockets.get(key)
+            if previous == values:
+                continue
+            sockets[key] = values
+            for name, position in _VALUES.iteritems():
+                index_values = indexes.get(name)
+                if index_values is None:
+                    continue
+                if previous is not None:
+                    if previous[position] == values[position]:
+                        continue
+                    _discard(index_values, previous[position], key)
+                index_values[values[position]].add(key)
+
+    @staticmethod
+    def _added_values(delta):
+        # (state, uid, tx_queue, rx_queue) of the sockets added
+        for index in delta.added:
+            table, row = delta.locate(index)
+            yield (table.state[row], table.uid[row], table.tx_queue[row],
+                   table.rx_queue[row])
+
+    def _index(self, index_values, name, keys):
+        # Add sockets to an index
+        if name in _VALUES:
+            sockets = self.sockets
+            position = _VALUES[name]
+            for key in keys:
+                index_values[sockets[key][position]].add(key)
+            return
+
+        position = _FIELDS[name]
+        for key in keys:
+            if key[_PROTO] != "unix":
+                index_values[key[position]].add(key)
+
+    def index(self, name):
+        """
+        Returns:
+        Return the index of a field, {value: set of keys}, building it
+        if never looked up
+        """
+        index_values = self.indexes.get(name)
+        if index_values is not None:
+            return index_values
+
+        index_values = self.indexes[name] = collections.defaultdict(set)
+        self._index(index_values, name, self.sockets)
+        return index_values
+
+    def lookup(self, name, value):
+        """
+        Returns:
+        Return the keys of the sockets with a value, as a set not to be
+        modified
+        """
+        return self.index(name).get(value, frozenset())
+
+    def select(self, socket_filter):
+        """
+        Find the sockets a SocketFilter matches, as SocketFilter.match()
+
+        The terms of the filter are looked up in the indexes, "and" and
+        "or" intersect and join their sets, the smallest set first.
+
+        Returns:
+        Return a new set of the keys of the sockets
+        """
+        if socket_filter is None:
+            return set(self.sockets)
+
+        return self._select(socket_filter.tree)
+
+    def _select(self, node):
+        # A new set of the keys of the sockets a node of the tree of a
+        # SocketFilter matches
+        kind = node[0]
+        if kind == "or":
+            return _union(self._select(child) for child in node[1])
+
+        if kind == "and":
+            # Sockets not matched are removed from the others, and the
+            # ranges of the queues, of many values, checked on them
+            later = [child for child in node[1] if child[0] == "not" or
+                     (child[0] == "range" and child[1] in _VALUES)]
+            selected = [self._select(child) for child in node[1]
+                        if child not in later]
+            if selected:
+                selected.sort(key=len)
+                result = selected[0].intersection(*selected[1:])
+            else:
+                result = set(self.sockets)
+            for child in later:
+                if not result:
+                    break
+                if child[0] == "not":
+                    result -= self._select(child[1])
+                else:
+                    result = self._within(result, child)
+            return result
+
+        if kind == "not":
+            return set(self.sockets) - self._select(node[1])
+
+        if kind == "values":
+            return self._values(node[1], node[2])
+
+        if kind == "range":
+            low, high = node[2], node[3]
+            return _union(
+                keys for value, keys in self.index(node[1]).iteritems()
+                if low <= value and (high is None or value <= high)
+            )
+
+        return self._network(node[1], node[2])
+
+    def _within(self, keys, node):
+        # The keys whose value is in the range of a node, checked on the
+        # sockets unless fewer values are indexed
+        name, low, high = node[1:]
+        index_values = self.indexes.get(name)
+        if index_values is not None and len(index_values) < len(keys):
+            return keys & self._select(node)
+
+        position = _VALUES[name]
+        sockets = self.sockets
+        return set(key for key in keys
+                   if low <= sockets[key][position] and
+                   (high is None or sockets[key][position] <= high))
+
+    def _network(self, name, network):
+        family, address, mask = network
+        bits = 32 if family == socket.AF_INET else 128
+        if mask == (1 << bits) - 1:
+            return set(self.lookup(name, _ip_key(family, address)))
+
+        # Checked on every ip seen rather than every socket
+        words = family == socket.AF_INET6
+        return _union(
+            keys for ip, keys in self.index(name).iteritems()
+            if isinstance(ip, tuple) == words and
+            (words_int(ip) if words else ip) & mask == address
+        )
+
+    def _values(self, name, values):
+        index_values = self.index(name)
+        if len(values) < len(index_values):
+            return _union(index_values[value] for value in values
+                          if value in index_values)
+
+        return _union(keys for value, keys in index_values.iteritems()
+                      if value in values)
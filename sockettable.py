@@ -0,0 +1,396 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+import bisect
+import itertools
+import socket
+from array import array
+
+# Address family of the sockets of every /proc/net table
+PROTOCOL_FAMILIES = {
+    'tcp': socket.AF_INET,
+    'tcp6': socket.AF_INET6,
+    'udp': socket.AF_INET,
+    'udp6': socket.AF_INET6,
+    'raw': socket.AF_INET,
+    'raw6': socket.AF_INET6,
+    'unix': socket.AF_UNIX,
+}
+
+# Uid of the sockets without owner information, as unix sockets
+NO_UID = 0xFFFFFFFF
+
+# Name and array typecode of every column of a SocketTable
+COLUMNS = (
+    ('sl', 'I'),
+    ('local_ip', 'I'),
+    ('local_port', 'H'),
+    ('rem_ip', 'I'),
+    ('rem_port', 'H'),
+    ('state', 'B'),
+    ('tx_queue', 'I'),
+    ('rx_queue', 'I'),
+    ('timer', 'B'),
+    ('when', 'L'),
+    ('retrnsmt', 'I'),
+    ('uid', 'I'),
+    ('timeout', 'I'),
+    ('inode', 'L'),
+)
+
+
+class SocketTable:
+    """
+    Sockets of a /proc/net table stored as one integer array per column
+
+    Iterating the table returns SocketRow views which give the fields
+    as the dicts formerly returned by NetStat.collect_net_tcp().
+
+    IPv6 addresses take 4 entries of the ip columns, the 32 bit words
+    as in /proc/net/tcp6. Unix sockets have no addresses, their paths
+    are kept in the paths list.
+
+    Arguments:
+    proto -- Protocol of the sockets in the table
+    ret_format -- Format of the row fields, "hex" or "human_being"
+    netstat -- NetStat used to decode the "human being" fields
+    """
+
+    def __init__(self, proto, ret_format="hex", netstat=None):
+        self.proto = proto
+        self.family = PROTOCOL_FAMILIES[proto]
+        self.ret_format = ret_format
+        self.netstat = netstat
+
+        # Entries of the ip columns per socket
+        self.words = 1
+        if self.family == socket.AF_INET6:
+            self.words = 4
+
+        self.paths = []
+        # Host the sockets are on, None for this one, see fleet.Fleet
+        self.host = None
+
+        for name, typecode in COLUMNS:
+            setattr(self, name, array(typecode))
+
+        self._format_row = self._build_row_formatter()
+
+    def __len__(self):
+        return len(self.sl)
+
+    def __iter__(self):
+        return itertools.imap(SocketRow, itertools.repeat(self),
+                              xrange(len(self.sl)))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.sl)
+        if index < 0 or index >= len(self.sl):
+            raise IndexError("socket table index out of range")
+
+        return SocketRow(self, index)
+
+    def append(self, sl, local_ip, local_port, rem_ip, rem_port, state,
+               tx_queue, rx_queue, timer, when, retrnsmt, uid, timeout,
+               inode):
+        self.sl.append(sl)
+        if self.words == 1:
+            self.local_ip.append(local_ip)
+            self.rem_ip.append(rem_ip)
+        else:
+            self.local_ip.extend(local_ip)
+            self.rem_ip.extend(rem_ip)
+        self.local_port.append(local_port)
+        self.rem_port.append(rem_port)
+        self.state.append(state)
+        self.tx_queue.append(tx_queue)
+        self.rx_queue.append(rx_queue)
+        self.timer.append(timer)
+        self.when.append(when)
+        self.retrnsmt.append(retrnsmt)
+        self.uid.append(uid)
+        self.timeout.append(timeout)
+        self.inode.append(inode)
+
+    def extend(self, columns):
+        """
+        Append sockets given as one sequence of integers per column,
+        in the COLUMNS order
+        """
+        for (name, _), values in zip(COLUMNS, columns):
+            getattr(self, name).extend(values)
+
+    def address(self, column, index):
+        """
+        Return the ip of a socket from the local_ip or rem_ip column,
+        an int for IPv4 or a tuple of the 4 words for IPv6
+        """
+        if self.words == 1:
+            return column[index]
+
+        return tuple(column[index * 4:index * 4 + 4])
+
+    def addresses(self, column):
+        """
+        Return the ips of all the sockets from the local_ip or rem_ip
+        column, as address() does
+        """
+        if self.words == 1:
+            return column
+
+        words = iter(column)
+        return list(zip(words, words, words, words))
+
+    def keys(self):
+        """
+        Returns:
+        Return the (proto, local ip, local port, remote ip, remote port,
+        inode) of every socket, identifying them across collections.
+        The host is added first for the tables of another host.
+        """
+        columns = [itertools.repeat(self.proto, len(self.sl)),
+                   self.addresses(self.local_ip), self.local_port,
+                   self.addresses(self.rem_ip), self.rem_port, self.inode]
+        if self.host is not None:
+            columns.insert(0, itertools.repeat(self.host, len(self.sl)))
+
+        return list(zip(*columns))
+
+    def values(self):
+        """
+        Returns:
+        Return the (state, tx queue, rx queue, uid, pid) of every
+        socket, the fields displayed that change during the socket life
+        """
+        pids = None
+        if self.netstat is not None:
+            pids = self.netstat.pids(self.inode)
+        if pids is None:
+            pids = itertools.repeat(None, len(self.sl))
+
+        return list(zip(self.state, self.tx_queue, self.rx_queue, self.uid,
+                        pids))
+
+    def fields(self, index):
+        """
+        Format all the fields of a socket as the keys of the old row dicts
+
+        Arguments:
+        index -- The row number in the table
+
+        Returns:
+        Return the dict of the fields as strings, in the table ret_format:
+        'host', 'proto', 'sl', 'local_address', 'rem_address', 'st',
+        'tx_queue_rx_queue', 'tr_tm_when', 'retrnsmt', 'uid', 'timeout',
+        'inode' and 'program'
+        """
+        return self._format_row(index)
+
+    def _build_row_formatter(self):
+        # One function formatting a whole row, compiled from the
+        # expression of every field in the table format
+        expressions = dict(_HEX_FIELDS)
+        if self.ret_format == "human_being":
+            expressions.update(_HUMAN_FIELDS)
+            if self.words == 1:
+                expressions.update(_HUMAN_IPV4_FIELDS)
+            else:
+                expressions.update(_HUMAN_IPV6_FIELDS)
+        elif self.words != 1:
+            expressions.update(_HEX_IPV6_FIELDS)
+        if self.family == socket.AF_UNIX:
+            expressions.update(_UNIX_FIELDS)
+
+        namespace = {'table': self, 'netstat': self.netstat,
+                     'proto': self.proto, '_tuple': tuple,
+                     '_hex_bytes': _HEX_BYTES}
+        for name, _ in COLUMNS:
+            namespace[name] = getattr(self, name)
+
+        return eval("lambda index: {%s}" % ", ".join(
+            "%r: %s" % item for item in sorted(expressions.items())
+        ), namespace)
+
+
+# The bytes as 2 hex digits, the state and the timer columns
+_HEX_BYTES = tuple("%02X" % byte for byte in range(256))
+
+# Expression of every field of a row, in the namespace of
+# SocketTable._build_row_formatter(), the columns as arrays
+_HEX_FIELDS = {
+    'host': 'table.host or ""',
+    'proto': 'proto',
+    'sl': '"%d:" % sl[index]',
+    'local_address': '"%08X:%04X" % (local_ip[index], local_port[index])',
+    'rem_address': '"%08X:%04X" % (rem_ip[index], rem_port[index])',
+    'st': '_hex_bytes[state[index]]',
+    'tx_queue_rx_queue': '"%08X:%08X" % (tx_queue[index], rx_queue[index])',
+    'tr_tm_when': '_hex_bytes[timer[index]] + ":%08X" % when[index]',
+    'retrnsmt': '"%08X" % retrnsmt[index]',
+    'uid': 'str(uid[index])',
+    'timeout': 'str(timeout[index])',
+    'inode': 'str(inode[index])',
+    'program': 'netstat.program(inode[index])',
+}
+
+_HEX_IPV6_FIELDS = {
+    'local_address': '"%08X%08X%08X%08X:%04X" % (_tuple('
+                     'local_ip[index * 4:index * 4 + 4]) + '
+                     '(local_port[index],))',
+    'rem_address': '"%08X%08X%08X%08X:%04X" % (_tuple('
+                   'rem_ip[index * 4:index * 4 + 4]) + (rem_port[index],))',
+}
+
+_HUMAN_FIELDS = {
+    'st': 'netstat.conn_status[str(state[index])]',
+    'tx_queue_rx_queue': '"%d:%d" % (rx_queue[index], tx_queue[index])',
+    'uid': 'netstat.username(uid[index])',
+}
+
+# The remote address of the listening sockets is 0.0.0.0:* or :::*
+_HUMAN_IPV4_FIELDS = {
+    'local_address': 'netstat.human_address(local_ip[index], '
+                     'local_port[index])',
+    'rem_address': '"0.0.0.0:*" if rem_port[index] == 0 and '
+                   'rem_ip[index] == 0 else '
+                   'netstat.human_host(rem_ip[index], rem_port[index])',
+}
+
+_HUMAN_IPV6_FIELDS = {
+    'local_address': 'netstat.human_address(_tuple('
+                     'local_ip[index * 4:index * 4 + 4]), local_port[index])',
+    'rem_address': '":::*" if rem_port[index] == 0 and '
+                   'not any(rem_ip[index * 4:index * 4 + 4]) else '
+                   'netstat.human_host(_tuple('
+                   'rem_ip[index * 4:index * 4 + 4]), rem_port[index])',
+}
+
+# Unix sockets have paths instead of addresses, and no owner
+_UNIX_FIELDS = {
+    'local_address': 'table.paths[index]',
+    'rem_address': '""',
+    'uid': '""',
+}
+
+
+def _column(name):
+    return property(lambda self: getattr(self.table, name)[self.index])
+
+
+def _address_column(name):
+    return property(
+        lambda self: self.table.address(getattr(self.table, name),
+                                        self.index)
+    )
+
+
+class SocketRow(dict):
+    """
+    View of one socket of a SocketTable
+
+    row['local_address'] returns the formatted field, as the old row
+    dicts, while row.local_port returns the integer column value.
+    Nothing is formatted before a field is accessed, the whole row is
+    formatted then and the next fields are plain dict lookups.
+    """
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        dict.__init__(self)
+        self.table = table
+        self.index = index
+
+    def __missing__(self, key):
+        if self:
+            raise KeyError(key)
+        self.update(self.table.fields(self.index))
+        return self[key]
+
+
+for _name, _typecode in COLUMNS:
+    if _name in ('local_ip', 'rem_ip'):
+        setattr(SocketRow, _name, _address_column(_name))
+    else:
+        setattr(SocketRow, _name, _column(_name))
+
+
+class SnapshotDelta:
+    """
+    Sockets added, removed and changed between two collections
+
+    Arguments:
+    tables -- The SocketTables of the new collection
+    keys -- Key of every socket of the tables, in the tables order
+    added -- Indexes in keys of the sockets not seen before
+    removed -- Keys of the sockets gone since the previous collection
+    changed -- Indexes in keys of the sockets whose state, queues or
+               user changed
+    interval -- Seconds since the previous collection, None for the
+                first
+    snapshot -- The values of SocketTable.values() of every socket, by
+                key, None if not known
+    """
+
+    def __init__(self, tables, keys, added, removed, changed, interval,
+                 snapshot=None):
+        self.tables = tables
+        self.keys = keys
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.interval = interval
+        self.snapshot = snapshot
+
+        # Index in keys of the first socket of every table
+        self._offsets = []
+        offset = 0
+        for table in tables:
+            self._offsets.append(offset)
+            offset += len(table)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def locate(self, index):
+        """
+        Returns:
+        Return the (SocketTable, row number) of the socket of an index
+        of keys
+        """
+        position = bisect.bisect_right(self._offsets, index) - 1
+        return self.tables[position], index - self._offsets[position]
+
+    def row(self, index):
+        """
+        Returns:
+        Return the SocketRow of the socket of an index of keys
+        """
+        table, row = self.locate(index)
+        return SocketRow(table, row)
+
+    def churn(self):
+        """
+        Returns:
+        Return the connections opened and closed per second
+        """
+        if not self.interval:
+            return 0.0, 0.0
+
+        return (len(self.added) / self.interval,
+                len(self.removed) / self.interval)
@@ -0,0 +1,172 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Where the /proc/net tables are read from
+
+Captures of another machine are read from a copy of its tables: one
+file, a directory as made by "cp /proc/net/tcp* /proc/net/udp* dir/",
+or a tarball of such a directory. The counters of dev, snmp and
+netstat are read from the directory or tarball when copied too.
+"""
+
+import mmap
+import os
+import tarfile
+
+from counters import COUNTER_FILES
+
+
+class ProcSource:
+    """
+    The tables of the running kernel
+
+    Arguments:
+    root -- Directory of the tables
+    """
+
+    offline = False
+
+    def __init__(self, root="/proc/net"):
+        self.root = root
+
+    def read(self, proto):
+        """
+        Returns:
+        Return the whole table of a protocol as a string
+        """
+        # Read the whole table at once, the kernel builds it per read()
+        with open(os.path.join(self.root, proto), "r") as fd:
+            return fd.read()
+
+
+class DirectorySource:
+    """
+    Tables captured in a directory, named as in /proc/net
+
+    The files are mapped in memory, the parser reads them without a
+    copy. A missing table is read as empty.
+
+    Arguments:
+    path -- The directory, or the directory holding net/ of a captured
+            /proc
+    """
+
+    offline = True
+
+    def __init__(self, path):
+        if os.path.isdir(os.path.join(path, "net")):
+            path = os.path.join(path, "net")
+        self.path = path
+
+    def read(self, proto):
+        """
+        Returns:
+        Return the table of a protocol as an mmap, "" if not captured
+        """
+        return _map(os.path.join(self.path, proto))
+
+
+class FileSource:
+    """
+    One table captured in a file, of the protocol it is named after or
+    tcp by default
+
+    Arguments:
+    path -- The file
+    proto -- Protocol of the table, None to guess it from the name
+    """
+
+    offline = True
+
+    def __init__(self, path, proto=None):
+        self.path = path
+        self.proto = proto or os.path.basename(path)
+
+    def read(self, proto):
+        if proto != self.proto and \
+                not (proto == "tcp" and not _is_protocol(self.proto)):
+            return ""
+
+        return _map(self.path)
+
+
+class TarSource:
+    """
+    Tables captured in a tarball, found by their file name whatever
+    the directory they are in
+
+    The tables are decompressed once and kept in memory.
+
+    Arguments:
+    path -- The tarball, compressed or not
+    """
+
+    offline = True
+
+    def __init__(self, path):
+        self.path = path
+        self.tables = {}
+        with tarfile.open(path) as tar:
+            for member in tar.getmembers():
+                name = os.path.basename(member.name)
+                if member.isfile() and name not in self.tables and \
+                        (_is_protocol(name) or name in COUNTER_FILES):
+                    self.tables[name] = tar.extractfile(member).read()
+
+    def read(self, proto):
+        return self.tables.get(proto, "")
+
+
+def _is_protocol(name):
+    # Imported here, netstat imports this module
+    from netstat import PROTOCOLS
+    return name in PROTOCOLS
+
+
+def _map(path):
+    try:
+        with open(path, "rb") as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return ""
+            return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except IOError:
+        return ""
+
+
+def open_source(path):
+    """
+    Open the source of the tables at a path, see the source classes
+
+    Arguments:
+    path -- A file, directory or tarball, None for /proc/net
+
+    Raises IOError when the path can't be read.
+    """
+    if path is None:
+        return ProcSource()
+
+    if os.path.isdir(path):
+        return DirectorySource(path)
+
+    if not os.path.isfile(path):
+        raise IOError("no such file or directory: %s" % path)
+
+    if tarfile.is_tarfile(path):
+        return TarSource(path)
+
+    return FileSource(path)
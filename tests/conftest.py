@@ -0,0 +1,162 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Fixtures of the tests: /proc/net tables generated in a directory, read
+as "netpath --source" reads a capture
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+# The modules are at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from benchmark import make_net_tcp
+from netstat import NetStat
+from source import DirectorySource
+
+# Sockets of the generated tcp table, the other tables hold fewer
+TCP_LINES = 2000
+
+NET_TCP6_HEADER = "  sl  local_address                         " \
+    "remote_address                        st tx_queue rx_queue tr " \
+    "tm->when retrnsmt   uid  timeout inode\n"
+
+NET_TCP6_LINE = "%4d: %s:%04X %s:%04X %02X %08X:%08X 00:00000000 " \
+    "00000000 %5d        0 %d 1 0000000000000000 100 0 0 10 0\n"
+
+NET_UNIX_HEADER = "Num       RefCount Protocol Flags    Type St Inode Path\n"
+
+NET_UNIX_LINE = "0000000000000000: 00000002 00000000 %08X 0001 %02X %d%s\n"
+
+
+def make_net_tcp6(lines, seed=0):
+    """
+    Build a synthetic /proc/net/tcp6 table, a part of the addresses
+    IPv4 mapped
+
+    Arguments:
+    lines -- Number of sockets in the table
+    seed -- Seed used to generate the sockets, same seed same table
+
+    Returns:
+    Return the table as a string
+    """
+    rand = random.Random(seed)
+
+    def address():
+        if rand.random() < 0.25:
+            return "0000000000000000FFFF0000%08X" % rand.randint(
+                0, 0xFFFFFFFF)
+        return "%08X%08X%08X%08X" % tuple(
+            rand.randint(0, 0xFFFFFFFF) for _ in range(4))
+
+    local_ips = [address() for _ in range(4)]
+    rem_ips = [address() for _ in range(100)]
+    table = [NET_TCP6_HEADER]
+    for sl in range(lines):
+        table.append(NET_TCP6_LINE % (
+            sl,
+            rand.choice(local_ips), rand.randint(1, 0xFFFF),
+            rand.choice(rem_ips), rand.randint(1, 0xFFFF),
+            rand.randint(1, 11),
+            rand.randint(0, 0xFFFF), rand.randint(0, 0xFFFF),
+            rand.choice((0, 1000)),
+            rand.randint(1, 0xFFFFFFF)
+        ))
+
+    return "".join(table)
+
+
+def make_net_unix(lines, seed=0):
+    """
+    Build a synthetic /proc/net/unix table, listening and connected
+    sockets, with and without a path
+    """
+    rand = random.Random(seed)
+    table = [NET_UNIX_HEADER]
+    for number in range(lines):
+        listening = rand.random() < 0.2
+        table.append(NET_UNIX_LINE % (
+            0x10000 if listening else 0,
+            1 if listening else 3,
+            rand.randint(1, 0xFFFFFFF),
+            " /run/socket%d" % number if rand.random() < 0.5 else ""
+        ))
+
+    return "".join(table)
+
+
+def write_proc_net(path, seed=0, lines=TCP_LINES):
+    """
+    Write the tcp, tcp6 and unix tables in a directory, as copied from
+    /proc/net
+    """
+    for proto, content in (("tcp", make_net_tcp(lines, seed)),
+                           ("tcp6", make_net_tcp6(lines // 4, seed)),
+                           ("unix", make_net_unix(lines // 10, seed))):
+        with open(os.path.join(path, proto), "w") as fd:
+            fd.write(content)
+
+
+def churn_net_tcp(path, seed=1):
+    """
+    Turn the tcp table of a directory into the one of a next
+    collection: a third of the sockets changed, a third closed and as
+    many opened
+    """
+    path = os.path.join(path, "tcp")
+    with open(path) as fd:
+        lines = fd.readlines()
+    header, lines = lines[0], lines[1:]
+
+    kept = []
+    for number, line in enumerate(lines):
+        if number % 3 == 0:
+            # State, tx_queue and rx_queue
+            line = line[:34] + "%02X 00000000:%08X" % (
+                number % 11 + 1, number + seed) + line[54:]
+        if number % 3 != 1:
+            kept.append(line)
+    opened = make_net_tcp(len(lines) // 3, seed).splitlines(True)[1:]
+
+    with open(path, "w") as fd:
+        fd.write("".join([header] + kept + opened))
+
+
+@pytest.fixture
+def proc_net(tmpdir):
+    """
+    Directory of the generated tables
+    """
+    write_proc_net(str(tmpdir))
+    return str(tmpdir)
+
+
+@pytest.fixture
+def netstat(proc_net):
+    """
+    NetStat reading the generated tables
+    """
+    netstat = NetStat(source=DirectorySource(proc_net))
+    yield netstat
+    netstat.close()
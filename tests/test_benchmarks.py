@@ -0,0 +1,110 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+"""
+Timings of the parser, the diff of two collections and the rendering of
+a screen, compared between runs by pytest-benchmark:
+
+    python -m pytest tests/test_benchmarks.py --benchmark-autosave
+    python -m pytest tests/test_benchmarks.py --benchmark-compare
+"""
+
+import os
+import pty
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmark import make_net_tcp
+from netpath import FormatDisplay, NetPath
+from netstat import NetStat
+from socketfilter import SocketFilter
+
+# Sockets of the tables timed
+SIZES = (1000, 10000, 100000)
+
+# Filter of the parser timed, pushed down to the regex and the hex fields
+FILTER_EXPRESSION = "state established and port 1-1024"
+
+
+@pytest.fixture(scope="module", params=SIZES)
+def content(request):
+    return make_net_tcp(request.param)
+
+
+@pytest.fixture
+def view(monkeypatch):
+    # The screen reads the settings of a terminal on stdin
+    master, slave = pty.openpty()
+    monkeypatch.setattr(sys, "stdin", os.fdopen(slave))
+    yield NetPath()
+    os.close(master)
+
+
+@pytest.mark.parametrize("ret_format", ["hex", "human_being"])
+def test_parse(benchmark, content, ret_format):
+    netstat = NetStat()
+    table = benchmark(netstat.parse_net_tcp, content, ret_format)
+    assert len(table) == content.count("\n") - 1
+
+
+def test_parse_filtered(benchmark, content):
+    netstat = NetStat()
+    socket_filter = SocketFilter("expression", FILTER_EXPRESSION,
+                                 netstat.conn_status)
+    benchmark(netstat.parse_net_tcp, content, "hex", socket_filter)
+
+
+def test_diff(benchmark, content):
+    netstat = NetStat()
+    table = netstat.parse_net_tcp(content, "hex")
+    # The next collection, 1% of the sockets replaced
+    lines = content.splitlines(True)
+    churn = max(len(lines) // 100, 1)
+    next_table = netstat.parse_net_tcp("".join(
+        lines[:-churn] + make_net_tcp(churn, seed=1).splitlines(True)[1:]),
+        "hex")
+    netstat.delta([table])
+
+    def diff():
+        # Two collections, the snapshot ends as it started
+        netstat.delta([next_table])
+        return netstat.delta([table])
+
+    delta = benchmark(diff)
+    assert len(delta.added) == len(delta.removed) == churn
+
+
+def test_render(benchmark, content, view):
+    netstat = NetStat()
+    view.output_format = FormatDisplay.HUMAN_BEING
+    delta = netstat.delta([netstat.parse_net_tcp(content, "human_being")])
+
+    def format_line(position):
+        return view.format_line(delta.row(position))
+
+    def render():
+        # A screen of sockets never shown, drawn over a cleared terminal
+        view.frame = None
+        lines = {}
+        view.render(lines, delta.keys, format_line)
+        return lines
+
+    lines = benchmark(render)
+    assert len(lines) == min(view.page_size(), len(delta.keys))
@@ -0,0 +1,89 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+import pytest
+
+from benchmark import FILTER_EXPRESSIONS, NET_TCP_KEYS, \
+    legacy_collect_net_tcp
+from conftest import TCP_LINES
+from netstat import parse_net
+from socketfilter import SocketFilter
+
+
+@pytest.mark.parametrize("ret_format", ["hex", "human_being"])
+def test_fields_as_legacy_parser(netstat, ret_format):
+    content = netstat.read("tcp")[:]
+    table = netstat.parse_net_tcp(content, ret_format)
+    expected = legacy_collect_net_tcp(netstat.conn_status,
+                                      content.splitlines(True), ret_format)
+
+    assert len(table) == len(expected) == TCP_LINES
+    for row, fields in zip(table, expected):
+        # The legacy parser kept the columns after the inode with it
+        fields['inode'] = fields['inode'].split()[0]
+        assert dict((key, row[key]) for key in NET_TCP_KEYS) == \
+            dict((key, fields[key]) for key in NET_TCP_KEYS)
+
+
+def test_mmap_parsed_as_string(netstat):
+    # The directory source maps the files, they are parsed in place
+    content = netstat.read("tcp6")
+    assert not isinstance(content, str)
+    assert parse_net("tcp6", content).keys() == \
+        parse_net("tcp6", content[:]).keys()
+
+
+def test_chunks(netstat, monkeypatch):
+    content = netstat.read("tcp")
+    keys = parse_net("tcp", content).keys()
+    # A chunk of a few lines, the lines cut must be parsed once
+    monkeypatch.setattr("netstat.PARSE_CHUNK_SIZE", 1000)
+    assert parse_net("tcp", content).keys() == keys
+
+
+def test_collect(netstat):
+    tables = netstat.collect(["tcp", "tcp6", "unix"], "hex")
+
+    assert [table.proto for table in tables] == ["tcp", "tcp6", "unix"]
+    assert [len(table) for table in tables] == \
+        [TCP_LINES, TCP_LINES // 4, TCP_LINES // 10]
+    # A table not captured is empty
+    assert len(netstat.collect(["udp"], "hex")[0]) == 0
+
+
+@pytest.mark.parametrize("expression", FILTER_EXPRESSIONS + (
+    "port 22 or rem_port 1-1024",
+    "not state established and user 0",
+    "ip ::ffff:0.0.0.0/96 or rx_queue > 60000",
+))
+def test_filter_pushdown(netstat, expression):
+    socket_filter = SocketFilter("expression", expression,
+                                 netstat.conn_status)
+    for proto in ("tcp", "tcp6", "unix"):
+        content = netstat.read(proto)
+        table = parse_net(proto, content)
+        match = socket_filter.match_family(table.family)
+        expected = [key for key, fields in zip(table.keys(), zip(
+            table.state, table.addresses(table.local_ip), table.local_port,
+            table.addresses(table.rem_ip), table.rem_port, table.uid,
+            table.tx_queue, table.rx_queue))
+            if match is None or match(*fields)]
+
+        # The sockets filtered out by the parser are the ones match()
+        # rejects
+        assert parse_net(proto, content,
+                         socket_filter=socket_filter).keys() == expected
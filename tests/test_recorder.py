@@ -0,0 +1,118 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+import os
+import time
+
+import pytest
+
+import recorder
+from conftest import churn_net_tcp
+from recorder import Recorder, Replay
+from socketfilter import SocketFilter
+
+PROTOCOLS = ["tcp", "tcp6", "unix"]
+
+
+def _sockets(tables):
+    # What a recording keeps of the sockets, by protocol
+    return dict((table.proto, sorted(zip(table.keys(), table.values())))
+                for table in tables if len(table))
+
+
+def _collections(netstat, proc_net, count, socket_filter=None):
+    # The deltas of count collections of a changing tcp table
+    deltas = []
+    for number in range(count):
+        if number:
+            churn_net_tcp(proc_net, seed=number)
+        deltas.append(netstat.delta(netstat.collect(PROTOCOLS, "hex",
+                                                    socket_filter)))
+    return deltas
+
+
+def _record(path, deltas, socket_filter=None, started=1):
+    # Record the deltas, the writer started after the first ones, the
+    # queue then waited for
+    writer = Recorder(path)
+    for position, delta in enumerate(deltas):
+        writer.record(delta, socket_filter)
+        if position + 1 == started:
+            writer.start()
+        while writer._thread is not None and not writer._queue.empty():
+            time.sleep(0.01)
+    writer.stop()
+
+
+def _replayed(path):
+    replay = Replay(path)
+    collections = [_sockets(replay.collect(PROTOCOLS, "hex"))
+                   for _ in range(len(replay))]
+    replay.close()
+    return collections
+
+
+@pytest.fixture
+def path(tmpdir):
+    return os.path.join(str(tmpdir), "recording")
+
+
+def test_round_trip(netstat, proc_net, path, monkeypatch):
+    # Stepped back from a FULL record every 4 collections
+    monkeypatch.setattr(recorder, "KEYFRAME_INTERVAL", 4)
+    deltas = _collections(netstat, proc_net, 10)
+    _record(path, deltas)
+
+    expected = [_sockets(delta.tables) for delta in deltas]
+    assert _replayed(path) == expected
+
+    replay = Replay(path)
+    assert replay.keyframes == [0, 4, 8]
+    replay.seek(6)
+    assert _sockets(replay.collect(PROTOCOLS, "hex")) == expected[6]
+    # Paused by a step
+    replay.step(-5)
+    assert _sockets(replay.collect(PROTOCOLS, "hex")) == expected[1]
+    assert _sockets(replay.collect(PROTOCOLS, "hex")) == expected[1]
+    replay.step(2)
+    replay.step(1)
+    assert _sockets(replay.collect(PROTOCOLS, "hex")) == expected[4]
+    replay.close()
+
+
+def test_dropped_collection(netstat, proc_net, path, monkeypatch):
+    monkeypatch.setattr(recorder, "QUEUE_SIZE", 1)
+    deltas = _collections(netstat, proc_net, 6)
+    # The second collection finds the first one still queued
+    _record(path, deltas, started=2)
+
+    # The record after the drop restarts from all the sockets, the
+    # ones after it apply on them
+    kept = deltas[:1] + deltas[2:]
+    assert _replayed(path) == [_sockets(delta.tables) for delta in kept]
+    assert Replay(path).keyframes == [0, 1]
+
+
+def test_filter(netstat, proc_net, path):
+    socket_filter = SocketFilter("expression", "state established",
+                                 netstat.conn_status)
+    deltas = _collections(netstat, proc_net, 3)
+    _record(path, deltas, socket_filter=socket_filter)
+
+    expected = [_sockets(netstat.delta(netstat.collect(
+        PROTOCOLS, "hex", socket_filter)).tables)]
+    assert _replayed(path)[-1:] == expected
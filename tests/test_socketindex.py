@@ -0,0 +1,75 @@
+# Copyright (C) 2014
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.  A copy of the GNU General Public License is
+# also available at http://www.gnu.org/copyleft/gpl.html.
+
+import pytest
+
+from benchmark import FILTER_EXPRESSIONS
+from conftest import churn_net_tcp
+from socketfilter import SocketFilter
+from socketindex import SocketIndex
+
+EXPRESSIONS = FILTER_EXPRESSIONS + (
+    "port 22 or rem_port 1-1024",
+    "not state established and user 0",
+    "ip ::ffff:0.0.0.0/96 or rx_queue > 60000",
+    "state listen and not port 1-30000",
+)
+
+PROTOCOLS = ["tcp", "tcp6", "unix"]
+
+
+def _matched(tables, socket_filter):
+    # The keys of the sockets SocketFilter.match() accepts
+    keys = set()
+    for table in tables:
+        match = socket_filter.match_family(table.family)
+        for key, fields in zip(table.keys(), zip(
+                table.state, table.addresses(table.local_ip),
+                table.local_port, table.addresses(table.rem_ip),
+                table.rem_port, table.uid, table.tx_queue,
+                table.rx_queue)):
+            if match is None or match(*fields):
+                keys.add(key)
+    return keys
+
+
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_select_as_match(netstat, proc_net, expression):
+    socket_filter = SocketFilter("expression", expression,
+                                 netstat.conn_status)
+    index = SocketIndex()
+    tables = netstat.collect(PROTOCOLS, "hex")
+    index.update(netstat.delta(tables))
+    assert index.select(socket_filter) == _matched(tables, socket_filter)
+
+    # The indexes built are kept up to date by the next collection
+    churn_net_tcp(proc_net)
+    tables = netstat.collect(PROTOCOLS, "hex")
+    delta = netstat.delta(tables)
+    assert delta.added and delta.removed and delta.changed
+    index.update(delta)
+    assert index.select(socket_filter) == _matched(tables, socket_filter)
+
+
+def test_select_all(netstat):
+    index = SocketIndex()
+    tables = netstat.collect(PROTOCOLS, "hex")
+    index.update(netstat.delta(tables))
+
+    assert len(index) == sum(len(table) for table in tables)
+    assert index.select(None) == set(key for table in tables
+                                     for key in table.keys())
@@ -15,7 +15,9 @@
 # MA  02110-1301, USA.  A copy of the GNU General Public License is
 # also available at http://www.gnu.org/copyleft/gpl.html.
 
+import heapq
 import struct
+import time
 
 def split_string(string, step_chars):
     """
@@ -34,3 +36,62 @@ def hex_to_dec(hex_number):
     """
 
     return int(hex_number, 16)
+
+
+class LRUCache:
+    """
+    Bounded cache evicting the least recently used entries
+
+    Hits only stamp the entry, the eviction of the oldest quarter is
+    done in one go when the cache gets full.
+
+    Arguments:
+    maxsize -- Max number of entries kept
+    ttl -- Seconds an entry is valid, None means forever
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._tick = 0
+        self._data = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or \
+                (entry[1] is not None and entry[1] < time.time()):
+            self.misses += 1
+            return default
+
+        self._tick += 1
+        entry[2] = self._tick
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        # ttl -- Seconds the entry is valid, the ttl of the cache if None
+        if ttl is None:
+            ttl = self.ttl
+        expire = None
+        if ttl is not None:
+            expire = time.time() + ttl
+
+        self._tick += 1
+        self._data[key] = [value, expire, self._tick]
+        if len(self._data) > self.maxsize:
+            self._evict(len(self._data) - self.maxsize * 3 // 4)
+
+    def clear(self):
+        self._data.clear()
+
+    def _evict(self, count):
+        oldest = heapq.nsmallest(
+            count, self._data.items(), key=lambda item: item[1][2]
+        )
+        for key, _ in oldest:
+            del self._data[key]